@@ -2,7 +2,8 @@
 # Start: python3 app.py  →  http://127.0.0.1:5000/
 import os
 import sqlite3
-import json, time
+import json, time, math, base64, threading
+from datetime import date, datetime, timedelta
 from pywebpush import webpush, WebPushException
 from py_vapid import Vapid
 from flask import Flask, request, redirect, url_for, render_template_string
@@ -11,6 +12,16 @@ from providers.ka_stats import fetch_ka_stats
 from providers.autoscout_stats import fetch_autoscout_stats
 from providers.carwow_stats import fetch_carwow_stats, build_carwow_search_url
 from flask import send_from_directory, make_response
+from planner import DEFAULT_VIEW_FILTERS
+import dbpool
+import writer
+import archive
+import replication
+from migrations import migrate, has_fulltext, has_geo_index
+import geo
+from vehicle import parse_registration
+from db import data_generation, listing_details, latest_event_seq, sync_lease, lease_status
+import snapshot
 
 VAPID_PUBLIC = os.environ.get("VAPID_PUBLIC_KEY", "")
 VAPID_PRIVATE_PEM = os.environ.get("VAPID_PRIVATE_KEY_PEM", "")
@@ -23,6 +34,14 @@ PUSH_SUBJECT = os.environ.get("PUSH_SUBJECT", "mailto:noreply@example.com")
 APP_TITLE = "Autoscan"
 DB_PATH = os.environ.get("AUTOS_DB", "autos.db")
 PER_PAGE_DEFAULT = 50
+PER_PAGE_MAX = 200
+# Trefferzahl: exact = immer COUNT(*), estimate = immer gedeckelt,
+# auto = deckeln nur bei Filtern, die ohnehin die ganze Tabelle scannen
+COUNT_MODE = os.environ.get("COUNT_MODE", "auto")
+COUNT_ESTIMATE_CAP = int(os.environ.get("COUNT_ESTIMATE_CAP", "1000"))
+COUNT_CACHE_MAX = 512
+# Spaltenweiser Schnappschuss (snapshot.py) für Filter/Zählung/Sortierung; braucht numpy
+SNAPSHOT_ENABLED = snapshot.available() and os.environ.get("AUTOS_SNAPSHOT", "1") != "0"
 
 app = Flask(__name__)
 
@@ -62,8 +81,9 @@ def add_no_cache_headers(resp):
     resp.headers["Expires"] = "0"
     return resp
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+def get_db(readonly=False):
+    # Verbindung aus dem Prozess-Pool; readonly → PRAGMA query_only
+    conn = dbpool.connect(DB_PATH, readonly=readonly)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -72,76 +92,21 @@ KA_AREA_CODE  = os.environ.get("KA_AREA_CODE", "l5510")
 KA_RADIUS_KM  = int(os.environ.get("KA_RADIUS", "100"))
 
 
+FTS_ENABLED = False  # wird in init_db() gesetzt
+GEO_INDEX = False    # R*Tree listings_geo vorhanden (init_db)
+
+
 def init_db():
     try:
         print(f"[i] DB_PATH = {DB_PATH}, exists = {os.path.exists(DB_PATH)}, cwd = {os.getcwd()}", file=sys.stderr, flush=True)
-        conn = get_db(); cur = conn.cursor()
-        cur.execute("""CREATE TABLE IF NOT EXISTS listings(
-            id TEXT PRIMARY KEY,
-            title TEXT,
-            price_eur INTEGER,
-            km INTEGER,
-            postal_code TEXT,
-            city TEXT,
-            posted_at TEXT,
-            pics INTEGER,
-            url TEXT,
-            platform TEXT,
-            last_seen TEXT,
-            ez_text TEXT,
-            brand TEXT,
-            model TEXT,
-            fuel TEXT,
-            gearbox TEXT,
-            first_reg TEXT,
-            description TEXT,
-            image_urls_json TEXT
-        )""")
-        cur.execute("""CREATE TABLE IF NOT EXISTS listing_prices(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            listing_id TEXT,
-            price_eur INTEGER,
-            seen_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )""")
-        cur.execute("""CREATE TABLE IF NOT EXISTS push_subscriptions(
-            id INTEGER PRIMARY KEY,
-            endpoint TEXT UNIQUE,
-            p256dh TEXT, auth TEXT,
-            filters TEXT,
-            max_price INTEGER,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )""")
-        cur.execute("""CREATE TABLE IF NOT EXISTS push_sent(
-            endpoint TEXT NOT NULL,
-            listing_id TEXT NOT NULL,
-            sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (endpoint, listing_id)
-        )""")
-        # --- Favorites ---
-        cur.execute("""CREATE TABLE IF NOT EXISTS favorites(
-            listing_id TEXT PRIMARY KEY,
-            status TEXT DEFAULT 'interessant',
-            note TEXT DEFAULT '',
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )""")
-        # --- Deal Score Cache ---
-        cur.execute("""CREATE TABLE IF NOT EXISTS deal_scores(
-            listing_id TEXT PRIMARY KEY,
-            score INTEGER DEFAULT 0,
-            ka_avg INTEGER,
-            as_avg INTEGER,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )""")
-        # --- Mobile.de Preis-Cache (vom Bookmarklet befüllt) ---
-        cur.execute("""CREATE TABLE IF NOT EXISTS mobile_price_cache(
-            url_hash TEXT PRIMARY KEY,
-            search_url TEXT,
-            count INTEGER,
-            avg_price INTEGER,
-            prices_json TEXT,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )""")
-        conn.commit(); conn.close()
+        global FTS_ENABLED, GEO_INDEX
+        conn = get_db()
+        migrate(conn, DB_PATH)
+        FTS_ENABLED = has_fulltext(conn)
+        GEO_INDEX = has_geo_index(conn)
+        replication.setup(conn)
+        conn.close()
+        replication.start()
         print("[i] Datenbank-Tabellen initialisiert", file=sys.stderr, flush=True)
     except Exception as e:
         print(f"[!] DB-Init Fehler: {e}", file=sys.stderr, flush=True)
@@ -157,11 +122,41 @@ def parse_int(v, default=None):
         return default
 
 
+def fts_query(q):
+    """Freitext → FTS5-Query: jedes Wort als Präfix, alle müssen vorkommen."""
+    words = re.findall(r"\w+", q or "")
+    return " ".join(f'"{w}"*' for w in words)
+
+
+DUP_COUNT_SQL = "(SELECT COUNT(*) FROM listings d WHERE d.fingerprint = listings.fingerprint) AS dup_count"
+
+
+def posted_since(days):
+    """posted_days → Epoch ab Mitternacht (Ortszeit) vor so vielen Tagen, sonst None."""
+    days = parse_int(days)
+    if days is None or days < 0:
+        return None
+    return int(datetime.combine(date.today() - timedelta(days=days), datetime.min.time()).timestamp())
+
+
 def build_query(params):
     where = []
     args = []
 
-    if params.get("q"):
+    sort = params.get("sort", "posted_desc")
+    fts_q = fts_query(params.get("q")) if FTS_ENABLED else ""
+    fts_join = ""
+    fts_where = "rid IN (SELECT rowid FROM listings_fts WHERE listings_fts MATCH ?)"
+    if fts_q and sort == "relevance":
+        # Relevanz: FTS treibt die Abfrage, bm25 (kleiner = besser, Titel zählt
+        # am meisten) wird einmal pro Treffer berechnet statt je Zeile neu zu matchen
+        fts_join = ("JOIN (SELECT rowid AS fts_rowid, bm25(listings_fts, 10.0, 1.0, 2.0) AS fts_rank "
+                    "FROM listings_fts WHERE listings_fts MATCH ?) AS fts ON fts.fts_rowid = listings.rid")
+        args.append(fts_q)
+    elif fts_q:
+        where.append(fts_where)
+        args.append(fts_q)
+    elif params.get("q"):
         where.append("title LIKE ?")
         args.append(f"%{params['q']}%")
 
@@ -174,67 +169,357 @@ def build_query(params):
         where.append("price_eur <= ?")
         args.append(pmax)
 
+    # ez_year wird beim Ingest gesetzt (vehicle.parse_registration) → indexierbar
     ez_min = parse_int(params.get("ez_min"))
     ez_max = parse_int(params.get("ez_max"))
-    if ez_min is not None or ez_max is not None:
-        ez_year_sql = """
-        CASE
-          WHEN first_reg IS NOT NULL AND length(first_reg) >= 4 THEN
-            CASE
-              WHEN substr(first_reg, 5, 1) = '-' THEN CAST(substr(first_reg, 1, 4) AS INTEGER)
-              ELSE CAST(substr(first_reg, length(first_reg)-3, 4) AS INTEGER)
-            END
-          WHEN ez_text IS NOT NULL AND length(ez_text) >= 4 THEN
-            CAST(substr(ez_text, length(ez_text)-3, 4) AS INTEGER)
-          ELSE NULL
-        END
-        """
-        if ez_min is not None:
-            where.append(f"({ez_year_sql}) >= ?")
-            args.append(ez_min)
-        if ez_max is not None:
-            where.append(f"({ez_year_sql}) <= ?")
-            args.append(ez_max)
+    if ez_min is not None:
+        where.append("ez_year >= ?")
+        args.append(ez_min)
+    if ez_max is not None:
+        where.append("ez_year <= ?")
+        args.append(ez_max)
 
     km_max = parse_int(params.get("km_max"))
     if km_max is not None:
         where.append("km <= ?")
         args.append(km_max)
 
-    plz = params.get("postal_prefix")
+    plz = (params.get("postal_prefix") or "").rstrip("%")
     if plz:
-        where.append("postal_code LIKE ?")
-        args.append(plz.rstrip("%") + "%")
+        # Bereich statt LIKE 'xx%' → nutzt idx_listings_postal
+        where.append("postal_code >= ? AND postal_code < ?")
+        args += [plz, plz[:-1] + chr(ord(plz[-1]) + 1)]
 
     city = params.get("city")
     if city:
-        where.append("city LIKE ?")
+        # LIKE nur über die wenigen Städtenamen in lookup, die Zeilen vergleichen Codes
+        where.append("city_code IN (SELECT code FROM lookup WHERE kind = 'city' AND value LIKE ?)")
         args.append(f"%{city}%")
 
+    # Umkreis um eine PLZ: Bounding-Box aus dem R*Tree, dann exakter Kreis – beide um den
+    # Fehler der Leitregionen erweitert (geo.search_radius_km), solange PLZ nur grob bekannt sind
+    near = geo.plz_centroid(params.get("near"))
+    if near:
+        radius = geo.search_radius_km(geo.radius_km(params.get("radius_km")), params.get("near"))
+        lat_min, lat_max, lon_min, lon_max = geo.bbox(near[0], near[1], radius)
+        if GEO_INDEX:
+            where.append("""rid IN (SELECT id FROM listings_geo
+                WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?)""")
+        else:
+            where.append("lat >= ? AND lat <= ? AND lon >= ? AND lon <= ?")
+        args += [lat_min, lat_max, lon_min, lon_max]
+        where.append("distance_km(lat, lon, ?, ?) <= ?")
+        args += [near[0], near[1], radius]
+
     pics_min = parse_int(params.get("pics_min"))
     if pics_min is not None:
         where.append("IFNULL(pics, 0) >= ?")
         args.append(pics_min)
 
-    posted_days = parse_int(params.get("posted_days"))
-    if posted_days is not None and posted_days >= 0:
-        where.append("posted_at IS NOT NULL AND posted_at >= date('now', ?) ")
-        args.append(f"-{posted_days} day")
+    since = posted_since(params.get("posted_days"))
+    if since is not None:
+        where.append("posted_ts >= ?")
+        args.append(since)
+
+    # Duplikate zusammenfassen: pro Fingerprint nur den Vertreter zeigen
+    # (günstigster, bei Gleichstand frischester). Gewählt wird unter den Kopien,
+    # die selbst alle Filter erfüllen – sonst fiele die Gruppe ganz weg, wenn die
+    # günstigste Kopie z. B. unter price_min liegt. Die Filter stehen unqualifiziert
+    # da und beziehen sich im Subselect daher auf d.
+    if params.get("dedupe"):
+        same, same_args = list(where), list(args)
+        if fts_join:
+            same.append(fts_where)
+            same_args = same_args[1:] + [fts_q]  # MATCH des JOINs steht in args vorn
+        where.append(f"""(fingerprint IS NULL OR id = (
+            SELECT d.id FROM listings d WHERE d.fingerprint = listings.fingerprint
+            {"".join(" AND " + w for w in same)}
+            ORDER BY (d.price_eur IS NULL), d.price_eur ASC, d.posted_ts DESC, d.last_seen_ts DESC
+            LIMIT 1))""")
+        args += same_args
 
     where_sql = ("WHERE " + " AND ".join(where)) if where else ""
 
-    sort = params.get("sort", "posted_desc")
-    order_sql = {
-        "price_asc":  "ORDER BY (price_eur IS NULL),  price_eur ASC,  last_seen DESC",
-        "price_desc": "ORDER BY (price_eur IS NULL),  price_eur DESC, last_seen DESC",
-        "km_asc":     "ORDER BY (km IS NULL),         km ASC,         last_seen DESC",
-        "km_desc":    "ORDER BY (km IS NULL),         km DESC,        last_seen DESC",
-        "posted_desc":"ORDER BY (posted_at IS NULL),  posted_at DESC, last_seen DESC",
-        "seen_desc":  "ORDER BY last_seen DESC",
-        "title_asc":  "ORDER BY title COLLATE NOCASE ASC, last_seen DESC",
-    }.get(sort, "ORDER BY (posted_at IS NULL), posted_at DESC, last_seen DESC")
+    if fts_join:
+        # where_sql beginnt hier mit dem JOIN – passt weiter hinter "FROM listings"
+        return f"{fts_join} {where_sql}".strip(), args, "ORDER BY fts.fts_rank, last_seen_ts DESC, id DESC"
+
+    if sort == "distance_asc" and near:
+        # Koordinaten aus plz_centroids (Zahlen) als Literal: Zählung und Seiten
+        # nutzen dieselben args wie das WHERE; blättern per Offset-Cursor
+        return where_sql, args, (f"ORDER BY distance_km(lat, lon, {near[0]:.6f}, {near[1]:.6f}), "
+                                 "last_seen_ts DESC, id DESC")
+
+    return where_sql, args, sort_order_sql(sort)
+
+
+# --- Trefferzahl-Cache ---
+# Schlüssel: normalisierte Filter (ohne Sortierung/Seite); gültig, solange die
+# data_generation (meta-Tabelle, von Sync/Cleanup hochgezählt) gleich bleibt.
+_count_cache = {}
+_count_lock = threading.Lock()
+
+
+def _count_key(params):
+    key = []
+    for k, v in sorted(params.items()):
+        v = " ".join(str(v or "").lower().split())
+        if k != "sort" and v:
+            key.append((k, v))
+    if params.get("posted_days"):
+        key.append(("today", date.today().isoformat()))
+    return tuple(key)
+
+
+def _count_is_expensive(params):
+    # LIKE '%…%' und der Dedupe-Subselect lassen sich nicht per Index zählen
+    return bool((params.get("q") and not (FTS_ENABLED and fts_query(params["q"])))
+                or params.get("city") or params.get("dedupe"))
+
+
+def count_listings(conn, params, where_sql, args):
+    """Trefferzahl für die Filter → (anzahl, geschätzt). Geschätzt heißt: mindestens anzahl."""
+    gen = data_generation(conn)
+    key = _count_key(params)
+    with _count_lock:
+        hit = _count_cache.get(key)
+    if hit and hit[0] == gen:
+        return hit[1], hit[2]
+
+    if COUNT_MODE == "estimate" or (COUNT_MODE == "auto" and _count_is_expensive(params)):
+        n = conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM listings {where_sql} LIMIT ?)",
+                         args + [COUNT_ESTIMATE_CAP + 1]).fetchone()[0]
+        estimated = n > COUNT_ESTIMATE_CAP
+        n = min(n, COUNT_ESTIMATE_CAP)
+    else:
+        n = conn.execute(f"SELECT COUNT(*) FROM listings {where_sql}", args).fetchone()[0]
+        estimated = False
+
+    with _count_lock:
+        if len(_count_cache) >= COUNT_CACHE_MAX:
+            _count_cache.pop(next(iter(_count_cache)))
+        _count_cache[key] = (gen, n, estimated)
+    return n, estimated
+
+
+# --- Keyset-Pagination ---
+# Je Sortierung: (Spalte, Sortierausdruck, Richtung). NULLs kommen immer ans Ende,
+# danach last_seen_ts DESC, id DESC → totale Ordnung, passend zu idx_listings_sort_*.
+SORT_KEYS = {
+    "price_asc":   ("price_eur", "price_eur", "ASC"),
+    "price_desc":  ("price_eur", "price_eur", "DESC"),
+    "km_asc":      ("km", "km", "ASC"),
+    "km_desc":     ("km", "km", "DESC"),
+    "posted_desc": ("posted_ts", "posted_ts", "DESC"),
+    "seen_desc":   (None, None, None),
+    "title_asc":   ("title", "title COLLATE NOCASE", "ASC"),
+}
+
+
+def _flip(d):
+    return "ASC" if d == "DESC" else "DESC"
+
+
+def sort_order_sql(sort, reverse=False, pinned=False):
+    """ORDER BY zur Sortierung. pinned: das WHERE legt ({col} IS NULL) per Gleichheit fest
+    (Keyset-Segmente) – dann ohne diesen Term, sonst sortiert SQLite trotz passendem Index nach."""
+    col, expr, d = SORT_KEYS.get(sort, SORT_KEYS["posted_desc"])
+    tail = "ASC" if reverse else "DESC"
+    parts = []
+    if col and pinned:
+        parts.append(f"{expr} {_flip(d) if reverse else d}")
+    elif col:
+        parts += [f"({col} IS NULL) {'DESC' if reverse else 'ASC'}",
+                  f"{expr} {_flip(d) if reverse else d}"]
+    parts += [f"last_seen_ts {tail}", f"id {tail}"]
+    return "ORDER BY " + ", ".join(parts)
+
+
+def _keyset_segments(sort, key, before=False):
+    """WHERE-Fragmente für die Zeilen nach (before: vor) `key`, in Leserichtung.
+    Jedes Fragment ist ein Index-Seek; ein zweites deckt den Sprung über die NULL-Gruppe ab.
+    Die Gruppe steht als ({col} IS NULL) = 0/1 da – die führende Spalte der idx_listings_sort_*,
+    sonst nimmt der Planer den Filter-Index (z.B. idx_listings_price) und sortiert nach.
+    Abfragen dazu mit sort_order_sql(..., pinned=True)."""
+    col, expr, d = SORT_KEYS[sort]
+    v, ls, lid = key
+    lt = ">" if before else "<"
+    tail = f"last_seen_ts {lt}= ? AND (last_seen_ts {lt} ? OR (last_seen_ts = ? AND id {lt} ?))"
+    targs = [ls, ls, ls, lid]
+    if not col:
+        return [(tail, targs)]
+    if v is None:
+        segs = [(f"({col} IS NULL) = 1 AND {tail}", targs)]
+        if before:
+            segs.append((f"({col} IS NULL) = 0", []))
+        return segs
+    op = "<" if (d == "DESC") != before else ">"
+    segs = [(f"({col} IS NULL) = 0 AND {expr} {op}= ? AND ({expr} {op} ? OR ({expr} = ? AND ({tail})))",
+             [v, v, v] + targs)]
+    if not before:
+        segs.append((f"({col} IS NULL) = 1", []))
+    return segs
+
+
+# --- Schnappschuss statt SQL ---
+# Nur rein numerische Filter/Sortierungen; Volltext, Stadt, Dedupe und Titel bleiben bei SQLite.
+SNAPSHOT_SORTS = {s for s, (col, _, _) in SORT_KEYS.items() if col != "title"}
+
+
+def snapshot_ranges(params):
+    """Filter als {Spalte: (min, max)} für snapshot.Snapshot – None, wenn einer nur per SQL geht."""
+    if params.get("q") or params.get("city") or params.get("dedupe") or params.get("near"):
+        return None
+    ranges = {}
+    for col, lo, hi in (("price_eur", "price_min", "price_max"), ("ez_year", "ez_min", "ez_max"),
+                        ("km", None, "km_max"), ("pics", "pics_min", None)):
+        lo = parse_int(params.get(lo)) if lo else None
+        hi = parse_int(params.get(hi)) if hi else None
+        if lo is not None or hi is not None:
+            ranges[col] = (lo, hi)
+    since = posted_since(params.get("posted_days"))
+    if since is not None:
+        ranges["posted_ts"] = (since, None)
+    plz = (params.get("postal_prefix") or "").rstrip("%")
+    if plz:
+        ranges["plz"] = snapshot.plz_range(plz)
+        if ranges["plz"] is None:
+            return None
+    return ranges
+
+
+def listing_snapshot(conn, params):
+    """(Schnappschuss, Filterbereiche), wenn er die Anfrage beantworten kann, sonst (None, None)."""
+    if not SNAPSHOT_ENABLED or params.get("sort", "posted_desc") not in SNAPSHOT_SORTS:
+        return None, None
+    ranges = snapshot_ranges(params)
+    if ranges is None:
+        return None, None
+    try:
+        return snapshot.current(conn, data_generation(conn)), ranges
+    except Exception as e:
+        print(f"[!] Snapshot nicht verfügbar, nutze SQL: {e}", file=sys.stderr, flush=True)
+        return None, None
+
+
+def _hydrate(cur, select_sql, ids):
+    """Zeilen zu ids aus SQLite holen, in der Reihenfolge der ids."""
+    if not ids:
+        return []
+    cur.execute(f"{select_sql} WHERE id IN ({','.join('?' * len(ids))})", ids)
+    pos = {lid: i for i, lid in enumerate(ids)}
+    return sorted(cur.fetchall(), key=lambda r: pos[r["id"]])
+
+
+# Unfall-/Schadenshinweise auf den Karten – serverseitig aus der Beschreibung, damit
+# die (gepackte) Beschreibung nicht mehr mit jeder Karte ausgeliefert wird
+WARN_WORDS = ("unfall", "unfallwagen", "unfallfahrzeug", "unfallbeschaedigt", "totalschaden", "motorschaden",
+              "getriebeschaden", "bastlerfahrzeug", "bastlerauto", "bastler", "defekt", "nicht fahrbereit",
+              "standschaden", "hagelschaden", "wasserschaden", "rahmenschaden", "verzogen", "nachlassfahrzeug",
+              "export", "schlachtung", "teilespender", "heckschaden")
 
-    return where_sql, args, order_sql
+
+def warn_word(text):
+    """Erstes Warnwort im Text (ohne "…frei"), sonst ''."""
+    text = (text or "").lower()
+    for w in WARN_WORDS:
+        if w in text and w + "frei" not in text:
+            return w
+    return ""
+
+
+def card_rows(conn, rows):
+    """Kartenzeilen um Ausstattung (Mobile-Link) und Warnwort aus listing_details ergänzen."""
+    details = listing_details(conn, [r["rid"] for r in rows])
+    out = []
+    for r in rows:
+        d = details.get(r["rid"], {})
+        out.append(dict(r, features_json=d.get("features_json"),
+                        warn=warn_word(f"{r['title'] or ''} {d.get('description') or ''}")))
+    return out
+
+
+def encode_cursor(c):
+    return base64.urlsafe_b64encode(json.dumps(c, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        c = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return c if isinstance(c, dict) else None
+    except Exception:
+        return None
+
+
+def fetch_page(cur, select_sql, where_sql, args, order_sql, sort, token, per_page, snap=None, ranges=None):
+    """Eine Seite laden → (rows, next_cursor, prev_cursor).
+
+    Keyset auf (Sortierschlüssel, last_seen_ts, id): tiefe Seiten kosten wie Seite 1 und
+    neue Inserts während eines Syncs verschieben nichts. Sortierungen ohne festen
+    Schlüssel (Relevanz) fallen auf einen Offset-Cursor zurück. Mit snap (listing_snapshot)
+    wählt der Schnappschuss die ids, SQLite liefert nur noch diese Zeilen."""
+    if sort not in SORT_KEYS and order_sql == sort_order_sql(sort):
+        sort = "posted_desc"  # unbekannte Sortierung → Standardreihenfolge
+    c = decode_cursor(token)
+    if c and c.get("s") != sort:
+        c = None
+
+    if sort not in SORT_KEYS or (c and "o" in c):
+        offset = max(parse_int(c.get("o"), 0) or 0, 0) if c else 0
+        cur.execute(f"{select_sql} {where_sql} {order_sql} LIMIT ? OFFSET ?",
+                    args + [per_page + 1, offset])
+        rows = cur.fetchall()
+        nxt = encode_cursor({"s": sort, "o": offset + per_page}) if len(rows) > per_page else None
+        prv = encode_cursor({"s": sort, "o": max(offset - per_page, 0)}) if offset > 0 else None
+        return rows[:per_page], nxt, prv
+
+    key = c.get("k") if c else None
+    if not (isinstance(key, list) and len(key) == 3):
+        key = None
+    before = bool(key and c.get("b"))
+
+    rows = []
+    snap_keys = None
+    if snap is not None:
+        col, _, d = SORT_KEYS[sort]
+        ids, keys = snap.page(ranges, col, d == "DESC", key, before, per_page + 1)
+        snap_keys = dict(zip(ids, keys))
+        rows = _hydrate(cur, select_sql, ids)
+        segments = []
+    else:
+        segments = _keyset_segments(sort, key, before) if key else [("", [])]
+    for frag, fargs in segments:
+        need = per_page + 1 - len(rows)
+        if need <= 0:
+            break
+        w = where_sql
+        if frag:
+            w = f"{w} AND ({frag})" if w else f"WHERE {frag}"
+        cur.execute(f"{select_sql} {w} {sort_order_sql(sort, reverse=before, pinned=bool(frag))} LIMIT ?",
+                    args + fargs + [need])
+        rows += cur.fetchall()
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        if not more:
+            # am Anfang angekommen → volle erste Seite statt Rest
+            return fetch_page(cur, select_sql, where_sql, args, order_sql, sort, None, per_page, snap, ranges)
+        rows.reverse()
+
+    col = SORT_KEYS[sort][0]
+
+    def key_of(r):
+        # mit Schnappschuss dessen Werte – die Seite wurde nach ihnen sortiert
+        if snap_keys is not None:
+            return snap_keys[r["id"]]
+        return [r[col] if col else None, r["last_seen_ts"], r["id"]]
+
+    nxt = encode_cursor({"s": sort, "k": key_of(rows[-1])}) if rows and (more or before) else None
+    prv = encode_cursor({"s": sort, "k": key_of(rows[0]), "b": 1}) if rows and (key or before) else None
+    return rows, nxt, prv
 
 
 @app.route("/")
@@ -242,61 +527,80 @@ def index():
   try:
     q = request.args.get("q", "")
     price_min = request.args.get("price_min", "")
-    price_max = request.args.get("price_max", "9000")
-    ez_min = request.args.get("ez_min", "2012")
+    price_max = request.args.get("price_max", DEFAULT_VIEW_FILTERS["price_max"])
+    ez_min = request.args.get("ez_min", DEFAULT_VIEW_FILTERS["ez_min"])
     ez_max = request.args.get("ez_max", "")
-    km_max = request.args.get("km_max", "100000")
+    km_max = request.args.get("km_max", DEFAULT_VIEW_FILTERS["km_max"])
     postal_prefix = request.args.get("postal_prefix", "")
     city = request.args.get("city", "")
+    near = request.args.get("near", "")
+    radius_km = request.args.get("radius_km", "")
     pics_min = request.args.get("pics_min", "")
     posted_days = request.args.get("posted_days", "")
     sort = request.args.get("sort", "posted_desc")
+    dedupe = request.args.get("dedupe", "")
 
     page = max(parse_int(request.args.get("page"), 1) or 1, 1)
-    per_page = max(parse_int(request.args.get("per_page"), PER_PAGE_DEFAULT) or PER_PAGE_DEFAULT, 1)
-    offset = (page - 1) * per_page
+    per_page = min(max(parse_int(request.args.get("per_page"), PER_PAGE_DEFAULT) or PER_PAGE_DEFAULT, 1), PER_PAGE_MAX)
+    cursor = request.args.get("cursor", "")
 
     params = {
         "q": q, "price_min": price_min, "price_max": price_max,
         "ez_min": ez_min, "ez_max": ez_max, "km_max": km_max,
         "postal_prefix": postal_prefix, "city": city,
         "pics_min": pics_min, "posted_days": posted_days, "sort": sort,
+        "dedupe": dedupe, "near": near, "radius_km": radius_km,
     }
 
     where_sql, args, order_sql = build_query(params)
 
-    conn = get_db()
+    conn = get_db(readonly=True)
     cur = conn.cursor()
-    cur.execute(f"SELECT COUNT(*) AS n FROM listings {where_sql}", args)
-    total = cur.fetchone()[0]
-
-    cur.execute(
-        f"""SELECT id, title, price_eur, km, postal_code, city, posted_at, pics, url, platform, last_seen, ez_text,
-                   brand, model, fuel, gearbox, first_reg, description, features_json
-            FROM listings {where_sql} {order_sql} LIMIT ? OFFSET ?""",
-        args + [per_page, offset],
+    snap, ranges = listing_snapshot(conn, params)
+    if snap is not None:
+        total, total_estimated = snap.count(ranges), False
+    else:
+        total, total_estimated = count_listings(conn, params, where_sql, args)
+
+    rows, next_cursor, prev_cursor = fetch_page(
+        cur,
+        f"""SELECT id, title, price_eur, km, postal_code, city, posted_at, posted_ts, pics, url, platform,
+                   last_seen, last_seen_ts, ez_text,
+                   brand, model, fuel, gearbox, first_reg, rid, {DUP_COUNT_SQL}
+            FROM listings""",
+        where_sql, args, order_sql, sort, cursor, per_page, snap, ranges,
     )
-    rows = cur.fetchall()
+    rows = card_rows(conn, rows)
+    change_seq = latest_event_seq(conn)  # Ausgangspunkt für /api/changes im Client
     conn.close()
+    if not prev_cursor:
+        page = 1
 
-    def page_url(p):
-        if p < 1: p = 1
+    def page_url(p, c):
         qs = request.args.to_dict(flat=True)
-        qs["page"] = str(p)
+        qs.pop("cursor", None)
+        if c and p > 1:
+            qs["cursor"] = c
+            qs["page"] = str(p)
+        else:
+            qs.pop("page", None)
         return url_for("index", **qs)
 
     return render_template_string(TPL, **{
         "app_title": APP_TITLE,
         "rows": rows,
         "total": total,
+        "total_estimated": total_estimated,
         "page": page,
         "per_page": per_page,
-        "has_prev": page > 1,
-        "has_next": (offset + len(rows)) < total,
-        "prev_url": page_url(page - 1),
-        "next_url": page_url(page + 1),
+        "has_prev": prev_cursor is not None,
+        "has_next": next_cursor is not None,
+        "prev_url": page_url(page - 1, prev_cursor),
+        "next_url": page_url(page + 1, next_cursor),
         "params": params,
+        "plz_error_km": 0 if geo.has_full_plz() else geo.REGION_ERROR_KM,
         "VAPID_PUBLIC": VAPID_PUBLIC,
+        "change_seq": change_seq,
     })
   except Exception as e:
     import traceback as tb
@@ -308,37 +612,73 @@ def index():
 def api_table():
     q = request.args.get("q", "")
     price_min = request.args.get("price_min", "")
-    price_max = request.args.get("price_max", "9000")
-    ez_min = request.args.get("ez_min", "2012")
+    price_max = request.args.get("price_max", DEFAULT_VIEW_FILTERS["price_max"])
+    ez_min = request.args.get("ez_min", DEFAULT_VIEW_FILTERS["ez_min"])
     ez_max = request.args.get("ez_max", "")
-    km_max = request.args.get("km_max", "100000")
+    km_max = request.args.get("km_max", DEFAULT_VIEW_FILTERS["km_max"])
     postal_prefix = request.args.get("postal_prefix", "")
     city = request.args.get("city", "")
+    near = request.args.get("near", "")
+    radius_km = request.args.get("radius_km", "")
     pics_min = request.args.get("pics_min", "")
     posted_days = request.args.get("posted_days", "")
     sort = request.args.get("sort", "posted_desc")
+    dedupe = request.args.get("dedupe", "")
 
     params = {
         "q": q, "price_min": price_min, "price_max": price_max,
         "ez_min": ez_min, "ez_max": ez_max, "km_max": km_max,
         "postal_prefix": postal_prefix, "city": city,
         "pics_min": pics_min, "posted_days": posted_days, "sort": sort,
+        "dedupe": dedupe, "near": near, "radius_km": radius_km,
     }
 
     where_sql, args, order_sql = build_query(params)
 
-    conn = get_db()
+    conn = get_db(readonly=True)
     cur = conn.cursor()
-    cur.execute(
-        f"""SELECT id, title, price_eur, km, postal_code, city, posted_at, pics, url, ez_text,
-                   brand, model, fuel, gearbox, first_reg, description, features_json
-            FROM listings {where_sql} {order_sql} LIMIT ? OFFSET ?""",
-        args + [50, 0],
+    per_page = min(max(parse_int(request.args.get("per_page"), PER_PAGE_DEFAULT) or PER_PAGE_DEFAULT, 1), PER_PAGE_MAX)
+    snap, ranges = listing_snapshot(conn, params)
+    rows, next_cursor, prev_cursor = fetch_page(
+        cur,
+        f"""SELECT id, title, price_eur, km, postal_code, city, posted_at, posted_ts, pics, url,
+                   last_seen, last_seen_ts, ez_text,
+                   brand, model, fuel, gearbox, first_reg, rid, {DUP_COUNT_SQL}
+            FROM listings""",
+        where_sql, args, order_sql, sort, request.args.get("cursor", ""), per_page, snap, ranges,
     )
-    rows = cur.fetchall()
+    rows = card_rows(conn, rows)
     conn.close()
 
-    return render_template_string(CARDS_TPL, rows=rows)
+    resp = make_response(render_template_string(CARDS_TPL, rows=rows))
+    resp.headers["X-Next-Cursor"] = next_cursor or ""
+    resp.headers["X-Prev-Cursor"] = prev_cursor or ""
+    return resp
+
+CHANGES_LIMIT = 500
+
+
+@app.get("/api/changes")
+def api_changes():
+    """Änderungen seit seq `since` (listing_events). reset=True: zu alt bzw. DB getauscht →
+    Client lädt die Liste komplett; more=True: mehr als CHANGES_LIMIT, ebenfalls neu laden."""
+    since = parse_int(request.args.get("since"))
+    conn = get_db(readonly=True)
+    seq = latest_event_seq(conn)
+    if since is None:
+        conn.close()
+        return {"ok": True, "seq": seq, "events": [], "reset": False, "more": False}
+    oldest = conn.execute("SELECT MIN(seq) FROM listing_events").fetchone()[0]
+    reset = since > seq or (oldest is not None and since < oldest - 1) or (oldest is None and since < seq)
+    rows = [] if reset else conn.execute(
+        "SELECT seq, listing_id, kind, ts, data FROM listing_events WHERE seq > ? ORDER BY seq LIMIT ?",
+        (since, CHANGES_LIMIT)).fetchall()
+    conn.close()
+    events = [{"seq": r["seq"], "id": r["listing_id"], "kind": r["kind"], "ts": r["ts"],
+               "data": json.loads(r["data"]) if r["data"] else None} for r in rows]
+    more = len(rows) == CHANGES_LIMIT
+    return {"ok": True, "seq": events[-1]["seq"] if more else seq, "events": events, "reset": reset, "more": more}
+
 
 @app.get("/api/prompt")
 def api_prompt():
@@ -346,15 +686,15 @@ def api_prompt():
     if not lid:
         return {"ok": False, "error": "missing id"}, 400
 
-    conn = get_db()
+    conn = get_db(readonly=True)
     cur = conn.cursor()
     cur.execute("""
         SELECT id, title, price_eur, km, city, posted_at, url, ez_text,
-               brand, model, fuel, gearbox, first_reg,
-               description, image_urls_json
+               brand, model, fuel, gearbox, first_reg, rid
         FROM listings WHERE id = ?
     """, (lid,))
     r = cur.fetchone()
+    details = listing_details(conn, [r["rid"]]).get(r["rid"], {}) if r else {}
     conn.close()
 
     if not r:
@@ -362,8 +702,8 @@ def api_prompt():
 
     image_urls = []
     try:
-        if r["image_urls_json"]:
-            image_urls = json.loads(r["image_urls_json"])
+        if details.get("image_urls_json"):
+            image_urls = json.loads(details["image_urls_json"])
             if not isinstance(image_urls, list): image_urls = []
     except Exception:
         image_urls = []
@@ -380,7 +720,7 @@ def api_prompt():
             "KM": (str(r["km"]) if r["km"] is not None else ""),
             "Kraftstoff": (r["fuel"] or ""), "Getriebe": (r["gearbox"] or ""),
         },
-        "features": [], "description": r["description"] or "",
+        "features": [], "description": details.get("description") or "",
         "image_urls": image_urls,
     }
 
@@ -564,6 +904,7 @@ TPL = r"""
     .listing-card:active { transform: scale(0.99); }
     .listing-card.deal-good { border-left: 3px solid var(--green); background: var(--green-bg); }
     .listing-card.deal-bad { border-left: 3px solid var(--red); background: var(--red-bg); }
+    .listing-card.expired { opacity: 0.45; }
 
     .card-top { display: flex; justify-content: space-between; align-items: flex-start; gap: 12px; }
     .card-title { font-size: 15px; font-weight: 600; line-height: 1.3; flex: 1; }
@@ -841,7 +1182,7 @@ TPL = r"""
 
 <!-- Stats bar -->
 <div class="stats-bar">
-  <div class="stat-chip"><span class="num">{{ total }}</span> Treffer</div>
+  <div class="stat-chip"><span class="num">{{ total }}{% if total_estimated %}+{% endif %}</span> Treffer</div>
   <div class="stat-chip">Seite <span class="num">{{ page }}</span></div>
   <div class="stat-chip" id="favCount">⭐ —</div>
   <div class="stat-chip" id="lastSyncChip">⏳ Sync…</div>
@@ -875,8 +1216,8 @@ TPL = r"""
 <div class="filter-sheet" id="filterSheet">
   <div class="filter-grid">
     <div class="full">
-      <label class="field-label">Suche im Titel</label>
-      <input class="field-input" name="q" value="{{ params.q }}" placeholder="z.B. Polo, Yaris, Golf…">
+      <label class="field-label">Suche (Titel, Beschreibung, Ausstattung)</label>
+      <input class="field-input" name="q" value="{{ params.q }}" placeholder="z.B. Golf Scheckheft Automatik">
     </div>
     <div>
       <label class="field-label">Preis min €</label>
@@ -906,6 +1247,15 @@ TPL = r"""
       <label class="field-label">Stadt</label>
       <input class="field-input" name="city" value="{{ params.city }}" placeholder="München">
     </div>
+    <div>
+      <label class="field-label">Umkreis um PLZ{% if plz_error_km %} (± {{ plz_error_km }} km){% endif %}</label>
+      <input class="field-input" name="near" value="{{ params.near }}" placeholder="85221" inputmode="numeric"
+             {% if plz_error_km %}title="Nur Leitregionen (erste zwei PLZ-Ziffern) bekannt – Entfernungen sind bis zu {{ plz_error_km }} km ungenau, der Umkreis zeigt deshalb auch etwas weiter entfernte Autos"{% endif %}>
+    </div>
+    <div>
+      <label class="field-label">Radius (km)</label>
+      <input class="field-input" type="number" name="radius_km" value="{{ params.radius_km }}" min="1" placeholder="50">
+    </div>
     <div>
       <label class="field-label">Min. Bilder</label>
       <input class="field-input" type="number" name="pics_min" value="{{ params.pics_min }}" min="0">
@@ -914,6 +1264,12 @@ TPL = r"""
       <label class="field-label">Letzte Tage</label>
       <input class="field-input" type="number" name="posted_days" value="{{ params.posted_days }}" min="0">
     </div>
+    <div class="full">
+      <label class="field-label">
+        <input type="checkbox" name="dedupe" value="1" {% if params.dedupe %}checked{% endif %}>
+        Duplikate zusammenfassen (gleiches Auto, günstigstes Angebot)
+      </label>
+    </div>
     <div class="full">
       <label class="field-label">Sortierung</label>
       <select name="sort" class="field-input">
@@ -924,6 +1280,8 @@ TPL = r"""
         <option value="km_desc"    {% if params.sort=='km_desc'    %}selected{% endif %}>Kilometer ↓</option>
         <option value="seen_desc"  {% if params.sort=='seen_desc'  %}selected{% endif %}>Zuletzt gesehen</option>
         <option value="title_asc"  {% if params.sort=='title_asc'  %}selected{% endif %}>Titel A–Z</option>
+        <option value="relevance"  {% if params.sort=='relevance'  %}selected{% endif %}>Relevanz (Suche)</option>
+        <option value="distance_asc" {% if params.sort=='distance_asc' %}selected{% endif %}>Entfernung (Umkreis)</option>
       </select>
     </div>
   </div>
@@ -955,7 +1313,7 @@ TPL = r"""
   <div class="listing-card"
        data-row-id="{{ r['id'] }}"
        data-price-eur="{{ r['price_eur'] or '' }}"
-       data-desc="{{ (r['description'] or '')|e }}">
+       data-warn="{{ r['warn'] }}">
 
     <div class="card-top">
       <button class="fav-btn" data-fav-id="{{ r['id'] }}" title="Favorit">🤍</button>
@@ -977,6 +1335,7 @@ TPL = r"""
       {% if r['pics'] is not none %}<span class="tag"><span class="icon">📸</span> {{ r['pics'] }}</span>{% endif %}
       {% if r['posted_at'] %}<span class="tag tag-green"><span class="icon">🕐</span> {{ r['posted_at'] }}</span>{% endif %}
       <!-- Price history tag (filled by JS) -->
+      {% if r['dup_count'] > 1 %}<span class="tag" title="Gleiches Fahrzeug in weiteren Anzeigen">👯 +{{ r['dup_count'] - 1 }}</span>{% endif %}
       <span class="tag" data-pricehist-id="{{ r['id'] }}" style="display:none"></span>
       <span class="tag" style="opacity:0.5">{{ r['platform'] }} · {{ r['id'] }}</span>
     </div>
@@ -1115,6 +1474,7 @@ TPL = r"""
 document.addEventListener('DOMContentLoaded', () => {
   const REFRESH_MS = 120000;
   const VAPID_PUBLIC = "{{ VAPID_PUBLIC|default('')|safe }}".trim();
+  let changeSeq = {{ change_seq|int }};
   console.log('[Push] VAPID Key Länge:', VAPID_PUBLIC.length, 'Anfang:', VAPID_PUBLIC.slice(0,8));
 
   // --- Toast ---
@@ -1206,16 +1566,54 @@ document.addEventListener('DOMContentLoaded', () => {
     }
   }
 
+  // --- Delta-Refresh: nur geänderte Karten anfassen (/api/changes) ---
+  function patchCard(card, ev) {
+    if (ev.kind === 'expire') { card.classList.add('expired'); return; }
+    if (ev.kind === 'price') {
+      const p = ev.data && ev.data.new;
+      card.dataset.priceEur = p || '';
+      const el = card.querySelector('.card-price');
+      if (el) el.textContent = p ? p.toLocaleString('de-DE') + ' €' : '—';
+      card.querySelectorAll('[data-score-id]').forEach(el => { el.className = 'deal-score loading'; loadDealScore(el); });
+      initPriceHistory(card);
+      return;
+    }
+    if (ev.kind === 'update' && ev.data && ev.data.title) {
+      const el = card.querySelector('.card-title');
+      if (el) el.textContent = ev.data.title[1] || '—';
+    }
+  }
+
+  async function applyChanges() {
+    const r = await fetch('/api/changes?since=' + changeSeq, { cache: 'no-store' });
+    if (!r.ok) { await reloadCards(); return; }
+    const j = await r.json();
+    changeSeq = j.seq;
+    // Neue Angebote: Position hängt an Filter/Sortierung → erste Seite neu laden
+    const firstPage = !new URLSearchParams(window.location.search).get('cursor');
+    if (j.reset || j.more || (firstPage && j.events.some(ev => ev.kind === 'insert'))) {
+      await reloadCards();
+      return;
+    }
+    for (const ev of j.events) {
+      const card = document.querySelector(`.listing-card[data-row-id="${CSS.escape(ev.id)}"]`);
+      if (card) patchCard(card, ev);
+    }
+  }
+
   // --- Auto sync ---
   async function autosync() {
     try {
-      let changed = false;
+      let changed = false, partial = false;
       const s = await fetch('/api/sync', { cache: 'no-store' });
       if (s.ok) {
         const d = await s.json();
         changed = !!d.changed;
+        partial = !!d.partial;
       }
-      await reloadCards();
+      await applyChanges();
+      // Sync wurde vom Zeitbudget unterbrochen → gleich fortsetzen
+      if (partial) setTimeout(autosync, 3000);
       if (changed) toast('Neue Angebote gefunden', 'success');
       document.getElementById('lastSyncChip').textContent = '✓ ' + new Date().toLocaleTimeString('de-DE', {hour:'2-digit',minute:'2-digit'});
     } catch {}
@@ -1403,7 +1801,7 @@ document.addEventListener('DOMContentLoaded', () => {
     if (!fs) return 'Alle';
     let params;
     try { params = new URLSearchParams(fs.replace(/^\?/,'')); } catch { return fs; }
-    const label = { q:'Suche', price_min:'Min€', price_max:'Max€', ez_min:'EZ ab', ez_max:'EZ bis', km_max:'KM max', postal_prefix:'PLZ', city:'Stadt', pics_min:'Bilder', posted_days:'Tage', sort:'Sort' };
+    const label = { q:'Suche', price_min:'Min€', price_max:'Max€', ez_min:'EZ ab', ez_max:'EZ bis', km_max:'KM max', postal_prefix:'PLZ', city:'Stadt', near:'Umkreis', radius_km:'km', pics_min:'Bilder', posted_days:'Tage', sort:'Sort' };
     const out = [];
     for (const [k,v] of params.entries()) { const vv=(v||'').trim(); if(vv) out.push(`${label[k]||k}: ${vv}`); }
     return out.length ? out.join(' · ') : 'Alle';
@@ -1549,24 +1947,15 @@ document.addEventListener('DOMContentLoaded', () => {
   }
 
 
-  // --- Unfall-Warnwoerter ---
-  const WARN_WORDS = ['unfall','unfallwagen','unfallfahrzeug','unfallbeschaedigt','totalschaden','motorschaden','getriebeschaden','bastlerfahrzeug','bastlerauto','bastler','defekt','nicht fahrbereit','standschaden','hagelschaden','wasserschaden','rahmenschaden','verzogen','nachlassfahrzeug','export','schlachtung','teilespender','heckschaden'];
-
+  // --- Unfall-Warnwoerter (Wort kommt vom Server, siehe app.warn_word) ---
   function checkWarnWords(card) {
-    const title = (card.querySelector('.card-title')?.textContent || '').toLowerCase();
-    const desc = (card.dataset.desc || '').toLowerCase();
-    const text = title + ' ' + desc;
+    const w = card.dataset.warn || '';
     const meta = card.querySelector('.card-meta');
-    if (!meta) return;
-    for (const w of WARN_WORDS) {
-      if (text.includes(w) && !text.includes(w + 'frei') && !text.includes(w + 'freies')) {
-        const tag = document.createElement('span');
-        tag.className = 'tag tag-warn';
-        tag.textContent = '\u26a0\ufe0f ' + w.charAt(0).toUpperCase() + w.slice(1);
-        meta.prepend(tag);
-        return;
-      }
-    }
+    if (!w || !meta) return;
+    const tag = document.createElement('span');
+    tag.className = 'tag tag-warn';
+    tag.textContent = '\u26a0\ufe0f ' + w.charAt(0).toUpperCase() + w.slice(1);
+    meta.prepend(tag);
   }
 
   function initWarnTags(scope) {
@@ -1771,7 +2160,7 @@ CARDS_TPL = r"""
 <div class="listing-card"
      data-row-id="{{ r['id'] }}"
      data-price-eur="{{ r['price_eur'] or '' }}"
-     data-desc="{{ (r['description'] or '')|e }}">
+     data-warn="{{ r['warn'] }}">
 
   <div class="card-top">
     <button class="fav-btn" data-fav-id="{{ r['id'] }}" title="Favorit">🤍</button>
@@ -1791,6 +2180,7 @@ CARDS_TPL = r"""
     {% if r['postal_code'] %}<span class="tag">{{ r['postal_code'] }}</span>{% endif %}
     {% if r['pics'] is not none %}<span class="tag"><span class="icon">📸</span> {{ r['pics'] }}</span>{% endif %}
     {% if r['posted_at'] %}<span class="tag tag-green"><span class="icon">🕐</span> {{ r['posted_at'] }}</span>{% endif %}
+    {% if r['dup_count'] > 1 %}<span class="tag" title="Gleiches Fahrzeug in weiteren Anzeigen">👯 +{{ r['dup_count'] - 1 }}</span>{% endif %}
     <span class="tag" data-pricehist-id="{{ r['id'] }}" style="display:none"></span>
     <span class="tag" style="opacity:0.5">{{ r['id'] }}</span>
   </div>
@@ -1860,11 +2250,8 @@ CARDS_TPL = r"""
 # ============================================================
 # API routes (unchanged logic, same as original)
 # ============================================================
-import threading
-from time import monotonic
-_sync_lock = threading.Lock()
-_last_sync_ts = 0.0
-from datetime import datetime, timedelta
+# Zeitbudget pro /api/sync-Aufruf; Rest wird beim nächsten Aufruf fortgesetzt
+SYNC_BUDGET_SEC = float(os.environ.get("SYNC_BUDGET_SEC", "20"))
 import re
 
 def _rval(r, k):
@@ -1872,19 +2259,32 @@ def _rval(r, k):
     except: return None
 
 def _extract_year_from_row(r):
-    s = (_rval(r, "first_reg") or _rval(r, "ez_text") or "")
-    m = re.search(r"(19\d{2}|20\d{2})", s)
-    return int(m.group(1)) if m else None
-
-def _parse_posted_at(r):
-    s = (_rval(r, "posted_at") or "").strip()
+    y = _rval(r, "ez_year")
+    if y: return y
+    return parse_registration(_rval(r, "first_reg"), _rval(r, "ez_text"))[0]
+
+def _posted_epoch(r):
+    ts = _rval(r, "posted_ts")
+    if ts is not None: return ts
+    s = (_rval(r, "posted_at") or "").strip()  # Zeilen ohne posted_ts (altes Schema)
     if not s: return None
-    try: return datetime.fromisoformat(s.replace("T", " "))
+    try: return datetime.fromisoformat(s.replace("T", " ")).timestamp()
     except: return None
 
 
+def _mark_sent(conn, endpoint, listing_id, ts):
+    conn.execute("INSERT OR IGNORE INTO push_sent(endpoint, listing_id) VALUES(?,?)", (endpoint, listing_id))
+    try:
+        conn.execute("UPDATE listing_latency SET notified_ts = COALESCE(notified_ts, ?) WHERE listing_id = ?",
+                     (ts, listing_id))
+    except sqlite3.OperationalError:
+        pass
+
+
 def _notify_matches(new_rows):
-    conn = get_db(); cur = conn.cursor()
+    # nur lesen; geschrieben wird über den Writer-Thread – push_sent mit Warten auf den Commit,
+    # sonst ginge derselbe Push nach einem Fehler/Neustart noch einmal raus
+    conn = get_db(readonly=True); cur = conn.cursor()
     subs = list(cur.execute("SELECT endpoint,p256dh,auth,filters,max_price FROM push_subscriptions"))
 
     for r in new_rows:
@@ -1924,6 +2324,13 @@ def _notify_matches(new_rows):
             if ok and params.get("city"):
                 if params["city"].lower() not in (r["city"] or "").lower(): ok = False
 
+            if ok and params.get("near"):
+                center = geo.plz_centroid(params["near"])
+                if center:
+                    d = geo.distance_km(_rval(r, "lat"), _rval(r, "lon"), center[0], center[1])
+                    limit = geo.search_radius_km(geo.radius_km(params.get("radius_km")), params["near"])
+                    if d is None or d > limit: ok = False
+
             if ok and params.get("q"):
                 if params["q"].lower() not in (r["title"] or "").lower(): ok = False
 
@@ -1952,9 +2359,9 @@ def _notify_matches(new_rows):
             if ok and params.get("posted_days"):
                 try:
                     pd = int(params["posted_days"])
-                    dt = _parse_posted_at(r)
-                    if dt is None: ok = False
-                    elif dt < (datetime.now() - timedelta(days=pd)): ok = False
+                    ts = _posted_epoch(r)
+                    if ts is None: ok = False
+                    elif ts < time.time() - pd * 86400: ok = False
                 except: pass
 
             if not ok: continue
@@ -1971,47 +2378,229 @@ def _notify_matches(new_rows):
                     vapid_private_key=Vapid.from_pem(VAPID_PRIVATE_PEM.encode() if isinstance(VAPID_PRIVATE_PEM, str) else VAPID_PRIVATE_PEM),
                     vapid_claims={"sub": PUSH_SUBJECT},
                 )
-                cur.execute("INSERT OR IGNORE INTO push_sent(endpoint, listing_id) VALUES(?,?)", (endpoint, rid))
-                conn.commit()
             except WebPushException:
-                cur.execute("DELETE FROM push_subscriptions WHERE endpoint=?", (endpoint,))
-                conn.commit()
+                writer.execute(DB_PATH, "DELETE FROM push_subscriptions WHERE endpoint=?", (endpoint,))
+                continue
+            try:
+                writer.submit(DB_PATH, _mark_sent, endpoint, rid, time.time()).result(writer.RESULT_TIMEOUT_SEC)
+            except Exception as e:
+                print(f"[!] push_sent für {rid} nicht gespeichert: {e}", file=sys.stderr, flush=True)
     conn.close()
 
 
 @app.get("/api/sync")
 def api_sync():
-    global _last_sync_ts
-    now = monotonic()
-    if (now - _last_sync_ts) < 30.0:
-        return {"ok": True, "seen": 0, "stored": 0, "changed": False}
+    if replication.ROLE == "follower":
+        # Follower scrapen nicht; neue Daten kommen per Replikation, der Client holt sie über /api/changes
+        return {"ok": True, "seen": 0, "stored": 0, "changed": False, "role": "follower"}
 
-    if not _sync_lock.acquire(blocking=False):
-        return {"ok": True, "seen": 0, "stored": 0, "changed": False}
+    # Lease in SQLite statt Lock je Prozess: ein Crawl über alle Worker, Container und runner.py,
+    # dazu der gemeinsame Debounce (SYNC_DEBOUNCE_SEC nach dem letzten vollständigen Lauf)
+    with sync_lease() as lease:
+        if lease is None:
+            return {"ok": True, "seen": 0, "stored": 0, "changed": False}
 
-    try:
         from db import init_db
         init_db()
         from scrape_ebay import sync_once
-        res = sync_once()
-        _last_sync_ts = monotonic()
+        res = sync_once(budget_sec=SYNC_BUDGET_SEC)
+        # Teil-Lauf: Debounce nicht setzen, damit der nächste Aufruf weitermacht
+        lease["completed"] = not res.get("partial")
         changed = (res.get("stored", 0) > 0)
 
         if changed:
-            conn = get_db(); cur = conn.cursor()
+            conn = get_db(readonly=True); cur = conn.cursor()
             try:
-                cur.execute("""SELECT id,title,price_eur,km,city,url,posted_at,postal_code,ez_text,first_reg,pics
-                    FROM listings WHERE posted_at IS NOT NULL ORDER BY posted_at DESC, last_seen DESC LIMIT 50""")
+                cur.execute("""SELECT id,title,price_eur,km,city,url,posted_at,posted_ts,postal_code,lat,lon,ez_text,first_reg,ez_year,pics
+                    FROM listings WHERE posted_ts IS NOT NULL ORDER BY posted_ts DESC, last_seen_ts DESC LIMIT 50""")
             except:
                 cur.execute("""SELECT id,title,price_eur,km,city,url,posted_at,postal_code,ez_text,first_reg,pics
                     FROM listings ORDER BY last_seen DESC LIMIT 50""")
             new_rows = cur.fetchall()
             conn.close()
+            # Reihenfolge wie beim Detail-Laden: beste Deals zuerst pushen
+            prio = {lid: i for i, lid in enumerate(res.get("priority_ids") or [])}
+            new_rows.sort(key=lambda r: prio.get(r["id"], len(prio)))
             _notify_matches(new_rows)
 
+        res.pop("priority_ids", None)
         return {"ok": True, **res, "changed": changed}
+
+
+@app.get("/api/sync/lease")
+def api_sync_lease():
+    return {"ok": True, **lease_status()}
+
+
+# --- Replikation: Status für alle Rollen, Batches/Schnappschüsse vom Leader für Follower per HTTP ---
+@app.get("/api/repl/status")
+def api_repl_status():
+    conn = get_db(readonly=True)
+    try:
+        return {"ok": True, **replication.status(conn)}
+    finally:
+        conn.close()
+
+
+def _repl_allowed():
+    return replication.ROLE == "leader" and (
+        not replication.REPL_TOKEN or request.headers.get("X-Repl-Token") == replication.REPL_TOKEN)
+
+
+@app.get("/api/repl/files")
+def api_repl_files():
+    if not _repl_allowed():
+        return {"ok": False}, 404
+    return {"ok": True, "files": replication.list_files()}
+
+
+@app.get("/api/repl/file/<name>")
+def api_repl_file(name):
+    if not _repl_allowed() or not replication.is_repl_file(name):
+        return {"ok": False}, 404
+    return send_from_directory(replication.REPL_DIR, name, mimetype="application/octet-stream")
+
+
+# --- DB-Verbindungspool: Konfiguration + Zähler (geöffnet/wiederverwendet) ---
+@app.get("/api/db/pool")
+def api_db_pool():
+    return {"ok": True, **dbpool.pool_stats(), "writer": writer.writer_stats()}
+
+
+# --- End-to-End-Latenz (Inserat → entdeckt → Details → Push) ---
+LATENCY_STAGES = {
+    "posted_to_discovered":   ("posted_ts",     "discovered_ts"),
+    "discovered_to_enriched": ("discovered_ts", "enriched_ts"),
+    "discovered_to_notified": ("discovered_ts", "notified_ts"),
+    "posted_to_notified":     ("posted_ts",     "notified_ts"),
+}
+# Histogramm-Grenzen in Sekunden (letzter Bucket: alles darüber)
+LATENCY_BUCKETS = [60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 24 * 3600]
+
+def _percentile(sorted_vals, p):
+    if not sorted_vals: return None
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(p / 100.0 * len(sorted_vals)) - 1))
+    return round(sorted_vals[k], 1)
+
+@app.get("/api/latency")
+def api_latency():
+    days = parse_int(request.args.get("days"), 7) or 7
+    profile = request.args.get("profile")
+
+    conn = get_db(readonly=True); cur = conn.cursor()
+    sql = """SELECT profile, posted_ts, discovered_ts, enriched_ts, notified_ts
+             FROM listing_latency WHERE discovered_ts >= ?"""
+    args = [time.time() - days * 86400]
+    if profile:
+        sql += " AND profile = ?"
+        args.append(profile)
+    try:
+        rows = cur.execute(sql, args).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    conn.close()
+
+    by_profile = {}
+    for r in rows:
+        by_profile.setdefault(r["profile"] or "", []).append(r)
+
+    out = {}
+    for prof, prows in by_profile.items():
+        stages = {}
+        for name, (a, b) in LATENCY_STAGES.items():
+            vals = sorted(max(0.0, r[b] - r[a]) for r in prows if r[a] is not None and r[b] is not None)
+            hist = [0] * (len(LATENCY_BUCKETS) + 1)
+            for v in vals:
+                i = 0
+                while i < len(LATENCY_BUCKETS) and v > LATENCY_BUCKETS[i]: i += 1
+                hist[i] += 1
+            stages[name] = {
+                "n": len(vals),
+                "p50": _percentile(vals, 50), "p95": _percentile(vals, 95), "p99": _percentile(vals, 99),
+                "histogram": hist,
+            }
+        out[prof] = {"listings": len(prows), "stages": stages}
+
+    return {"ok": True, "days": days, "bucket_bounds_sec": LATENCY_BUCKETS, "profiles": out}
+
+
+# --- Archiv-Tier: Historie über heiße + archivierte Listings ---
+@app.get("/api/archive/stats")
+def api_archive_stats():
+    conn = get_db(readonly=True)
+    try:
+        archive.attach(conn)
+        hot = conn.execute("SELECT COUNT(*) FROM main.listings").fetchone()[0]
+        return {"ok": True, "hot_listings": hot, "archive": archive.archive_stats(conn)}
     finally:
-        _sync_lock.release()
+        archive.detach(conn)
+        conn.close()
+
+
+@app.get("/api/market_history")
+def api_market_history():
+    """Monatliche Preisstatistik (nach first_seen) für Marke/Modell/EZ über beide Tiers."""
+    brand = (request.args.get("brand") or "").strip()
+    model = (request.args.get("model") or "").strip()
+    if not brand:
+        return {"ok": False, "error": "missing brand"}, 400
+    months = min(parse_int(request.args.get("months"), 24) or 24, 120)
+
+    where = ["brand = ? COLLATE NOCASE", "price_eur > 0", "first_seen_ts >= ?"]
+    args = [brand, int(time.time()) - months * 31 * 86400]
+    if model:
+        where.append("model = ? COLLATE NOCASE")
+        args.append(model)
+    for key, op in (("ez_min", ">="), ("ez_max", "<=")):
+        y = parse_int(request.args.get(key))
+        if y is not None:
+            where.append(f"ez_year {op} ?")
+            args.append(y)
+
+    conn = get_db(readonly=True)
+    try:
+        archive.attach(conn)
+        # Duplikate (gleicher Fingerprint) nur einmal je Monat zählen
+        rows = conn.execute(f"""
+            SELECT month, COUNT(*) AS n, CAST(AVG(price_eur) AS INTEGER) AS avg_price,
+                   MIN(price_eur) AS min_price, MAX(price_eur) AS max_price,
+                   SUM(tier = 'archive') AS archived
+            FROM (SELECT strftime('%Y-%m', first_seen_ts, 'unixepoch') AS month,
+                         COALESCE(fingerprint, id) AS vehicle, MIN(price_eur) AS price_eur, MAX(tier) AS tier
+                  FROM {archive.all_listings_sql(conn)}
+                  WHERE {" AND ".join(where)}
+                  GROUP BY 1, 2)
+            GROUP BY month ORDER BY month""", args).fetchall()
+    finally:
+        archive.detach(conn)
+        conn.close()
+    return {"ok": True, "brand": brand, "model": model or None,
+            "months": [dict(r) for r in rows]}
+
+
+# --- Duplikate (gleicher Fahrzeug-Fingerprint) ---
+@app.get("/api/duplicates")
+def api_duplicates():
+    lid = request.args.get("id")
+    if not lid: return {"ok": False, "error": "missing id"}, 400
+
+    conn = get_db(readonly=True); cur = conn.cursor()
+    row = cur.execute("SELECT fingerprint FROM listings WHERE id = ?", (lid,)).fetchone()
+    if not row:
+        conn.close()
+        return {"ok": False, "error": "not found"}, 404
+    if not row["fingerprint"]:
+        conn.close()
+        return {"ok": True, "fingerprint": None, "representative": lid, "items": []}
+
+    rows = cur.execute("""SELECT id, platform, title, price_eur, km, city, posted_at, url
+                          FROM listings WHERE fingerprint = ?
+                          ORDER BY (price_eur IS NULL), price_eur ASC, posted_ts DESC, last_seen_ts DESC""",
+                       (row["fingerprint"],)).fetchall()
+    conn.close()
+    items = [dict(r) for r in rows]
+    return {"ok": True, "fingerprint": row["fingerprint"],
+            "representative": items[0]["id"] if items else lid, "items": items}
 
 
 # --- Kleinanzeigen Stats ---
@@ -2020,7 +2609,7 @@ def api_similar_stats():
     lid = request.args.get("id")
     if not lid: return {"ok": False, "error": "missing id"}, 400
 
-    conn = get_db(); cur = conn.cursor()
+    conn = get_db(readonly=True); cur = conn.cursor()
     cur.execute("""SELECT id, title, km, ez_text, brand, model, fuel, gearbox, first_reg
                    FROM listings WHERE id = ?""", (lid,))
     row = cur.fetchone(); conn.close()
@@ -2042,7 +2631,7 @@ def api_autoscout_stats():
     lid = request.args.get("id")
     if not lid: return {"ok": False, "error": "missing id"}, 400
 
-    conn = get_db(); cur = conn.cursor()
+    conn = get_db(readonly=True); cur = conn.cursor()
     cur.execute("""SELECT id, title, km, ez_text, brand, model, fuel, gearbox, first_reg
                    FROM listings WHERE id = ?""", (lid,))
     row = cur.fetchone(); conn.close()
@@ -2143,7 +2732,7 @@ def api_mobile_stats():
 def api_carwow_stats():
     lid = request.args.get("id")
     if not lid: return {"ok": False, "error": "missing id"}, 400
-    conn = get_db(); cur = conn.cursor()
+    conn = get_db(readonly=True); cur = conn.cursor()
     cur.execute("""SELECT id, title, km, ez_text, brand, model, fuel, gearbox, first_reg
                    FROM listings WHERE id = ?""", (lid,))
     row = cur.fetchone(); conn.close()
@@ -2181,13 +2770,11 @@ def api_mobile_price_save():
     avg = int(round(sum(prices) / count)) if count else 0
     h = _url_hash(url)
 
-    conn = get_db(); cur = conn.cursor()
-    cur.execute("""INSERT INTO mobile_price_cache(url_hash, search_url, count, avg_price, prices_json, updated_at)
+    writer.execute(DB_PATH, """INSERT INTO mobile_price_cache(url_hash, search_url, count, avg_price, prices_json, updated_at)
                    VALUES(?,?,?,?,?,datetime('now'))
                    ON CONFLICT(url_hash) DO UPDATE SET count=excluded.count, avg_price=excluded.avg_price,
                    prices_json=excluded.prices_json, updated_at=datetime('now')""",
-                (h, url, count, avg, json.dumps(prices)))
-    conn.commit(); conn.close()
+                   (h, url, count, avg, json.dumps(prices))).result(writer.RESULT_TIMEOUT_SEC)
     return {"ok": True, "count": count, "avg_price": avg}
 
 @app.get("/api/mobile_price")
@@ -2197,7 +2784,7 @@ def api_mobile_price_get():
     if not url:
         return {"ok": False}, 400
     h = _url_hash(url)
-    conn = get_db(); cur = conn.cursor()
+    conn = get_db(readonly=True); cur = conn.cursor()
     row = cur.execute("SELECT count, avg_price, updated_at FROM mobile_price_cache WHERE url_hash=?", (h,)).fetchone()
     conn.close()
     if not row:
@@ -2395,7 +2982,7 @@ fetch('${BASE}/api/mobile_price', {
 # --- Favorites API ---
 @app.get("/api/favs")
 def api_favs():
-    conn = get_db(); cur = conn.cursor()
+    conn = get_db(readonly=True); cur = conn.cursor()
     rows = cur.execute("SELECT listing_id, status, note, created_at FROM favorites ORDER BY created_at DESC").fetchall()
     conn.close()
     return {"ok": True, "favs": [{"listing_id": r["listing_id"], "status": r["status"], "note": r["note"] or ""} for r in rows]}
@@ -2407,10 +2994,8 @@ def api_fav_set():
     status = (data.get("status") or "interessant").strip()
     note = (data.get("note") or "").strip()
     if not lid: return {"ok": False}, 400
-    conn = get_db(); cur = conn.cursor()
-    cur.execute("INSERT INTO favorites(listing_id, status, note) VALUES(?,?,?) ON CONFLICT(listing_id) DO UPDATE SET status=excluded.status, note=excluded.note",
-                (lid, status, note))
-    conn.commit(); conn.close()
+    writer.execute(DB_PATH, "INSERT INTO favorites(listing_id, status, note) VALUES(?,?,?) ON CONFLICT(listing_id) DO UPDATE SET status=excluded.status, note=excluded.note",
+                   (lid, status, note)).result(writer.RESULT_TIMEOUT_SEC)
     return {"ok": True}
 
 @app.delete("/api/fav")
@@ -2418,9 +3003,7 @@ def api_fav_del():
     data = request.get_json(force=True, silent=True) or {}
     lid = (data.get("id") or "").strip()
     if not lid: return {"ok": False}, 400
-    conn = get_db(); cur = conn.cursor()
-    cur.execute("DELETE FROM favorites WHERE listing_id=?", (lid,))
-    conn.commit(); conn.close()
+    writer.execute(DB_PATH, "DELETE FROM favorites WHERE listing_id=?", (lid,)).result(writer.RESULT_TIMEOUT_SEC)
     return {"ok": True}
 
 
@@ -2438,9 +3021,9 @@ def api_deal_score():
     lid = request.args.get("id")
     if not lid: return {"ok": False, "error": "missing id"}, 400
 
-    conn = get_db(); cur = conn.cursor()
+    conn = get_db(readonly=True); cur = conn.cursor()
     cur.execute("""SELECT id, title, price_eur, km, ez_text, brand, model, fuel, gearbox, first_reg,
-                          posted_at, pics, city
+                          posted_at, posted_ts, pics, city
                    FROM listings WHERE id = ?""", (lid,))
     row = cur.fetchone()
     if not row:
@@ -2476,12 +3059,10 @@ def api_deal_score():
     detail["pics"] = min(pics, 10)
 
     # --- Standzeit (10 Punkte) - frische Inserate = besser ---
-    posted = row["posted_at"]
-    if posted:
+    posted_ts = row["posted_ts"]
+    if posted_ts is not None:
         try:
-            from datetime import datetime
-            dt = datetime.fromisoformat(posted.replace("T", " "))
-            age_days = (datetime.now() - dt).days
+            age_days = int((time.time() - posted_ts) // 86400)
             if age_days <= 1: score += 10
             elif age_days <= 3: score += 8
             elif age_days <= 7: score += 5
@@ -2548,14 +3129,14 @@ def api_deal_score():
 
     score = max(0, min(100, score))
 
-    # Cache in DB
-    try:
-        cur.execute("INSERT INTO deal_scores(listing_id,score,ka_avg,as_avg) VALUES(?,?,?,?) ON CONFLICT(listing_id) DO UPDATE SET score=excluded.score,ka_avg=excluded.ka_avg,as_avg=excluded.as_avg,updated_at=datetime('now')",
-                    (lid, score, ka_avg, as_avg))
-        conn.commit()
-    except: pass
     conn.close()
 
+    # Cache in DB (über den Writer, ohne auf den Commit zu warten)
+    try:
+        writer.execute(DB_PATH, "INSERT INTO deal_scores(listing_id,score,ka_avg,as_avg) VALUES(?,?,?,?) ON CONFLICT(listing_id) DO UPDATE SET score=excluded.score,ka_avg=excluded.ka_avg,as_avg=excluded.as_avg,updated_at=datetime('now')",
+                       (lid, score, ka_avg, as_avg))
+    except Exception: pass
+
     return {"ok": True, "score": score, "detail": detail}
 
 
@@ -2565,8 +3146,16 @@ def api_price_history():
     lid = request.args.get("id")
     if not lid: return {"ok": False, "error": "missing id"}, 400
 
-    conn = get_db(); cur = conn.cursor()
-    rows = cur.execute("SELECT price_eur, seen_at FROM listing_prices WHERE listing_id=? ORDER BY seen_at ASC", (lid,)).fetchall()
+    conn = get_db(readonly=True); cur = conn.cursor()
+    sql = """SELECT price_eur, ts, datetime(ts, 'unixepoch') AS seen_at
+             FROM {}.price_history WHERE listing_id = ? ORDER BY ts ASC"""
+    rows = cur.execute(sql.format("main"), (lid,)).fetchall()
+    # nicht mehr im heißen Tier → evtl. archiviert
+    if not rows and archive.attach(conn):
+        try:
+            rows = cur.execute(sql.format(archive.SCHEMA), (lid,)).fetchall()
+        finally:
+            archive.detach(conn)
     conn.close()
 
     if not rows or len(rows) < 2:
@@ -2577,7 +3166,7 @@ def api_price_history():
     for r in rows[1:]:
         p = r["price_eur"]
         if p is not None and prev is not None and p != prev:
-            changes.append({"from": prev, "to": p, "diff": p - prev, "at": r["seen_at"]})
+            changes.append({"from": prev, "to": p, "diff": p - prev, "at": r["seen_at"], "ts": r["ts"]})
         if p is not None:
             prev = p
 
@@ -2593,28 +3182,28 @@ def api_push_sub():
     maxp = data.get("max_price")
     if not (sub.get("endpoint") and sub.get("keys",{}).get("p256dh") and sub["keys"].get("auth")):
         return {"ok": False, "error": "bad subscription"}, 400
-    conn = get_db(); cur = conn.cursor()
-    cur.execute("""INSERT INTO push_subscriptions(endpoint,p256dh,auth,filters,max_price)
+    writer.execute(DB_PATH, """INSERT INTO push_subscriptions(endpoint,p256dh,auth,filters,max_price)
                    VALUES(?,?,?,?,?)
                    ON CONFLICT(endpoint) DO UPDATE SET p256dh=excluded.p256dh,auth=excluded.auth,filters=excluded.filters,max_price=excluded.max_price""",
-                   (sub["endpoint"], sub["keys"]["p256dh"], sub["keys"]["auth"], filt, maxp))
-    conn.commit(); conn.close()
+                   (sub["endpoint"], sub["keys"]["p256dh"], sub["keys"]["auth"], filt, maxp)).result(writer.RESULT_TIMEOUT_SEC)
     return {"ok": True}
 
+def _delete_subscription(conn, endpoint):
+    conn.execute("DELETE FROM push_subscriptions WHERE endpoint=?", (endpoint,))
+    conn.execute("DELETE FROM push_sent WHERE endpoint=?", (endpoint,))
+
+
 @app.post("/api/push/unsubscribe")
 def api_push_unsub():
     data = request.get_json(force=True, silent=True) or {}
     ep = (data.get("endpoint") or "").strip()
     if not ep: return {"ok": False}, 400
-    conn = get_db(); cur = conn.cursor()
-    cur.execute("DELETE FROM push_subscriptions WHERE endpoint=?", (ep,))
-    cur.execute("DELETE FROM push_sent WHERE endpoint=?", (ep,))
-    conn.commit(); conn.close()
+    writer.submit(DB_PATH, _delete_subscription, ep).result(writer.RESULT_TIMEOUT_SEC)
     return {"ok": True}
 
 @app.get("/api/push/list")
 def api_push_list():
-    conn = get_db(); cur = conn.cursor()
+    conn = get_db(readonly=True); cur = conn.cursor()
     rows = cur.execute("SELECT endpoint, filters, max_price, created_at FROM push_subscriptions ORDER BY created_at DESC").fetchall()
     conn.close()
     return {"ok": True, "subs": [{"endpoint": r["endpoint"], "filters": r["filters"] or "", "max_price": r["max_price"], "created_at": r["created_at"]} for r in rows]}
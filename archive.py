@@ -0,0 +1,196 @@
+# archive.py — Archiv-Tier: abgelaufene Listings + Preisverlauf in archive.db
+#
+# maintenance.py verschiebt alte Listings batchweise hierher statt sie zu löschen;
+# die heiße listings-Tabelle (und ihre Indizes) bleibt klein. Die Archiv-Datei wird
+# nur bei Bedarf per ATTACH eingebunden – gepoolte Verbindungen danach wieder detach().
+#
+# Prüfen, dass archivierte Listings ihre Texte behalten:  python archive.py --check
+import os
+import sys
+import time
+
+from migrations import LAYOUT_COLUMNS, DETAIL_COLUMNS, DETAIL_TABLE, has_details, listing_table, unpack_text
+
+DB_PATH = os.environ.get("AUTOS_DB", "autos.db")
+ARCHIVE_PATH = os.environ.get("AUTOS_ARCHIVE_DB") or os.path.join(
+    os.path.dirname(os.path.abspath(DB_PATH)), "archive.db")
+SCHEMA = "archive"
+
+# Indizes für Marktstatistiken über die Historie
+ARCHIVE_INDEXES = {
+    "idx_archive_model": "listings(brand, model, ez_year)",
+    "idx_archive_fingerprint": "listings(fingerprint)",
+    "idx_archive_first_seen": "listings(first_seen_ts)",
+}
+
+
+def is_attached(conn) -> bool:
+    return any(r[1] == SCHEMA for r in conn.execute("PRAGMA database_list"))
+
+
+def attach(conn, create: bool = False) -> bool:
+    """archive.db als Schema 'archive' einbinden. Ohne create nur, wenn die Datei existiert."""
+    if is_attached(conn):
+        return True
+    if not create and not os.path.exists(ARCHIVE_PATH):
+        return False
+    conn.execute(f"ATTACH DATABASE ? AS {SCHEMA}", (ARCHIVE_PATH, ))
+    if create:
+        conn.execute(f"PRAGMA {SCHEMA}.journal_mode=WAL")
+        ensure_schema(conn)
+    return True
+
+
+def detach(conn):
+    if is_attached(conn):
+        conn.execute(f"DETACH DATABASE {SCHEMA}")
+
+
+def ensure_schema(conn):
+    """Archiv-Tabellen anlegen bzw. um neue Spalten aus main.listings ergänzen."""
+    cols = [(r[1], r[2]) for r in conn.execute("PRAGMA main.table_info(listings)")
+            if r[1] not in LAYOUT_COLUMNS]  # Codes/rid gelten nur in der heißen DB
+    have = {r[1] for r in conn.execute(f"PRAGMA {SCHEMA}.table_info(listings)")}
+    if not have:
+        defs = ",\n          ".join(f"{c} {t or ''}{' PRIMARY KEY' if c == 'id' else ''}" for c, t in cols)
+        conn.execute(f"""
+          CREATE TABLE {SCHEMA}.listings (
+          {defs},
+          archived_ts INTEGER
+        )""")
+    else:
+        for c, t in cols:
+            if c not in have:
+                conn.execute(f"ALTER TABLE {SCHEMA}.listings ADD COLUMN {c} {t or ''}")
+    conn.execute(f"""
+      CREATE TABLE IF NOT EXISTS {SCHEMA}.price_history (
+        listing_id TEXT NOT NULL,
+        ts         INTEGER NOT NULL,
+        price_eur  INTEGER,
+        PRIMARY KEY (listing_id, ts)
+      ) WITHOUT ROWID""")
+    # Beschreibung/Bilder/Ausstattung wie im heißen Tier zlib-gepackt, aber nach listing_id
+    # (rid gilt nur in der heißen DB)
+    conn.execute(f"""
+      CREATE TABLE IF NOT EXISTS {SCHEMA}.{DETAIL_TABLE} (
+        listing_id TEXT PRIMARY KEY,
+        {", ".join(f"{c} BLOB" for c in DETAIL_COLUMNS)}
+      )""")
+    for name, target in ARCHIVE_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {SCHEMA}.{name} ON {target}")
+
+
+def move_listings(conn, ids) -> int:
+    """Listings samt Details und Preisverlauf ins Archiv kopieren und aus dem heißen Tier löschen.
+
+    Läuft in der Transaktion des Aufrufers. Erst kopieren, dann löschen: bricht es
+    dazwischen ab, steht das Listing doppelt und wird beim nächsten Lauf ersetzt."""
+    if not ids:
+        return 0
+    ph = ",".join("?" * len(ids))
+    cols = ",".join(r[1] for r in conn.execute("PRAGMA main.table_info(listings)")
+                    if r[1] not in LAYOUT_COLUMNS)
+    conn.execute(f"""INSERT OR REPLACE INTO {SCHEMA}.listings({cols}, archived_ts)
+                     SELECT {cols}, ? FROM main.listings WHERE id IN ({ph})""",
+                 [int(time.time())] + list(ids))
+    if has_details(conn):
+        # vor dem DELETE: trg_listing_details_delete nimmt die Details sonst mit
+        dcols = ", ".join(DETAIL_COLUMNS)
+        conn.execute(f"""INSERT OR REPLACE INTO {SCHEMA}.{DETAIL_TABLE}(listing_id, {dcols})
+                         SELECT l.id, {", ".join(f"x.{c}" for c in DETAIL_COLUMNS)}
+                         FROM main.listings l JOIN main.{DETAIL_TABLE} x ON x.rid = l.rid
+                         WHERE l.id IN ({ph})""", list(ids))
+    conn.execute(f"""INSERT OR REPLACE INTO {SCHEMA}.price_history(listing_id, ts, price_eur)
+                     SELECT listing_id, ts, price_eur FROM main.price_history WHERE listing_id IN ({ph})""",
+                 list(ids))
+    conn.execute(f"DELETE FROM main.price_history WHERE listing_id IN ({ph})", list(ids))
+    return conn.execute(f"DELETE FROM main.{listing_table(conn)} WHERE id IN ({ph})", list(ids)).rowcount
+
+
+def archived_details(conn, ids) -> dict:
+    """{listing_id: {Spalte: Text}} für archivierte Listings (Archiv muss eingebunden sein)."""
+    if not ids:
+        return {}
+    rows = conn.execute(
+        f"""SELECT listing_id, {", ".join(DETAIL_COLUMNS)} FROM {SCHEMA}.{DETAIL_TABLE}
+            WHERE listing_id IN ({",".join("?" * len(ids))})""", list(ids)).fetchall()
+    return {r[0]: {c: unpack_text(v) for c, v in zip(DETAIL_COLUMNS, r[1:])} for r in rows}
+
+
+def all_listings_sql(conn) -> str:
+    """Unterabfrage über beide Tiers (statt TEMP-View: geht auch mit query_only-Verbindungen).
+    Ohne eingebundenes Archiv nur das heiße Tier."""
+    cols = "id, brand, model, ez_year, km, price_eur, first_seen_ts, last_seen_ts, fingerprint"
+    sql = f"SELECT {cols}, 'hot' AS tier, NULL AS archived_ts FROM main.listings"
+    if is_attached(conn):
+        sql += f" UNION ALL SELECT {cols}, 'archive', archived_ts FROM {SCHEMA}.listings"
+    return f"({sql})"
+
+
+def archive_stats(conn) -> dict:
+    if not is_attached(conn):
+        return {"path": ARCHIVE_PATH, "listings": 0, "price_points": 0}
+    return {
+        "path": ARCHIVE_PATH,
+        "listings": conn.execute(f"SELECT COUNT(*) FROM {SCHEMA}.listings").fetchone()[0],
+        "price_points": conn.execute(f"SELECT COUNT(*) FROM {SCHEMA}.price_history").fetchone()[0],
+    }
+
+
+def check_archive(rows=6) -> list:
+    """Wartungslauf in einer Wegwerf-DB: die Hälfte der Listings veraltet und wird archiviert.
+    Beschreibung, Bilder und Ausstattung müssen im Archiv lesbar bleiben. Gibt Fehler zurück."""
+    import tempfile
+    tmp = tempfile.mkdtemp(prefix="archivecheck-")
+    os.environ["AUTOS_DB"] = os.path.join(tmp, "autos.db")
+    os.environ["AUTOS_ARCHIVE_DB"] = os.path.join(tmp, "archive.db")
+    os.environ["AUTOS_ARCHIVE"] = "1"
+    import db
+    import maintenance
+    import archive  # nicht __main__: maintenance arbeitet mit diesem Modul
+
+    db.init_db()
+
+    ids = [f"A{i:03d}" for i in range(rows)]
+    for lid in ids:
+        db.upsert_listing({"id": lid, "platform": "ebay-kleinanzeigen", "url": f"https://example.invalid/{lid}",
+                           "title": f"Archiv {lid}", "price_eur": 1000, "km": 1000,
+                           "description": f"Beschreibung {lid} " * 20,
+                           "image_urls_json": f'["https://example.invalid/{lid}.jpg"]',
+                           "features_json": '["Klima", "AHK"]'})
+    old = ids[: rows // 2]
+    conn = db.get_conn()
+    conn.execute(f"UPDATE listings_data SET last_seen_ts = last_seen_ts - ? WHERE id IN ({','.join('?' * len(old))})",
+                 [(maintenance.RETENTION_DAYS + 1) * 86400] + old)
+    conn.commit()
+    conn.close()
+
+    errors = []
+    res = maintenance.run(budget_sec=10)
+    if res["expired"] != len(old):
+        errors.append(f"{res['expired']} statt {len(old)} Listings archiviert")
+    conn = db.get_conn()
+    try:
+        archive.attach(conn)
+        got = archive.archived_details(conn, old)
+        for lid in old:
+            d = got.get(lid) or {}
+            if not (d.get("description") or "").startswith(f"Beschreibung {lid}"):
+                errors.append(f"{lid}: Beschreibung fehlt im Archiv")
+            if lid not in (d.get("image_urls_json") or "") or "Klima" not in (d.get("features_json") or ""):
+                errors.append(f"{lid}: Bilder/Ausstattung fehlen im Archiv")
+        kept = db.listing_details(conn, [r[0] for r in conn.execute(
+            f"SELECT rid FROM main.listings WHERE id IN ({','.join('?' * (rows - len(old)))})", ids[len(old):])])
+        if len(kept) != rows - len(old):
+            errors.append(f"heißes Tier: {len(kept)} statt {rows - len(old)} Listings mit Details")
+    finally:
+        archive.detach(conn)
+        conn.close()
+    return errors
+
+
+if __name__ == "__main__":
+    if "--check" in sys.argv:
+        errors = check_archive()
+        print("\n".join(errors) or "Archiv behält Details OK")
+        sys.exit(1 if errors else 0)
@@ -1,12 +1,24 @@
+import os
+import json
+import time
+import hashlib
+import socket
 import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
 
-DB_PATH = "autos.db"
+import dbpool
+from migrations import (migrate, has_fulltext, index_fulltext, pack_text, unpack_text,
+                        CATEGORICAL_COLUMNS, LISTING_TABLE, DETAIL_COLUMNS, DETAIL_TABLE, REPL_TOUCH)
+from vehicle import vehicle_fingerprint, parse_registration
+
+DB_PATH = os.environ.get("AUTOS_DB", "autos.db")
 
 
 def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA journal_mode=WAL;")
-    return conn
+    # gepoolt, WAL + Pragmas werden nur beim Öffnen gesetzt (siehe dbpool.py)
+    return dbpool.connect(DB_PATH)
 
 
 def ensure_column(conn, table, col, type_sql):
@@ -16,78 +28,19 @@ def ensure_column(conn, table, col, type_sql):
         conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {type_sql}")
 
 
-def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-      CREATE TABLE IF NOT EXISTS listings (
-        id TEXT PRIMARY KEY,
-        platform TEXT,
-        url TEXT,
-        title TEXT,
-        price_eur INTEGER,
-        km INTEGER,
-        ez_text TEXT,
-        location TEXT,
-        postal_code TEXT,
-        city TEXT,
-        posted_at TEXT,
-        pics INTEGER,
-        brand TEXT,
-        model TEXT,
-        fuel TEXT,
-        power_ps INTEGER,
-        gearbox TEXT,
-        doors TEXT,
-        hu_until TEXT,
-        emission_class TEXT,
-        color TEXT,
-        upholstery TEXT,
-        first_reg TEXT,
-        first_seen TEXT DEFAULT (datetime('now')),
-        last_seen  TEXT DEFAULT (datetime('now')),
-        status TEXT DEFAULT 'active'
-      )
-    """)
-    cur.execute("""
-      CREATE TABLE IF NOT EXISTS listing_prices (
-        listing_id TEXT NOT NULL,
-        seen_at    TEXT DEFAULT (datetime('now')),
-        price_eur  INTEGER,
-        FOREIGN KEY(listing_id) REFERENCES listings(id)
-      )
-    """)
-    # sinnvolle Indizes
-    cur.execute(
-        "CREATE INDEX IF NOT EXISTS idx_listings_price   ON listings(price_eur)"
-    )
-    cur.execute(
-        "CREATE INDEX IF NOT EXISTS idx_listings_km      ON listings(km)")
-    cur.execute(
-        "CREATE INDEX IF NOT EXISTS idx_listings_postal  ON listings(postal_code)"
-    )
-    cur.execute(
-        "CREATE INDEX IF NOT EXISTS idx_listings_city    ON listings(city)")
-    cur.execute(
-        "CREATE INDEX IF NOT EXISTS idx_listings_title   ON listings(title)")
-    # --- MIGRATION: neue Spalten für Detaildaten (Beschreibung + Bilder) ---
-    # idempotent: wenn Spalte existiert -> try/except verhindert Crash
-    try:
-        cur.execute("ALTER TABLE listings ADD COLUMN description TEXT")
-    except Exception:
-        pass
+def _update_derived(conn, r):
+    """Abgeleitete Spalten (Fingerprint, EZ-Jahr/-Monat) aus dem gemergten Datensatz."""
+    fp = vehicle_fingerprint(r)
+    ez_year, ez_month = parse_registration(r["first_reg"], r["ez_text"])
+    if (fp, ez_year, ez_month) != (r["fingerprint"], r["ez_year"], r["ez_month"]):
+        conn.execute(f"UPDATE {LISTING_TABLE} SET fingerprint = ?, ez_year = ?, ez_month = ? WHERE rid = ?",
+                     (fp, ez_year, ez_month, r["rid"]))
 
-    try:
-        cur.execute("ALTER TABLE listings ADD COLUMN image_urls_json TEXT")
-    except Exception:
-        pass
-
-    try:
-        cur.execute("ALTER TABLE listings ADD COLUMN features_json TEXT")
-    except Exception:
-        pass
 
-    conn.commit()
+def init_db():
+    """Schema anlegen/aktualisieren – siehe migrations.py (läuft pro Prozess nur einmal)."""
+    conn = get_conn()
+    migrate(conn, DB_PATH)
     conn.close()
 
 
@@ -99,51 +52,572 @@ def upsert_listing(row: dict) -> int:
     """
     assert "id" in row, "upsert_listing: 'id' fehlt"
 
-    # dynamische Spaltenliste bauen
-    cols = list(row.keys())
-    placeholders = ",".join([":" + c for c in cols])
+    # Beschreibung/Bilder/Ausstattung gehen komprimiert nach listing_details
+    details = {c: row[c] for c in DETAIL_COLUMNS if c in row}
+    base = {c: v for c, v in row.items() if c not in details}
+
+    # dynamische Spaltenliste bauen – Kategorien (brand, city, …) als lookup-Code,
+    # platform gehört zum Schlüssel (id, platform_code) und fehlt ggf. bei Detail-Updates
+    cats = [c for c in base if c in CATEGORICAL_COLUMNS]
+    cols = [f"{c}_code" if c in CATEGORICAL_COLUMNS else c for c in base]
+    values = [f"(SELECT code FROM lookup WHERE kind = '{c}' AND value = :{c})"
+              if c in CATEGORICAL_COLUMNS else ":" + c for c in base]
+    if "platform" not in base:
+        cols.append("platform_code")
+        values.append(f"COALESCE((SELECT platform_code FROM {LISTING_TABLE} WHERE id = :id), 0)")
 
     # Vergleichswerte für WHERE (COALESCE auf Vergleichs-Typen)
     def diff_expr(c):
-        # Strings → '' ; Integers → -1
-        if c in ("price_eur", "km", "pics", "power_ps"):
-            return f"COALESCE(listings.{c}, -1) <> COALESCE(excluded.{c}, -1)"
+        # Strings → '' ; Integers/Codes → -1
+        if c in ("price_eur", "km", "pics", "power_ps", "srp_hash") or c.removesuffix("_code") in CATEGORICAL_COLUMNS:
+            return f"COALESCE({LISTING_TABLE}.{c}, -1) <> COALESCE(excluded.{c}, -1)"
         else:
-            return f"COALESCE(listings.{c}, '') <> COALESCE(excluded.{c}, '')"
+            return f"COALESCE({LISTING_TABLE}.{c}, '') <> COALESCE(excluded.{c}, '')"
 
-    diff_clauses = " OR ".join(diff_expr(c) for c in cols if c != "id")
+    keys = ("id", "platform_code")
+    diff_clauses = " OR ".join(diff_expr(c) for c in cols if c not in keys)
 
-    # falls nur id gesetzt ist, trotzdem last_seen aktualisieren
-    set_list = ", ".join([f"{c}=excluded.{c}" for c in cols if c != "id"])
+    # falls nur id gesetzt ist, trotzdem last_seen aktualisieren (bei reinen
+    # Detail-Updates entscheidet _write_details, ob sich etwas geändert hat)
+    if not diff_clauses:
+        diff_clauses = "0" if details else "1"
+    set_list = ", ".join([f"{c}=excluded.{c}" for c in cols if c not in keys])
     if set_list:
         set_list += ", "
 
     sql = f"""
-      INSERT INTO listings ({",".join(cols)})
-      VALUES ({placeholders})
-      ON CONFLICT(id) DO UPDATE SET
+      INSERT INTO {LISTING_TABLE} ({",".join(cols)})
+      VALUES ({",".join(values)})
+      ON CONFLICT(id, platform_code) DO UPDATE SET
         {set_list}last_seen = datetime('now')
       WHERE {diff_clauses}
     """
 
     conn = get_conn()
+    # Vorher-Stand für das Änderungsprotokoll (listing_events)
+    watched = [c for c in base if c not in EVENT_IGNORE]
+    old = conn.execute(f"SELECT 1{''.join(', ' + c for c in watched)} FROM listings WHERE id = ?",
+                       (row["id"], )).fetchone()
     cur = conn.cursor()
-    cur.execute(sql, row)
+    cur.executemany("INSERT OR IGNORE INTO lookup(kind, value) VALUES (?, ?)",
+                    [(c, base[c]) for c in cats if base[c] is not None])
+    cur.execute(sql, base)
     changed = cur.rowcount  # 1 = insert oder echtes update, 0 = keine Änderung
 
-    # Preis-Historie nur loggen, wenn sich Preis geändert hat
-    if "price_eur" in row and row.get("price_eur") is not None:
-        cur.execute("SELECT price_eur FROM listings WHERE id = ?",
-                    (row["id"], ))
-        current = cur.fetchone()
-        if current and current[0] == row["price_eur"] and changed:
-            # schon aktueller Preis in Zeile – Historie trotzdem nur 1x pro Änderung schreiben:
-            cur.execute(
-                """
-              INSERT INTO listing_prices(listing_id, price_eur)
-              VALUES (?, ?)
-            """, (row["id"], row["price_eur"]))
+    details_changed = False
+    if details:
+        rid = conn.execute(f"SELECT rid FROM {LISTING_TABLE} WHERE id = ?", (row["id"], )).fetchone()[0]
+        details_changed = _write_details(conn, rid, details)
+        if details_changed and not changed:
+            # nur Details neu → wie früher als Änderung zählen
+            conn.execute(f"UPDATE {LISTING_TABLE} SET last_seen = datetime('now') WHERE rid = ?", (rid, ))
+            changed = 1
+
+    # Fingerprint + EZ aus dem kompletten (gemergten) Datensatz neu berechnen
+    if changed:
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        stored = cur.execute("SELECT * FROM listings WHERE id = ?", (row["id"], )).fetchone()
+        if stored:
+            _update_derived(conn, stored)
+            # Volltext: Trigger sehen nur die komprimierten Details → hier pflegen
+            if FULLTEXT_FIELDS & row.keys() and has_fulltext(conn):
+                index_fulltext(conn, [stored["rid"]])
+
+    # Preisverlauf: nur echte Preisänderungen (gegen den letzten Punkt geprüft)
+    if changed and row.get("price_eur") is not None:
+        record_price(conn, row["id"], row["price_eur"])
+
+    if changed:
+        record_events(conn, _listing_events(row["id"], base, watched, old, details if details_changed else {}))
 
     conn.commit()
     conn.close()
     return 1 if changed else 0
+
+
+# ------------------------------------------------------------
+# Änderungsprotokoll (listing_events, gelesen von /api/changes)
+# ------------------------------------------------------------
+EVENT_IGNORE = {"id", "srp_hash"}  # interne Felder, für Clients ohne Bedeutung
+
+
+def _same(a, b) -> bool:
+    # wie diff_expr im Upsert: NULL und '' gelten als gleich
+    return (a if a is not None else "") == (b if b is not None else "")
+
+
+def _listing_events(listing_id, base, watched, old, details) -> list:
+    """Ereignisse eines Upserts: insert, price {old, new}, update {feld: [alt, neu], details: [...]}."""
+    if old is None:
+        return [(listing_id, "insert", {c: base[c] for c in ("title", "price_eur") if c in base})]
+    prev = dict(zip(watched, old[1:]))
+    events = []
+    if "price_eur" in prev and not _same(prev["price_eur"], base["price_eur"]):
+        events.append((listing_id, "price", {"old": prev["price_eur"], "new": base["price_eur"]}))
+    fields = {c: [prev[c], base[c]] for c in watched if c != "price_eur" and not _same(prev[c], base[c])}
+    if details:
+        fields["details"] = sorted(details)  # nur die Namen, die Texte sind zu groß
+    if fields:
+        events.append((listing_id, "update", fields))
+    return events
+
+
+def record_events(conn, events, ts: int = None):
+    """(listing_id, kind, data) anhängen – in der Transaktion des Aufrufers."""
+    ts = int(ts if ts is not None else time.time())
+    conn.executemany(
+        "INSERT INTO listing_events(listing_id, kind, ts, data) VALUES (?, ?, ?, ?)",
+        [(lid, kind, ts, json.dumps(data, ensure_ascii=False) if data is not None else None)
+         for lid, kind, data in events])
+
+
+def latest_event_seq(conn) -> int:
+    """Höchste je vergebene seq (auch wenn die Zeile schon ausgedünnt wurde)."""
+    r = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'listing_events'").fetchone()
+    return r[0] if r else 0
+
+
+FULLTEXT_FIELDS = {"title", "description", "features_json"}
+
+
+def _write_details(conn, rid: int, details: dict) -> bool:
+    """Gepackte Detailfelder schreiben, nur wenn sie sich unterscheiden. True = geschrieben."""
+    cols = list(details)
+    cur = conn.execute(
+        f"""INSERT INTO {DETAIL_TABLE}(rid, {", ".join(cols)}) VALUES (?{", ?" * len(cols)})
+            ON CONFLICT(rid) DO UPDATE SET {", ".join(f"{c} = excluded.{c}" for c in cols)}
+            WHERE {" OR ".join(f"{c} IS NOT excluded.{c}" for c in cols)}""",
+        [rid] + [pack_text(details[c]) for c in cols])
+    return cur.rowcount > 0
+
+
+def listing_details(conn, rids, cols=DETAIL_COLUMNS) -> dict:
+    """Entpackte Detailfelder je rid: {rid: {spalte: text}} (fehlende rids fehlen im Ergebnis)."""
+    rids = list(rids)
+    if not rids:
+        return {}
+    rows = conn.execute(
+        f"SELECT rid, {', '.join(cols)} FROM {DETAIL_TABLE} WHERE rid IN ({','.join('?' * len(rids))})",
+        rids).fetchall()
+    return {r[0]: {c: unpack_text(v) for c, v in zip(cols, r[1:])} for r in rows}
+
+
+# ------------------------------------------------------------
+# Preisverlauf (price_history: nur Änderungen, Schlüssel listing_id + ts)
+# ------------------------------------------------------------
+def record_price(conn, listing_id: str, price_eur: int, ts: int = None) -> bool:
+    """Preis anhängen, falls er sich vom letzten Punkt unterscheidet. True = geschrieben."""
+    cur = conn.execute(
+        """INSERT INTO price_history(listing_id, ts, price_eur)
+           SELECT ?, ?, ?
+           WHERE ? IS NOT (SELECT price_eur FROM price_history WHERE listing_id = ?
+                           ORDER BY ts DESC LIMIT 1)
+           ON CONFLICT(listing_id, ts) DO UPDATE SET price_eur = excluded.price_eur""",
+        (listing_id, int(ts if ts is not None else time.time()), price_eur, price_eur, listing_id))
+    return cur.rowcount > 0
+
+
+def compact_price_history(conn=None) -> int:
+    """Verwaiste Verläufe und aufeinanderfolgende gleiche Preise entfernen. Gibt gelöschte Zeilen zurück."""
+    own = conn is None
+    conn = conn or get_conn()
+    try:
+        n = conn.execute("""DELETE FROM price_history
+                            WHERE NOT EXISTS (SELECT 1 FROM listings l WHERE l.id = price_history.listing_id)
+                         """).rowcount
+        n += conn.execute("""
+          DELETE FROM price_history WHERE (listing_id, ts) IN (
+            SELECT listing_id, ts FROM (
+              SELECT listing_id, ts, price_eur,
+                     LAG(price_eur) OVER (PARTITION BY listing_id ORDER BY ts) AS prev
+              FROM price_history)
+            WHERE prev IS NOT NULL AND prev IS price_eur)""").rowcount
+        conn.commit()
+    finally:
+        if own:
+            conn.close()
+    return n
+
+
+# ------------------------------------------------------------
+# Kennzahlen für die Priorisierung im Sync
+# ------------------------------------------------------------
+KM_BUCKET = 25000
+
+
+def segment_key(ez_text, km):
+    """Segment aus SRP-Daten: (EZ-Jahr, km-Klasse). None, wenn unbekannt."""
+    year = parse_registration(None, ez_text)[0]
+    if year is None or km is None:
+        return None
+    return (year, int(km) // KM_BUCKET)
+
+
+def segment_price_averages(min_count: int = 3) -> dict:
+    """
+    Ø-Preis je Segment (EZ-Jahr, km-Klasse) aus den vorhandenen Listings.
+    Segmente mit weniger als `min_count` Angeboten werden ausgelassen.
+    """
+    conn = get_conn()
+    try:
+        # Duplikate (gleicher Fingerprint) nur einmal zählen – günstigstes Angebot
+        rows = conn.execute(
+            "SELECT ez_year, km, MIN(price_eur) FROM listings "
+            "WHERE price_eur > 0 AND km IS NOT NULL AND ez_year IS NOT NULL "
+            "GROUP BY COALESCE(fingerprint, id)"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        conn.close()
+
+    sums = {}
+    for year, km, price in rows:
+        s = sums.setdefault((year, int(km) // KM_BUCKET), [0, 0])
+        s[0] += price
+        s[1] += 1
+    return {k: s[0] / s[1] for k, s in sums.items() if s[1] >= min_count}
+
+
+def push_price_limits() -> list:
+    """Alle Preisgrenzen aus den Push-Abos (max_price bzw. price_max im Filter)."""
+    from urllib.parse import parse_qs
+
+    conn = get_conn()
+    try:
+        rows = conn.execute(
+            "SELECT filters, max_price FROM push_subscriptions").fetchall()
+    except sqlite3.OperationalError:
+        # Tabelle legt die Web-App an – Scraper kann auch ohne laufen
+        rows = []
+    finally:
+        conn.close()
+
+    limits = []
+    for filters, max_price in rows:
+        cands = []
+        if max_price:
+            cands.append(max_price)
+        pm = (parse_qs(filters or "").get("price_max") or [""])[0]
+        if pm.isdigit():
+            cands.append(int(pm))
+        if cands:
+            limits.append(min(int(c) for c in cands))
+    return limits
+
+
+def arrival_counts(platform: str, days: int = 28) -> dict:
+    """
+    Neue Listings je Wochen-Bucket (Wochentag 0=So .. 6=Sa, Stunde UTC)
+    aus der first_seen-Historie der letzten `days` Tage.
+    """
+    conn = get_conn()
+    try:
+        rows = conn.execute(
+            """
+            SELECT CAST(strftime('%w', first_seen_ts, 'unixepoch') AS INTEGER),
+                   CAST(strftime('%H', first_seen_ts, 'unixepoch') AS INTEGER),
+                   COUNT(*)
+            FROM listings
+            WHERE platform_code = (SELECT code FROM lookup WHERE kind = 'platform' AND value = ?)
+              AND first_seen_ts >= ?
+            GROUP BY 1, 2
+            """, (platform, int(time.time()) - int(days) * 86400)).fetchall()
+    except sqlite3.OperationalError:
+        # ältere Schemata ohne first_seen
+        rows = []
+    finally:
+        conn.close()
+    return {(wd, hh): n for wd, hh, n in rows if wd is not None}
+
+
+# ------------------------------------------------------------
+# Daten-Generation: ändert sich bei jedem Schreiblauf (Sync, Cleanup)
+# ------------------------------------------------------------
+def data_generation(conn=None) -> int:
+    own = conn is None
+    conn = conn or get_conn()
+    try:
+        r = conn.execute("SELECT value FROM meta WHERE key = 'data_generation'").fetchone()
+    finally:
+        if own:
+            conn.close()
+    return int(r[0]) if r else 0
+
+
+def bump_data_generation(conn=None) -> int:
+    own = conn is None
+    conn = conn or get_conn()
+    try:
+        conn.execute("""INSERT INTO meta(key, value) VALUES ('data_generation', '1')
+                        ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1""")
+        conn.commit()
+        r = conn.execute("SELECT value FROM meta WHERE key = 'data_generation'").fetchone()
+    finally:
+        if own:
+            conn.close()
+    return int(r[0])
+
+
+# ------------------------------------------------------------
+# Crawl-Checkpoint
+# ------------------------------------------------------------
+def load_checkpoint(profile: str):
+    """Gibt (state, alter_in_sekunden) zurück oder (None, None)."""
+    conn = get_conn()
+    try:
+        r = conn.execute(
+            "SELECT state_json, (julianday('now') - julianday(updated_at)) * 86400 "
+            "FROM crawl_checkpoint WHERE profile = ?", (profile, )).fetchone()
+    finally:
+        conn.close()
+    if not r:
+        return None, None
+    return json.loads(r[0]), r[1]
+
+
+def save_checkpoint(profile: str, state: dict):
+    conn = get_conn()
+    conn.execute(
+        """INSERT INTO crawl_checkpoint(profile, state_json, updated_at)
+           VALUES (?, ?, datetime('now'))
+           ON CONFLICT(profile) DO UPDATE SET state_json = excluded.state_json,
+                                             updated_at = excluded.updated_at""",
+        (profile, json.dumps(state, ensure_ascii=False)))
+    conn.commit()
+    conn.close()
+
+
+def clear_checkpoint(profile: str):
+    conn = get_conn()
+    conn.execute("DELETE FROM crawl_checkpoint WHERE profile = ?", (profile, ))
+    conn.commit()
+    conn.close()
+
+
+# ------------------------------------------------------------
+# Sync-Lease: höchstens ein Crawl gleichzeitig – über Worker, Container und runner.py
+# ------------------------------------------------------------
+LEASE_TTL_SEC = float(os.environ.get("AUTOS_LEASE_TTL_SEC", "60"))  # abgestürzter Halter → frei danach
+SYNC_DEBOUNCE_SEC = 30.0  # nach einem vollständigen Lauf so lange keinen neuen starten
+
+
+def acquire_lease(name: str, holder: str, ttl: float = LEASE_TTL_SEC, debounce_sec: float = 0.0) -> bool:
+    """Lease nehmen, wenn sie frei/abgelaufen ist und der letzte vollständige Lauf länger als
+    debounce_sec zurückliegt. Ein UPDATE – atomar auch zwischen Prozessen."""
+    now = time.time()
+    conn = get_conn()
+    try:
+        conn.execute("INSERT OR IGNORE INTO sync_lease(name) VALUES (?)", (name, ))
+        n = conn.execute("""
+            UPDATE sync_lease SET holder = ?, expires_ts = ?, heartbeat_ts = ?
+            WHERE name = ? AND (holder IS NULL OR holder = ? OR expires_ts < ?)
+              AND last_completed_ts <= ?""",
+            (holder, now + ttl, now, name, holder, now, now - debounce_sec)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return n == 1
+
+
+def renew_lease(name: str, holder: str, ttl: float = LEASE_TTL_SEC) -> bool:
+    """Heartbeat; False, wenn die Lease inzwischen jemand anderem gehört."""
+    now = time.time()
+    conn = get_conn()
+    try:
+        n = conn.execute("UPDATE sync_lease SET expires_ts = ?, heartbeat_ts = ? WHERE name = ? AND holder = ?",
+                         (now + ttl, now, name, holder)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return n == 1
+
+
+def release_lease(name: str, holder: str, completed: bool = True):
+    """Lease freigeben; completed=True setzt last_completed_ts (Debounce für alle)."""
+    now = time.time()
+    conn = get_conn()
+    try:
+        conn.execute("""
+            UPDATE sync_lease SET holder = NULL, expires_ts = 0, heartbeat_ts = ?,
+                   last_completed_ts = CASE WHEN ? THEN ? ELSE last_completed_ts END
+            WHERE name = ? AND holder = ?""", (now, completed, now, name, holder))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def lease_status(name: str = "sync") -> dict:
+    conn = get_conn()
+    try:
+        r = conn.execute("SELECT holder, expires_ts, heartbeat_ts, last_completed_ts FROM sync_lease WHERE name = ?",
+                         (name, )).fetchone()
+    finally:
+        conn.close()
+    if not r:
+        return {"name": name, "holder": None}
+    return {"name": name, "holder": r[0] if r[1] >= time.time() else None,
+            "expires_ts": r[1], "heartbeat_ts": r[2], "last_completed_ts": r[3]}
+
+
+@contextmanager
+def sync_lease(debounce_sec: float = SYNC_DEBOUNCE_SEC, name: str = "sync"):
+    """
+    with sync_lease() as lease:
+        if lease is None: return      # läuft woanders oder gerade erst gelaufen
+        ...; lease["completed"] = False   # Teil-Lauf → Debounce nicht setzen
+    Ein Heartbeat-Thread verlängert die Lease, solange der Block läuft.
+    """
+    holder = f"{socket.gethostname()}:{os.getpid()}:{os.urandom(4).hex()}"
+    if not acquire_lease(name, holder, debounce_sec=debounce_sec):
+        yield None
+        return
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(LEASE_TTL_SEC / 3):
+            if not renew_lease(name, holder):
+                print(f"[WARN] Sync-Lease {name} verloren ({holder})")
+                return
+
+    t = threading.Thread(target=heartbeat, name="lease-heartbeat", daemon=True)
+    t.start()
+    lease = {"holder": holder, "completed": True}
+    try:
+        yield lease
+    except BaseException:
+        lease["completed"] = False
+        raise
+    finally:
+        stop.set()
+        t.join()
+        release_lease(name, holder, completed=lease["completed"])
+
+
+# ------------------------------------------------------------
+# Latenz-Messung (posted_at → first_seen → Details → Push)
+# ------------------------------------------------------------
+def existing_ids(ids) -> set:
+    ids = [str(i) for i in ids]
+    if not ids:
+        return set()
+    conn = get_conn()
+    rows = conn.execute(
+        f"SELECT id FROM listings WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+    conn.close()
+    return {r[0] for r in rows}
+
+
+def _posted_ts(posted_at):
+    # "YYYY-MM-DD 00:00" kommt aus reinen Datumsangaben → keine Uhrzeit bekannt
+    if not posted_at or posted_at.endswith(" 00:00"):
+        return None
+    try:
+        return datetime.strptime(posted_at, "%Y-%m-%d %H:%M").timestamp()
+    except ValueError:
+        return None
+
+
+def record_discovered(rows, profile: str):
+    """Erstsichtung neuer Listings festhalten (nur der erste Eintrag zählt)."""
+    if not rows:
+        return
+    now = time.time()
+    conn = get_conn()
+    conn.executemany(
+        "INSERT OR IGNORE INTO listing_latency(listing_id, profile, posted_ts, discovered_ts) "
+        "VALUES (?, ?, ?, ?)",
+        [(r["id"], profile, _posted_ts(r.get("posted_at")), now) for r in rows])
+    conn.commit()
+    conn.close()
+
+
+def record_enriched(listing_id: str):
+    conn = get_conn()
+    conn.execute(
+        "UPDATE listing_latency SET enriched_ts = COALESCE(enriched_ts, ?) WHERE listing_id = ?",
+        (time.time(), listing_id))
+    conn.commit()
+    conn.close()
+
+
+def push_subscription_filters() -> list:
+    """Filter aller Push-Abos als dict (Querystring geparst, max_price → price_max)."""
+    from urllib.parse import parse_qs
+
+    conn = get_conn()
+    try:
+        rows = conn.execute(
+            "SELECT filters, max_price FROM push_subscriptions").fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        conn.close()
+
+    out = []
+    for filters, max_price in rows:
+        f = {k: v[0] for k, v in parse_qs(filters or "").items() if v}
+        if max_price and (not str(f.get("price_max", "")).isdigit()
+                          or int(max_price) < int(f["price_max"])):
+            f["price_max"] = str(max_price)
+        out.append(f)
+    return out
+
+
+# ------------------------------------------------------------
+# SRP-Zeilen-Cache: unveränderte Zeilen ohne Upsert überspringen
+# ------------------------------------------------------------
+SRP_FIELDS = ("platform", "url", "title", "price_eur", "km", "ez_text", "location",
+              "postal_code", "city", "posted_at", "pics")
+SRP_CACHE_MAX_AGE_SEC = 10 * 60  # danach neu aus der DB laden (andere Prozesse)
+
+_srp_cache = {"loaded_at": 0.0, "hashes": {}}
+
+
+def srp_hash(row: dict) -> int:
+    """Kompakter 64-bit-Hash der SRP-Felder (passt in SQLite INTEGER)."""
+    raw = json.dumps([row.get(k) for k in SRP_FIELDS], ensure_ascii=False)
+    return int.from_bytes(hashlib.blake2b(raw.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+def warm_srp_cache(force: bool = False) -> dict:
+    now = time.monotonic()
+    if force or not _srp_cache["loaded_at"] or (now - _srp_cache["loaded_at"]) > SRP_CACHE_MAX_AGE_SEC:
+        conn = get_conn()
+        try:
+            rows = conn.execute(
+                "SELECT id, srp_hash FROM listings WHERE srp_hash IS NOT NULL").fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        finally:
+            conn.close()
+        _srp_cache["hashes"] = dict(rows)
+        _srp_cache["loaded_at"] = now
+    return _srp_cache["hashes"]
+
+
+def remember_srp_hash(listing_id: str, h: int):
+    _srp_cache["hashes"][listing_id] = h
+
+
+def touch_listings(ids):
+    """Nur last_seen für unveränderte Listings setzen – ein Statement pro Batch.
+    Keine neue Daten-Generation: Inhalt und Trefferzahlen bleiben gleich; der Schnappschuss
+    holt last_seen in groben Fenstern nach (snapshot.SEEN_REFRESH_SEC). Auf dem Leader geht
+    der ganze Batch als EIN repl_log-Eintrag raus – die Capture-Trigger lassen last_seen aus."""
+    ids = list(ids)
+    if not ids:
+        return
+    conn = get_conn()
+    try:
+        now = conn.execute("SELECT datetime('now')").fetchone()[0]
+        conn.execute(f"UPDATE {LISTING_TABLE} SET last_seen = ? WHERE id IN ({','.join('?' * len(ids))})",
+                     [now] + ids)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                        (f"trg_repl_{LISTING_TABLE}_update", )).fetchone():
+            conn.execute("INSERT INTO repl_log(tbl, key) VALUES (?, ?)",
+                         (REPL_TOUCH, json.dumps({"last_seen": now, "ids": ids})))
+        conn.commit()
+    finally:
+        conn.close()
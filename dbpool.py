@@ -0,0 +1,155 @@
+# dbpool.py — gepoolte, getunte SQLite-Verbindungen (ein Pool pro Prozess und DB-Datei)
+#
+# app.get_db() und db.get_conn() holen sich hier eine Verbindung; close() gibt sie
+# an den Pool zurück statt sie zu schließen. Pragmas werden nur beim Öffnen gesetzt.
+import os
+import sqlite3
+import threading
+
+import geo
+
+# Pragma-Profil für neue Verbindungen (WAL + NORMAL ist in WAL crash-sicher)
+PRAGMAS = {
+    # nur wirksam, solange die Datei noch keine Tabellen hat → muss vor journal_mode stehen
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": -int(os.environ.get("SQLITE_CACHE_KIB", "16384")),   # negativ = KiB
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_MB", "128")) * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+MAX_IDLE = int(os.environ.get("SQLITE_POOL_MAX_IDLE", "8"))
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PooledConnection:
+    """Dünner Proxy um sqlite3.Connection; close() gibt an den Pool zurück."""
+
+    __slots__ = ("_raw", "_pool", "_readonly")
+
+    def __init__(self, raw, pool, readonly):
+        object.__setattr__(self, "_raw", raw)
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_readonly", readonly)
+
+    def __getattr__(self, name):
+        raw = object.__getattribute__(self, "_raw")
+        if raw is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(raw, name)
+
+    def __setattr__(self, name, value):
+        # z.B. conn.row_factory = sqlite3.Row
+        setattr(self._raw, name, value)
+
+    def __enter__(self):
+        return self._raw.__enter__()
+
+    def __exit__(self, *exc):
+        return self._raw.__exit__(*exc)
+
+    def close(self):
+        raw = self._raw
+        if raw is None:
+            return
+        object.__setattr__(self, "_raw", None)
+        self._pool.release(raw, self._readonly)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._idle = {False: [], True: []}
+        self._pid = os.getpid()
+        self.stats = {"opened": 0, "reused": 0, "closed": 0, "in_use": 0}
+
+    def _open(self, readonly):
+        raw = sqlite3.connect(self.path, check_same_thread=False)
+        for k, v in PRAGMAS.items():
+            raw.execute(f"PRAGMA {k}={v}")
+        if readonly:
+            raw.execute("PRAGMA query_only=1")
+        geo.register(raw)  # distance_km() für Umkreisfilter/-sortierung
+        self.stats["opened"] += 1
+        return raw
+
+    def acquire(self, readonly=False) -> PooledConnection:
+        with self._lock:
+            if self._pid != os.getpid():
+                # nach fork(): geerbte Verbindungen nicht weiterverwenden
+                self._idle = {False: [], True: []}
+                self._pid = os.getpid()
+            raw = self._idle[readonly].pop() if self._idle[readonly] else None
+            if raw is not None:
+                self.stats["reused"] += 1
+            self.stats["in_use"] += 1
+        if raw is None:
+            raw = self._open(readonly)
+        return PooledConnection(raw, self, readonly)
+
+    def release(self, raw, readonly):
+        try:
+            if raw.in_transaction:
+                raw.rollback()  # wie bisher: nicht committete Änderungen verwerfen
+            raw.row_factory = None
+        except sqlite3.Error:
+            raw = None
+        with self._lock:
+            self.stats["in_use"] -= 1
+            if raw is not None and self._pid == os.getpid() and len(self._idle[readonly]) < MAX_IDLE:
+                self._idle[readonly].append(raw)
+                return
+        if raw is not None:
+            raw.close()
+            self.stats["closed"] += 1
+
+    def clear(self):
+        with self._lock:
+            idle = self._idle[False] + self._idle[True]
+            self._idle = {False: [], True: []}
+        for raw in idle:
+            raw.close()
+            self.stats["closed"] += 1
+
+
+def _pool(path) -> ConnectionPool:
+    with _pools_lock:
+        p = _pools.get(path)
+        if p is None:
+            p = _pools[path] = ConnectionPool(path)
+        return p
+
+
+def connect(path, readonly=False) -> PooledConnection:
+    """Verbindung aus dem Pool; readonly=True → PRAGMA query_only für Lesepfade."""
+    return _pool(path).acquire(readonly)
+
+
+def configure(**pragmas):
+    """Pragma-Profil ändern (z.B. configure(cache_size=-65536)); gilt für neue Verbindungen."""
+    PRAGMAS.update(pragmas)
+    with _pools_lock:
+        pools = list(_pools.values())
+    for p in pools:
+        p.clear()
+
+
+def pool_stats() -> dict:
+    with _pools_lock:
+        pools = dict(_pools)
+    return {
+        "pragmas": dict(PRAGMAS),
+        "max_idle": MAX_IDLE,
+        "pools": {path: dict(p.stats, idle=len(p._idle[False]), idle_readonly=len(p._idle[True]))
+                  for path, p in pools.items()},
+    }
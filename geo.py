@@ -0,0 +1,135 @@
+# geo.py — PLZ → Koordinaten, Entfernungen und Umkreis-Boxen für die Umkreissuche
+#
+# plz_centroids.csv (mitgeliefert) enthält nur die 95 zweistelligen Leitregionen mit dem
+# Hauptort als Näherung. Ein Ort liegt davon leicht 20–40 km weg (85221 Dachau ↔ Region 85:
+# 27 km) – Entfernungen sind damit nur grob, Umkreise werden um REGION_ERROR_KM je Seite
+# erweitert (search_radius_km), damit nichts fälschlich herausfällt; sie schließen dafür mehr
+# ein. Eine vollständige Tabelle mit fünfstelligen PLZ (Spalten plz, lat, lon; Trenner , oder ;)
+# kann per AUTOS_PLZ_CSV dazugelegt werden; gesucht wird immer erst die volle PLZ, dann die Region.
+# Dieselben Zeilen liegen in der DB (plz_centroids): Trigger setzen damit lat/lon beim
+# Ingest und pflegen den R*Tree listings_geo (migrations._m009_geo).
+# Nach Austausch der Tabelle:  python geo.py [autos.db]
+import os
+import sys
+import csv
+import math
+
+BUNDLED_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plz_centroids.csv")
+EXTRA_CSV = os.environ.get("AUTOS_PLZ_CSV", "")
+DEFAULT_RADIUS_KM = 50
+MAX_RADIUS_KM = 1000
+EARTH_RADIUS_KM = 6371.0
+# Typische Abweichung eines Orts vom Hauptort seiner Leitregion
+REGION_ERROR_KM = 30
+
+_centroids = None
+
+
+def read_csv(path):
+    """(plz, lat, lon) je Zeile; Kopfzeile mit plz/lat/lon, kaputte Zeilen werden übersprungen."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        head = f.readline()
+        f.seek(0)
+        delim = ";" if head.count(";") > head.count(",") else ","
+        for row in csv.DictReader(f, delimiter=delim):
+            try:
+                yield row["plz"].strip(), float(row["lat"]), float(row["lon"])
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+
+
+def centroid_rows():
+    rows = list(read_csv(BUNDLED_CSV))
+    if EXTRA_CSV and os.path.exists(EXTRA_CSV):
+        rows += read_csv(EXTRA_CSV)
+    return rows
+
+
+def _table():
+    global _centroids
+    if _centroids is None:
+        _centroids = {plz: (lat, lon) for plz, lat, lon in centroid_rows()}
+    return _centroids
+
+
+def _valid(code):
+    return code.isascii() and code.isdigit() and len(code) >= 2
+
+
+def plz_centroid(code):
+    """(lat, lon) zur PLZ – volle PLZ, sonst Leitregion (erste zwei Ziffern); sonst None.
+    Bei der Leitregion bis etwa REGION_ERROR_KM daneben (siehe centroid_error_km)."""
+    code = (code or "").strip()
+    if not _valid(code):
+        return None
+    return _table().get(code) or _table().get(code[:2])
+
+
+def has_full_plz() -> bool:
+    """True, wenn fünfstellige PLZ geladen sind (AUTOS_PLZ_CSV) – Listings liegen dann genau."""
+    return any(len(plz) == 5 for plz in _table())
+
+
+def centroid_error_km(code) -> float:
+    """Wie weit plz_centroid(code) vom echten Ort weg sein kann: 0 bei voller PLZ, sonst Region."""
+    code = (code or "").strip()
+    return 0 if _valid(code) and code in _table() else REGION_ERROR_KM
+
+
+def search_radius_km(radius, code) -> float:
+    """Grenze für distance_km zwischen Schwerpunkten, damit kein Listing im echten Radius fehlt:
+    Radius + Fehler des Mittelpunkts + Fehler der Listing-Koordinaten (ohne fünfstellige
+    Tabelle ebenfalls nur Leitregion). Dafür kommen Listings bis so weit draußen mit."""
+    return radius + centroid_error_km(code) + (0 if has_full_plz() else REGION_ERROR_KM)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Großkreis-Entfernung (Haversine); None, wenn eine Koordinate fehlt."""
+    if lat1 is None or lon1 is None or lat2 is None or lon2 is None:
+        return None
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((p2 - p1) / 2) ** 2
+         + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bbox(lat, lon, radius_km):
+    """Umschließendes Rechteck (lat_min, lat_max, lon_min, lon_max) für den R*Tree-Lookup."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+def radius_km(v):
+    """radius_km-Parameter → km (Standard DEFAULT_RADIUS_KM, begrenzt auf 1..MAX_RADIUS_KM)."""
+    try:
+        r = int(v)
+    except (TypeError, ValueError):
+        return DEFAULT_RADIUS_KM
+    return min(max(r, 1), MAX_RADIUS_KM)
+
+
+def register(conn):
+    """distance_km(lat1, lon1, lat2, lon2) als SQL-Funktion (dbpool ruft das je Verbindung auf)."""
+    conn.create_function("distance_km", 4, distance_km, deterministic=True)
+
+
+def main():
+    import sqlite3
+    from db import bump_data_generation
+    from migrations import migrate, load_centroids, refresh_geo
+
+    path = next((a for a in sys.argv[1:] if not a.startswith("-")), os.environ.get("AUTOS_DB", "autos.db"))
+    conn = sqlite3.connect(path, isolation_level=None)
+    migrate(conn)
+    conn.execute("BEGIN IMMEDIATE")
+    n = load_centroids(conn)
+    refresh_geo(conn)
+    conn.execute("COMMIT")
+    bump_data_generation(conn)
+    located = conn.execute("SELECT COUNT(*) FROM listings WHERE lat IS NOT NULL").fetchone()[0]
+    print(f"{n} PLZ-Schwerpunkte geladen, {located} Listings mit Koordinaten")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# maintenance.py — Online-Wartung für autos.db in kleinen Schritten (ersetzt das alte cleanup.py)
+# Start: python3 maintenance.py [--budget SEK] [--convert] [--compact]
+#
+# Jeder Schritt ist eine kurze Schreibtransaktion; dazwischen kommen Scraper und Web-App
+# wieder an die DB. Kein volles VACUUM – freie Seiten gibt incremental_vacuum stückweise
+# zurück (auto_vacuum=INCREMENTAL, für neue DBs in dbpool.PRAGMAS gesetzt).
+# --convert stellt eine bestehende DB einmalig per VACUUM um (blockiert, nur manuell),
+# --compact dünnt price_history auf echte Preiswechsel aus (ganze Tabelle, nur manuell).
+# Abgelaufene Listings wandern ins Archiv-Tier (archive.py); AUTOS_ARCHIVE=0 löscht sie wie früher.
+import os
+import sys
+import time
+import sqlite3
+
+import dbpool
+import archive
+import replication
+from db import bump_data_generation, compact_price_history, record_events
+from migrations import migrate, has_fulltext, LISTING_TABLE
+
+DB_PATH = os.environ.get("AUTOS_DB", "autos.db")
+RETENTION_DAYS = int(os.environ.get("AUTOS_RETENTION_DAYS", "14"))
+BUDGET_SEC = float(os.environ.get("MAINT_BUDGET_SEC", "30"))
+ARCHIVE_EXPIRED = os.environ.get("AUTOS_ARCHIVE", "1") != "0"
+EVENT_RETENTION_DAYS = int(os.environ.get("AUTOS_EVENT_RETENTION_DAYS", "7"))  # listing_events
+BATCH_ROWS = 50            # Listings je Lösch-Transaktion (≈ 20 ms Schreibsperre)
+VACUUM_STEP_PAGES = 256    # Seiten je incremental_vacuum-Aufruf
+FTS_MERGE_PAGES = 200      # Arbeit je FTS5-'merge'-Schritt
+PAUSE_SEC = 0.02           # Luft für andere Schreiber zwischen zwei Schritten
+
+# Tabellen mit listing_id, die mit dem Listing verschwinden (price_history geht ggf. mit ins Archiv)
+CHILD_TABLES = ("price_history", "deal_scores", "listing_latency")
+TRANSIENT_TABLES = ("deal_scores", "listing_latency")
+
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    for k, v in dbpool.PRAGMAS.items():
+        conn.execute(f"PRAGMA {k}={v}")
+    return conn
+
+
+def _write(conn, fn):
+    """fn(conn) in einer kurzen IMMEDIATE-Transaktion ausführen."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        res = fn(conn)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    time.sleep(PAUSE_SEC)
+    return res
+
+
+def _in(ids):
+    return ",".join("?" * len(ids))
+
+
+def expire_listings(conn, deadline) -> int:
+    """Listings ohne Favorit, die länger als RETENTION_DAYS nicht gesehen wurden, batchweise
+    ins Archiv verschieben (bzw. löschen, wenn das Archiv abgeschaltet ist)."""
+    cutoff = int(time.time()) - RETENTION_DAYS * 86400
+    to_archive = ARCHIVE_EXPIRED and archive.attach(conn, create=True)
+    total = 0
+    while time.monotonic() < deadline:
+        # Lesen außerhalb der Schreibtransaktion (WAL: blockiert niemanden)
+        rows = conn.execute("""
+            SELECT rid, id FROM listings l
+            WHERE last_seen_ts < ?
+              AND NOT EXISTS (SELECT 1 FROM favorites f WHERE f.listing_id = l.id)
+            LIMIT ?""", (cutoff, BATCH_ROWS)).fetchall()
+        if not rows:
+            break
+        rids = [r[0] for r in rows]
+        ids = [r[1] for r in rows]
+
+        def delete(c):
+            record_events(c, [(i, "expire", None) for i in ids])
+            if to_archive:
+                for t in TRANSIENT_TABLES:
+                    c.execute(f"DELETE FROM {t} WHERE listing_id IN ({_in(ids)})", ids)
+                return archive.move_listings(c, ids)
+            for t in CHILD_TABLES:
+                c.execute(f"DELETE FROM {t} WHERE listing_id IN ({_in(ids)})", ids)
+            return c.execute(f"DELETE FROM {LISTING_TABLE} WHERE rid IN ({_in(rids)})", rids).rowcount
+
+        total += _write(conn, delete)
+    return total
+
+
+def sweep_orphans(conn, table, deadline) -> int:
+    """Zeilen ohne Listing (z.B. aus früheren Läufen) per Keyset über listing_id entfernen."""
+    total = 0
+    last = ""
+    while time.monotonic() < deadline:
+        ids = [r[0] for r in conn.execute(f"""
+            SELECT DISTINCT listing_id FROM {table} x
+            WHERE listing_id > ?
+              AND NOT EXISTS (SELECT 1 FROM listings l WHERE l.id = x.listing_id)
+            ORDER BY listing_id LIMIT ?""", (last, BATCH_ROWS))]
+        if not ids:
+            break
+        last = ids[-1]
+        total += _write(conn, lambda c: c.execute(
+            f"DELETE FROM {table} WHERE listing_id IN ({_in(ids)})", ids).rowcount)
+    return total
+
+
+def prune_events(conn, deadline) -> int:
+    """Alte listing_events löschen – seq steigt mit ts, also immer vom Anfang her.
+    Clients mit älterem since bekommen von /api/changes ein reset."""
+    cutoff = int(time.time()) - EVENT_RETENTION_DAYS * 86400
+    total = 0
+    while time.monotonic() < deadline:
+        n = _write(conn, lambda c: c.execute("""
+            DELETE FROM listing_events WHERE ts < ? AND seq IN (
+              SELECT seq FROM listing_events ORDER BY seq LIMIT ?)""", (cutoff, BATCH_ROWS * 20)).rowcount)
+        total += n
+        if n < BATCH_ROWS * 20:
+            break
+    return total
+
+
+def merge_fulltext(conn, deadline) -> int:
+    """FTS5-Segmente schrittweise zusammenführen (statt 'optimize' in einem Rutsch)."""
+    if not has_fulltext(conn):
+        return 0
+    steps = 0
+    while time.monotonic() < deadline and steps < 50:
+        before = conn.total_changes
+        _write(conn, lambda c: c.execute(
+            "INSERT INTO listings_fts(listings_fts, rank) VALUES ('merge', ?)", (FTS_MERGE_PAGES, )))
+        steps += 1
+        if conn.total_changes - before <= 1:  # nichts mehr zu tun
+            break
+    return steps
+
+
+def incremental_vacuum(conn, deadline) -> int:
+    """Freie Seiten in kleinen Portionen an das Dateisystem zurückgeben."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    freed = 0
+    while time.monotonic() < deadline:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            break
+        conn.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})").fetchall()
+        freed += min(free, VACUUM_STEP_PAGES)
+        time.sleep(PAUSE_SEC)
+    return freed
+
+
+def convert_to_incremental(conn):
+    """Einmalig: bestehende DB auf auto_vacuum=INCREMENTAL umstellen (volles VACUUM!)."""
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # rid ist INTEGER PRIMARY KEY (Migration 10) → VACUUM behält die Schlüssel,
+    # Volltext- und Geo-Index bleiben gültig
+    conn.execute("VACUUM")
+
+
+def run(budget_sec: float = BUDGET_SEC, convert: bool = False, compact: bool = False) -> dict:
+    t0 = time.monotonic()
+    deadline = t0 + budget_sec
+    conn = _connect()
+    try:
+        migrate(conn, DB_PATH)
+        if convert and conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            convert_to_incremental(conn)
+
+        res = {"expired": 0, "orphans": 0, "events_pruned": 0}
+        # Follower: Listings, price_history und listing_events gehören dem Leader (replication.py)
+        if replication.ROLE != "follower":
+            res["expired"] = expire_listings(conn, deadline)
+            res["orphans"] = sum(sweep_orphans(conn, t, deadline) for t in CHILD_TABLES)
+            if compact:
+                res["orphans"] += compact_price_history(conn)
+            if res["expired"] or res["orphans"]:
+                bump_data_generation(conn)
+            res["events_pruned"] = prune_events(conn, deadline)
+        res["fts_merge_steps"] = merge_fulltext(conn, deadline)
+        res["vacuum_pages"] = incremental_vacuum(conn, deadline)
+
+        # Statistiken nur dort auffrischen, wo SQLite es für nötig hält (begrenzt)
+        conn.execute("PRAGMA analysis_limit = 400")
+        conn.execute("PRAGMA optimize")
+        # PASSIVE wartet nie auf Leser/Schreiber; was nicht geht, macht der nächste Lauf
+        busy, wal_pages, done = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        res["wal"] = {"busy": busy, "pages": wal_pages, "checkpointed": done}
+        res["auto_vacuum"] = {0: "none", 1: "full", 2: "incremental"}.get(
+            conn.execute("PRAGMA auto_vacuum").fetchone()[0])
+        res["archive"] = archive.archive_stats(conn)
+    finally:
+        conn.close()
+    res["elapsed_sec"] = round(time.monotonic() - t0, 2)
+    return res
+
+
+def main():
+    budget = BUDGET_SEC
+    if "--budget" in sys.argv:
+        budget = float(sys.argv[sys.argv.index("--budget") + 1])
+    res = run(budget, convert="--convert" in sys.argv, compact="--compact" in sys.argv)
+    print(f"Wartung: {res['expired']} alte Listings {'archiviert' if ARCHIVE_EXPIRED else 'gelöscht'}, "
+          f"{res['orphans']} verwaiste Zeilen, "
+          f"{res['vacuum_pages']} Seiten freigegeben ({res['elapsed_sec']}s)")
+    if res["auto_vacuum"] != "incremental":
+        print("[i] auto_vacuum ist nicht INCREMENTAL – einmalig mit --convert umstellen", file=sys.stderr)
+    return res
+
+
+if __name__ == "__main__":
+    main()
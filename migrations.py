@@ -0,0 +1,756 @@
+# migrations.py — versionierte Schema-Migrationen für autos.db
+#
+# Jede Migration läuft genau einmal; der Stand steht in `schema_version`.
+# app.init_db() und db.init_db() rufen beide migrate() auf – danach ist das
+# Schema identisch, egal welcher Prozess die Datei zuerst angelegt hat.
+#
+# Prüfen der Query-Pläne:  python migrations.py --explain [autos.db]
+#   (automatisch auf leerer und gefüllter Wegwerf-DB: python -m pytest, tests/test_query_plans.py)
+# Upgrade der Alt-Schemata: python migrations.py --legacy
+import os
+import re
+import sys
+import zlib
+import sqlite3
+
+import geo
+from vehicle import vehicle_fingerprint, parse_registration
+
+# Vereinigung der bisherigen listings-Schemata aus app.py und db.py
+LISTING_COLUMNS = [
+    ("id", "TEXT PRIMARY KEY"),
+    ("platform", "TEXT"),
+    ("url", "TEXT"),
+    ("title", "TEXT"),
+    ("price_eur", "INTEGER"),
+    ("km", "INTEGER"),
+    ("ez_text", "TEXT"),
+    ("location", "TEXT"),
+    ("postal_code", "TEXT"),
+    ("city", "TEXT"),
+    ("posted_at", "TEXT"),
+    ("pics", "INTEGER"),
+    ("brand", "TEXT"),
+    ("model", "TEXT"),
+    ("fuel", "TEXT"),
+    ("power_ps", "INTEGER"),
+    ("gearbox", "TEXT"),
+    ("doors", "TEXT"),
+    ("hu_until", "TEXT"),
+    ("emission_class", "TEXT"),
+    ("color", "TEXT"),
+    ("upholstery", "TEXT"),
+    ("first_reg", "TEXT"),
+    ("first_seen", "TEXT DEFAULT (datetime('now'))"),
+    ("last_seen", "TEXT DEFAULT (datetime('now'))"),
+    ("status", "TEXT DEFAULT 'active'"),
+    ("description", "TEXT"),
+    ("image_urls_json", "TEXT"),
+    ("features_json", "TEXT"),
+    ("fingerprint", "TEXT"),
+    ("srp_hash", "INTEGER"),
+]
+
+
+def _m001_base_schema(conn):
+    cols = ",\n        ".join(f"{c} {t}" for c, t in LISTING_COLUMNS)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS listings (\n        {cols}\n    )")
+
+    # Bestehende Dateien (altes app- oder db-Schema) auf den gleichen Stand bringen.
+    # ADD COLUMN erlaubt keine Ausdrucks-Defaults → per Trigger nachziehen.
+    have = {r[1]: r[4] for r in conn.execute("PRAGMA table_info(listings)")}
+    for c, t in LISTING_COLUMNS:
+        if c in have and (have[c] is not None or "datetime('now')" not in t):
+            continue
+        if "datetime('now')" in t:
+            if c not in have:
+                conn.execute(f"ALTER TABLE listings ADD COLUMN {c} TEXT")
+            conn.execute(f"UPDATE listings SET {c} = COALESCE(last_seen, datetime('now')) WHERE {c} IS NULL"
+                         if c == "first_seen" else f"UPDATE listings SET {c} = datetime('now') WHERE {c} IS NULL")
+            conn.execute(f"""
+              CREATE TRIGGER IF NOT EXISTS trg_listings_default_{c} AFTER INSERT ON listings
+              WHEN NEW.{c} IS NULL
+              BEGIN UPDATE listings SET {c} = datetime('now') WHERE rowid = NEW.rowid; END""")
+        else:
+            conn.execute(f"ALTER TABLE listings ADD COLUMN {c} {t}")
+
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS listing_prices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        listing_id TEXT NOT NULL,
+        price_eur  INTEGER,
+        seen_at    TEXT DEFAULT (datetime('now'))
+      )""")
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS push_subscriptions (
+        id INTEGER PRIMARY KEY,
+        endpoint TEXT UNIQUE,
+        p256dh TEXT, auth TEXT,
+        filters TEXT,
+        max_price INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+      )""")
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS push_sent (
+        endpoint TEXT NOT NULL,
+        listing_id TEXT NOT NULL,
+        sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (endpoint, listing_id)
+      )""")
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS favorites (
+        listing_id TEXT PRIMARY KEY,
+        status TEXT DEFAULT 'interessant',
+        note TEXT DEFAULT '',
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+      )""")
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS deal_scores (
+        listing_id TEXT PRIMARY KEY,
+        score INTEGER DEFAULT 0,
+        ka_avg INTEGER,
+        as_avg INTEGER,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+      )""")
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS mobile_price_cache (
+        url_hash TEXT PRIMARY KEY,
+        search_url TEXT,
+        count INTEGER,
+        avg_price INTEGER,
+        prices_json TEXT,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+      )""")
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS crawl_checkpoint (
+        profile    TEXT PRIMARY KEY,
+        state_json TEXT NOT NULL,
+        updated_at TEXT DEFAULT (datetime('now'))
+      )""")
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS listing_latency (
+        listing_id    TEXT PRIMARY KEY,
+        profile       TEXT,
+        posted_ts     REAL,
+        discovered_ts REAL,
+        enriched_ts   REAL,
+        notified_ts   REAL
+      )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_latency_discovered ON listing_latency(discovered_ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_listings_fingerprint ON listings(fingerprint)")
+
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT * FROM listings WHERE fingerprint IS NULL "
+                        "AND brand IS NOT NULL AND model IS NOT NULL").fetchall()
+    conn.row_factory = None
+    conn.executemany("UPDATE listings SET fingerprint = ? WHERE id = ?",
+                     [(vehicle_fingerprint(r), r["id"]) for r in rows])
+
+
+def _m002_query_indexes(conn):
+    # Titel/Stadt werden nur per LIKE '%x%' gefiltert → Index nutzlos, kostet nur Schreibzeit
+    conn.execute("DROP INDEX IF EXISTS idx_listings_title")
+    conn.execute("DROP INDEX IF EXISTS idx_listings_city")
+    conn.execute("DROP INDEX IF EXISTS idx_listings_km")
+
+    # Ein Index je Sortierung in build_query – Ausdrücke exakt wie im ORDER BY,
+    # damit die erste Seite ein Index-Scan mit frühem Abbruch ist (kein Temp-B-Tree)
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_listings_sort_posted
+                    ON listings((posted_at IS NULL), posted_at DESC, last_seen DESC)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_listings_sort_price_asc
+                    ON listings((price_eur IS NULL), price_eur ASC, last_seen DESC)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_listings_sort_price_desc
+                    ON listings((price_eur IS NULL), price_eur DESC, last_seen DESC)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_listings_sort_km_asc
+                    ON listings((km IS NULL), km ASC, last_seen DESC)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_listings_sort_km_desc
+                    ON listings((km IS NULL), km DESC, last_seen DESC)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_listings_sort_seen ON listings(last_seen DESC)")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_listings_sort_title
+                    ON listings(title COLLATE NOCASE, last_seen DESC)""")
+
+    # Partiell: nur Listings mit Datum – "neueste" für Push und posted_days-Filter
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_listings_posted_recent
+                    ON listings(posted_at DESC, last_seen DESC) WHERE posted_at IS NOT NULL""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_listings_price ON listings(price_eur)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_listings_postal ON listings(postal_code)")
+    conn.execute("ANALYZE")
+
+
+def _m003_registration_year(conn):
+    # EZ als Integer statt CASE/substr pro Zeile in build_query
+    have = {r[1] for r in conn.execute("PRAGMA table_info(listings)")}
+    for c in ("ez_year", "ez_month"):
+        if c not in have:
+            conn.execute(f"ALTER TABLE listings ADD COLUMN {c} INTEGER")
+    rows = conn.execute("SELECT id, first_reg, ez_text FROM listings").fetchall()
+    conn.executemany("UPDATE listings SET ez_year = ?, ez_month = ? WHERE id = ?",
+                     [parse_registration(fr, ez) + (lid, ) for lid, fr, ez in rows])
+    # Standardansicht: ez_year >= 2012 AND price_eur <= 9000 → Range-Scan
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_listings_ez_price ON listings(ez_year, price_eur)")
+    conn.execute("ANALYZE")
+
+
+FTS_TOKENIZE = "unicode61 remove_diacritics 2"  # ä/ö/ü/ß-tolerant, case-insensitiv
+
+
+def _m004_fulltext(conn):
+    # Volltext über Titel, Beschreibung, Ausstattung; rowid = listings.rowid
+    try:
+        conn.execute(f"""
+          CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts USING fts5(
+            title, description, features,
+            tokenize = '{FTS_TOKENIZE}',
+            prefix = '2 3 4'
+          )""")
+    except sqlite3.OperationalError as e:
+        # SQLite ohne FTS5 → build_query fällt auf LIKE zurück
+        print(f"[!] FTS5 nicht verfügbar: {e}", file=sys.stderr, flush=True)
+        return
+    _fulltext_triggers(conn, "listings")
+    rebuild_fulltext(conn)
+
+
+def _fulltext_triggers(conn, table):
+    conn.execute(f"""
+      CREATE TRIGGER IF NOT EXISTS trg_listings_fts_insert AFTER INSERT ON {table} BEGIN
+        INSERT INTO listings_fts(rowid, title, description, features)
+        VALUES (NEW.rowid, NEW.title, NEW.description, NEW.features_json);
+      END""")
+    conn.execute(f"""
+      CREATE TRIGGER IF NOT EXISTS trg_listings_fts_delete AFTER DELETE ON {table} BEGIN
+        DELETE FROM listings_fts WHERE rowid = OLD.rowid;
+      END""")
+    conn.execute(f"""
+      CREATE TRIGGER IF NOT EXISTS trg_listings_fts_update
+      AFTER UPDATE OF title, description, features_json ON {table} BEGIN
+        UPDATE listings_fts SET title = NEW.title, description = NEW.description,
+                                features = NEW.features_json
+        WHERE rowid = NEW.rowid;
+      END""")
+
+
+def rebuild_fulltext(conn):
+    """FTS-Index komplett neu aus listings (z.B. nach Austausch des Tokenizers)."""
+    conn.execute("DELETE FROM listings_fts")
+    if has_details(conn):
+        index_fulltext(conn)
+        return
+    conn.execute(f"""INSERT INTO listings_fts(rowid, title, description, features)
+                     SELECT rowid, title, description, features_json FROM {listing_table(conn)}""")
+
+
+def has_fulltext(conn) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'listings_fts'").fetchone() is not None
+
+
+def has_details(conn) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'listing_details'").fetchone() is not None
+
+
+def _m005_keyset_indexes(conn):
+    # Sortier-Indizes um id erweitern (Keyset-Cursor braucht eine totale Ordnung),
+    # Titel bekommt wie die anderen das NULL-Flag vorne
+    for name, cols in (
+        ("posted",     "(posted_at IS NULL), posted_at DESC"),
+        ("price_asc",  "(price_eur IS NULL), price_eur ASC"),
+        ("price_desc", "(price_eur IS NULL), price_eur DESC"),
+        ("km_asc",     "(km IS NULL), km ASC"),
+        ("km_desc",    "(km IS NULL), km DESC"),
+        ("title",      "(title IS NULL), title COLLATE NOCASE ASC"),
+    ):
+        conn.execute(f"DROP INDEX IF EXISTS idx_listings_sort_{name}")
+        conn.execute(f"""CREATE INDEX idx_listings_sort_{name}
+                         ON listings({cols}, last_seen DESC, id DESC)""")
+    conn.execute("DROP INDEX IF EXISTS idx_listings_sort_seen")
+    conn.execute("CREATE INDEX idx_listings_sort_seen ON listings(last_seen DESC, id DESC)")
+    conn.execute("ANALYZE")
+
+
+def _m006_meta(conn):
+    # Kleine Key/Value-Tabelle, u.a. data_generation (von Sync/Cleanup hochgezählt,
+    # invalidiert den Treffer-Cache in app.py)
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('data_generation', '0')")
+
+
+# Epoch-Sekunden (UTC) neben den Text-Zeitstempeln, per Trigger beim Schreiben
+# gepflegt – Filter/Sortierung vergleichen dann Integer statt Text zu parsen.
+# posted_at ist Ortszeit (Parser nutzt datetime.now()), die *_seen-Spalten sind UTC.
+EPOCH_COLUMNS = (
+    ("listings", "posted_ts", "posted_at", "CAST(strftime('%s', {}, 'utc') AS INTEGER)"),
+    ("listings", "first_seen_ts", "first_seen", "CAST(strftime('%s', {}) AS INTEGER)"),
+    ("listings", "last_seen_ts", "last_seen", "CAST(strftime('%s', {}) AS INTEGER)"),
+    ("listing_prices", "seen_ts", "seen_at", "CAST(strftime('%s', {}) AS INTEGER)"),
+)
+
+
+def _m007_epoch_columns(conn):
+    for table, col, src, expr in EPOCH_COLUMNS:
+        have = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+        if col not in have:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} INTEGER")
+        conn.execute(f"UPDATE {table} SET {col} = {expr.format(src)}")
+        _epoch_triggers(conn, table, table, col, src, expr)
+
+    # Sortier-Indizes auf die Integer-Spalten umstellen (Ausdrücke wie in app.SORT_KEYS)
+    for name, cols in (
+        ("posted",     "(posted_ts IS NULL), posted_ts DESC"),
+        ("price_asc",  "(price_eur IS NULL), price_eur ASC"),
+        ("price_desc", "(price_eur IS NULL), price_eur DESC"),
+        ("km_asc",     "(km IS NULL), km ASC"),
+        ("km_desc",    "(km IS NULL), km DESC"),
+        ("title",      "(title IS NULL), title COLLATE NOCASE ASC"),
+    ):
+        conn.execute(f"DROP INDEX IF EXISTS idx_listings_sort_{name}")
+        conn.execute(f"""CREATE INDEX idx_listings_sort_{name}
+                         ON listings({cols}, last_seen_ts DESC, id DESC)""")
+    conn.execute("DROP INDEX IF EXISTS idx_listings_sort_seen")
+    conn.execute("CREATE INDEX idx_listings_sort_seen ON listings(last_seen_ts DESC, id DESC)")
+    conn.execute("DROP INDEX IF EXISTS idx_listings_posted_recent")
+    conn.execute("""CREATE INDEX idx_listings_posted_recent
+                    ON listings(posted_ts DESC, last_seen_ts DESC) WHERE posted_ts IS NOT NULL""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_listings_first_seen ON listings(platform, first_seen_ts)")
+    conn.execute("ANALYZE")
+
+
+def _epoch_triggers(conn, name, table, col, src, expr):
+    for event in ("INSERT", f"UPDATE OF {src}"):
+        conn.execute(f"""
+          CREATE TRIGGER IF NOT EXISTS trg_{name}_{col}_{event.split()[0].lower()}
+          AFTER {event} ON {table} BEGIN
+            UPDATE {table} SET {col} = {expr.format("NEW." + src)} WHERE rowid = NEW.rowid;
+          END""")
+
+
+def _m008_price_history(conn):
+    # Preisverlauf nur bei Änderung: (listing_id, ts) geclustert → Abfrage je Listing O(log n)
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS price_history (
+        listing_id TEXT NOT NULL,
+        ts         INTEGER NOT NULL,
+        price_eur  INTEGER,
+        PRIMARY KEY (listing_id, ts)
+      ) WITHOUT ROWID""")
+    have = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'listing_prices'").fetchone()
+    if not have:
+        return
+    # Alte Log-Zeilen übernehmen, dabei Wiederholungen desselben Preises verwerfen.
+    # rowid statt id: das listing_prices aus db.py hatte keine id-Spalte (die aus app.py schon)
+    ts = "COALESCE(seen_ts, CAST(strftime('%s', seen_at) AS INTEGER))"
+    conn.execute(f"""
+      INSERT OR REPLACE INTO price_history(listing_id, ts, price_eur)
+      SELECT listing_id, ts, price_eur FROM (
+        SELECT listing_id, price_eur, {ts} AS ts,
+               LAG(price_eur) OVER (PARTITION BY listing_id ORDER BY {ts}, rowid) AS prev
+        FROM listing_prices WHERE price_eur IS NOT NULL)
+      WHERE ts IS NOT NULL AND (prev IS NULL OR prev <> price_eur)""")
+    conn.execute("DROP TABLE listing_prices")
+
+
+# Koordinaten zur PLZ: volle PLZ vor Leitregion (wie geo.plz_centroid)
+CENTROID_SQL = ("SELECT lat, lon FROM plz_centroids WHERE plz IN ({0}, substr({0}, 1, 2)) "
+                "ORDER BY length(plz) DESC LIMIT 1")
+
+
+def _m009_geo(conn):
+    # Umkreissuche: lat/lon je Listing aus plz_centroids, Punkte im R*Tree listings_geo
+    # (id = listings.rowid, wie beim Volltext-Index)
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS plz_centroids (
+        plz TEXT PRIMARY KEY,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL
+      ) WITHOUT ROWID""")
+    load_centroids(conn)
+    have = {r[1] for r in conn.execute("PRAGMA table_info(listings)")}
+    for c in ("lat", "lon"):
+        if c not in have:
+            conn.execute(f"ALTER TABLE listings ADD COLUMN {c} REAL")
+    try:
+        conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS listings_geo
+                        USING rtree(id, min_lat, max_lat, min_lon, max_lon)""")
+    except sqlite3.OperationalError as e:
+        # SQLite ohne R*Tree → build_query filtert per Bounding-Box auf lat/lon
+        print(f"[!] R*Tree nicht verfügbar: {e}", file=sys.stderr, flush=True)
+    _geo_triggers(conn, "listings")
+    refresh_geo(conn)
+
+
+def _geo_triggers(conn, table):
+    for event in ("INSERT", "UPDATE OF postal_code"):
+        conn.execute(f"""
+          CREATE TRIGGER IF NOT EXISTS trg_listings_geo_{event.split()[0].lower()}
+          AFTER {event} ON {table} BEGIN
+            UPDATE {table} SET (lat, lon) = ({CENTROID_SQL.format("NEW.postal_code")})
+            WHERE rowid = NEW.rowid;
+          END""")
+    if not has_geo_index(conn):
+        return
+    conn.execute(f"""
+      CREATE TRIGGER IF NOT EXISTS trg_listings_geo_index AFTER UPDATE OF lat, lon ON {table} BEGIN
+        DELETE FROM listings_geo WHERE id = NEW.rowid;
+        INSERT INTO listings_geo(id, min_lat, max_lat, min_lon, max_lon)
+        SELECT NEW.rowid, NEW.lat, NEW.lat, NEW.lon, NEW.lon
+        WHERE NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL;
+      END""")
+    conn.execute(f"""
+      CREATE TRIGGER IF NOT EXISTS trg_listings_geo_delete AFTER DELETE ON {table} BEGIN
+        DELETE FROM listings_geo WHERE id = OLD.rowid;
+      END""")
+
+
+def load_centroids(conn) -> int:
+    """PLZ-Schwerpunkte aus geo.centroid_rows() (mitgeliefert + AUTOS_PLZ_CSV) übernehmen."""
+    rows = geo.centroid_rows()
+    conn.executemany("INSERT OR REPLACE INTO plz_centroids(plz, lat, lon) VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+
+def refresh_geo(conn):
+    """lat/lon aller Listings neu zuordnen und den R*Tree komplett neu aufbauen
+    (nach neuer PLZ-Tabelle oder VACUUM, das rowids neu vergibt)."""
+    table = listing_table(conn)
+    conn.execute(f"UPDATE {table} SET (lat, lon) = ({CENTROID_SQL.format(table + '.postal_code')})")
+    if has_geo_index(conn):
+        conn.execute("DELETE FROM listings_geo")
+        conn.execute(f"""INSERT INTO listings_geo(id, min_lat, max_lat, min_lon, max_lon)
+                         SELECT rowid, lat, lat, lon, lon FROM {table}
+                         WHERE lat IS NOT NULL AND lon IS NOT NULL""")
+
+
+def has_geo_index(conn) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'listings_geo'").fetchone() is not None
+
+
+# Kompaktes Layout: physisch listings_data mit Integer-Schlüssel rid und Codes (lookup.code)
+# statt wiederholter Texte; die View listings liefert die bisherigen Spalten für alle Leser.
+# Schreiber (db.py, maintenance, archive) gehen direkt auf listings_data.
+LISTING_TABLE = "listings_data"
+CATEGORICAL_COLUMNS = ("platform", "brand", "model", "fuel", "gearbox", "city", "color", "emission_class")
+LAYOUT_COLUMNS = {"rid", *(f"{c}_code" for c in CATEGORICAL_COLUMNS)}  # nur in der View, nicht im Archiv
+
+
+def listing_table(conn) -> str:
+    """Physische Listings-Tabelle: listings_data ab Migration 10, davor listings selbst."""
+    have = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (LISTING_TABLE, )).fetchone()
+    return LISTING_TABLE if have else "listings"
+
+
+def _listing_view(conn):
+    """View listings über listings_data: Codes wieder als Text, dazu rid und die *_code-Spalten."""
+    cols, codes = ["d.rid AS rid"], []
+    for _, c, *_ in conn.execute(f"PRAGMA table_info({LISTING_TABLE})").fetchall():
+        kind = c.removesuffix("_code")
+        if kind in CATEGORICAL_COLUMNS:
+            cols.append(f"(SELECT value FROM lookup WHERE code = d.{c}) AS {kind}")
+            codes.append(f"d.{c} AS {c}")
+        elif c != "rid":
+            cols.append(f"d.{c} AS {c}")
+    conn.execute("DROP VIEW IF EXISTS listings")
+    conn.execute("CREATE VIEW listings AS SELECT\n  " + ",\n  ".join(cols + codes) + f"\nFROM {LISTING_TABLE} d")
+
+
+def _m010_compact_layout(conn):
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS lookup (
+        code  INTEGER PRIMARY KEY,
+        kind  TEXT NOT NULL,
+        value TEXT NOT NULL,
+        UNIQUE (kind, value)
+      )""")
+    # rid übernimmt die bisherige rowid → listings_fts und listings_geo bleiben gültig
+    defs, dst, src = ["rid INTEGER PRIMARY KEY"], ["rid"], ["rowid"]
+    for _, c, t, _, dflt, _ in conn.execute("PRAGMA table_info(listings)").fetchall():
+        if c in CATEGORICAL_COLUMNS:
+            conn.execute(f"""INSERT OR IGNORE INTO lookup(kind, value)
+                             SELECT DISTINCT '{c}', {c} FROM listings WHERE {c} IS NOT NULL""")
+            code = f"(SELECT code FROM lookup WHERE kind = '{c}' AND value = listings.{c})"
+            # platform gehört zum Schlüssel (id, platform_code) → nie NULL, 0 = unbekannt
+            defs.append(f"{c}_code INTEGER NOT NULL DEFAULT 0" if c == "platform" else f"{c}_code INTEGER")
+            src.append(f"COALESCE({code}, 0)" if c == "platform" else code)
+            dst.append(f"{c}_code")
+            continue
+        if c == "id":
+            t = "TEXT NOT NULL"
+        elif c in ("first_seen", "last_seen"):
+            dflt = "datetime('now')"  # bei alten Dateien per Trigger nachgezogen (_m001)
+        defs.append(f"{c} {t or ''}" + (f" DEFAULT ({dflt})" if dflt is not None else ""))
+        dst.append(c)
+        src.append(c)
+
+    conn.execute(f"CREATE TABLE {LISTING_TABLE} (\n  " + ",\n  ".join(defs) + "\n)")
+    conn.execute(f"INSERT INTO {LISTING_TABLE}({', '.join(dst)}) SELECT {', '.join(src)} FROM listings")
+
+    # Indizes mitnehmen (Spalten der Kategorien → *_code), Tabelle samt Triggern ersetzen
+    indexes = [r[0] for r in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'listings' AND sql IS NOT NULL")]
+    conn.execute("DROP TABLE listings")
+    cats = "|".join(CATEGORICAL_COLUMNS)
+    for sql in indexes:
+        sql = re.sub(r"\bON\s+listings\s*\(", f"ON {LISTING_TABLE}(", sql)
+        conn.execute(re.sub(rf"\b({cats})\b", r"\1_code", sql))
+    conn.execute(f"CREATE UNIQUE INDEX idx_listings_external ON {LISTING_TABLE}(id, platform_code)")
+    _listing_view(conn)
+
+    if has_fulltext(conn):
+        _fulltext_triggers(conn, LISTING_TABLE)
+    for table, col, src_col, expr in EPOCH_COLUMNS:
+        if table == "listings":
+            _epoch_triggers(conn, "listings", LISTING_TABLE, col, src_col, expr)
+    _geo_triggers(conn, LISTING_TABLE)
+    conn.execute("ANALYZE")
+
+
+
+# Große Felder (Beschreibung, Bild-URLs, Ausstattung) liegen zlib-komprimiert in
+# listing_details (rid wie listings_data) – Listen-Scans lesen nur noch kleine Zeilen.
+DETAIL_COLUMNS = ("description", "image_urls_json", "features_json")
+DETAIL_TABLE = "listing_details"
+
+
+def pack_text(s):
+    """Text → zlib-BLOB (None bleibt None)."""
+    return None if s is None else zlib.compress(str(s).encode("utf-8"))
+
+
+def unpack_text(b):
+    """zlib-BLOB → Text; unkomprimierte Altwerte kommen unverändert zurück."""
+    if b is None or isinstance(b, str):
+        return b
+    return zlib.decompress(b).decode("utf-8")
+
+
+def _m011_listing_details(conn):
+    conn.execute(f"""
+      CREATE TABLE IF NOT EXISTS {DETAIL_TABLE} (
+        rid             INTEGER PRIMARY KEY,
+        description     BLOB,
+        image_urls_json BLOB,
+        features_json   BLOB
+      )""")
+    cols = ", ".join(DETAIL_COLUMNS)
+    rows = conn.execute(f"""SELECT rid, {cols} FROM {LISTING_TABLE}
+                            WHERE {" OR ".join(f"{c} IS NOT NULL" for c in DETAIL_COLUMNS)}""").fetchall()
+    conn.executemany(f"INSERT OR REPLACE INTO {DETAIL_TABLE}(rid, {cols}) VALUES (?, ?, ?, ?)",
+                     [(r[0], *map(pack_text, r[1:])) for r in rows])
+
+    # Volltext pflegt ab jetzt db.upsert_listing (Trigger sehen nur komprimierte Bytes);
+    # Spalten samt View ersetzen, Details beim Löschen des Listings mitnehmen
+    conn.execute("DROP TRIGGER IF EXISTS trg_listings_fts_insert")
+    conn.execute("DROP TRIGGER IF EXISTS trg_listings_fts_update")
+    conn.execute("DROP VIEW listings")
+    for c in DETAIL_COLUMNS:
+        conn.execute(f"ALTER TABLE {LISTING_TABLE} DROP COLUMN {c}")
+    _listing_view(conn)
+    conn.execute(f"""
+      CREATE TRIGGER IF NOT EXISTS trg_listing_details_delete AFTER DELETE ON {LISTING_TABLE} BEGIN
+        DELETE FROM {DETAIL_TABLE} WHERE rid = OLD.rid;
+      END""")
+
+
+def index_fulltext(conn, rids=None):
+    """FTS-Zeilen aus listings_data + entpackten Details neu schreiben (rids=None: alle)."""
+    where = f"WHERE d.rid IN ({','.join('?' * len(rids))})" if rids is not None else ""
+    rows = conn.execute(f"""SELECT d.rid, d.title, x.description, x.features_json
+                            FROM {LISTING_TABLE} d LEFT JOIN {DETAIL_TABLE} x ON x.rid = d.rid {where}
+                            ORDER BY d.rid""",  # FTS5 will aufsteigende rowids, sonst winzige Segmente
+                        list(rids or ())).fetchall()
+    if rids is not None:
+        conn.executemany("DELETE FROM listings_fts WHERE rowid = ?", [(r[0], ) for r in rows])
+    conn.executemany("INSERT INTO listings_fts(rowid, title, description, features) VALUES (?, ?, ?, ?)",
+                     [(r[0], r[1], unpack_text(r[2]), unpack_text(r[3])) for r in rows])
+
+
+def _m012_listing_events(conn):
+    # Änderungsprotokoll für /api/changes – der Client patcht nur die betroffenen Karten.
+    # AUTOINCREMENT: seq bleibt monoton, auch nachdem maintenance alte Einträge löscht
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS listing_events (
+        seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+        listing_id TEXT NOT NULL,
+        kind       TEXT NOT NULL,   -- insert | update | price | expire
+        ts         INTEGER NOT NULL,
+        data       TEXT             -- JSON, je nach kind (siehe db.record_events)
+      )""")
+
+
+# repl_log.tbl für einen gebündelten last_seen-Eintrag (db.touch_listings) statt einem je Zeile;
+# key ist dann {"last_seen": ..., "ids": [...]}
+REPL_TOUCH = "touch"
+
+
+def _m013_repl_log(conn):
+    # Replikation (replication.py): die Capture-Trigger des Leaders merken sich nur Tabelle
+    # und Schlüssel; die Zeilenwerte liest erst der Versand. AUTOINCREMENT, weil die Batches
+    # nach seq benannt sind und versandte Einträge gelöscht werden
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS repl_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT NOT NULL,
+        key TEXT NOT NULL   -- JSON-Array der Primärschlüsselwerte
+      )""")
+
+
+def _m014_sync_lease(conn):
+    # Eine Sync-Lease für alle Prozesse/Container (db.sync_lease) statt threading.Lock je Prozess;
+    # Zeiten als Epoch-Sekunden (time.time), damit sie prozessübergreifend vergleichbar sind
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS sync_lease (
+        name              TEXT PRIMARY KEY,
+        holder            TEXT,                       -- host:pid:nonce, NULL = frei
+        expires_ts        REAL NOT NULL DEFAULT 0,    -- ohne Heartbeat danach verfallen
+        heartbeat_ts      REAL,
+        last_completed_ts REAL NOT NULL DEFAULT 0     -- für den gemeinsamen Debounce
+      )""")
+
+# (version, beschreibung, funktion) – nur anhängen, nie umnummerieren
+MIGRATIONS = [
+    (1, "base schema (app + scraper vereinheitlicht)", _m001_base_schema),
+    (2, "query-shaped composite/partial indexes", _m002_query_indexes),
+    (3, "ez_year/ez_month + (ez_year, price_eur) index", _m003_registration_year),
+    (4, "FTS5 full-text index over title/description/features", _m004_fulltext),
+    (5, "sort indexes extended by id for keyset pagination", _m005_keyset_indexes),
+    (6, "meta table with data_generation counter", _m006_meta),
+    (7, "integer epoch timestamps + sort indexes on them", _m007_epoch_columns),
+    (8, "change-only price_history replaces listing_prices", _m008_price_history),
+    (9, "plz_centroids + lat/lon + R*Tree listings_geo for radius search", _m009_geo),
+    (10, "listings_data with integer rid + lookup codes, listings becomes a view", _m010_compact_layout),
+    (11, "zlib-compressed listing_details split off listings_data", _m011_listing_details),
+    (12, "listing_events change log with monotonic seq", _m012_listing_events),
+    (13, "repl_log capture table for leader/follower replication", _m013_repl_log),
+    (14, "sync_lease shared across processes (holder, expiry, heartbeat)", _m014_sync_lease),
+]
+
+_done = set()
+
+
+def current_version(conn) -> int:
+    conn.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+                      version INTEGER PRIMARY KEY,
+                      name TEXT,
+                      applied_at TEXT DEFAULT (datetime('now')))""")
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn, path=None) -> int:
+    """Offene Migrationen anwenden (je eine Transaktion). Gibt die Version zurück."""
+    key = (os.getpid(), path)
+    if path is not None and key in _done:
+        return MIGRATIONS[-1][0]
+
+    conn.execute("BEGIN IMMEDIATE")  # andere Prozesse warten, statt doppelt zu migrieren
+    try:
+        v = current_version(conn)
+        for version, name, fn in MIGRATIONS:
+            if version <= v:
+                continue
+            fn(conn)
+            conn.execute("INSERT INTO schema_version(version, name) VALUES (?, ?)", (version, name))
+            print(f"[i] Migration {version}: {name}", file=sys.stderr, flush=True)
+            v = version
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if path is not None:
+        _done.add(key)
+    return v
+
+
+# ------------------------------------------------------------
+# Query-Plan-Check für die Listen-Abfragen aus app.build_query
+# ------------------------------------------------------------
+def listing_plan_queries():
+    from app import build_query, DEFAULT_VIEW_FILTERS, SORT_KEYS, sort_order_sql, _keyset_segments
+
+    out = []
+    for sort in SORT_KEYS:
+        for params in ({"sort": sort}, dict(DEFAULT_VIEW_FILTERS, sort=sort)):
+            where_sql, args, order_sql = build_query(params)
+            out.append((params, f"SELECT id FROM listings {where_sql} {order_sql} LIMIT 50", args))
+            # Folgeseiten per Keyset-Cursor (vorwärts/rückwärts, mit und ohne NULL-Schlüssel)
+            for key in ([1, 1767225600, "x"], [None, 1767225600, "x"]):
+                for before in (False, True):
+                    for frag, fargs in _keyset_segments(sort, key, before):
+                        w = f"{where_sql} AND ({frag})" if where_sql else f"WHERE {frag}"
+                        out.append((dict(params, cursor=key, before=before),
+                                    f"SELECT id FROM listings {w} {sort_order_sql(sort, before, True)} LIMIT 51",
+                                    args + fargs))
+    return out
+
+
+def check_query_plans(conn) -> list:
+    """Liefert (params, plan) für alle Listen-Abfragen, die noch sortieren müssen."""
+    bad = []
+    for params, sql, args in listing_plan_queries():
+        plan = [r[-1] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, args)]
+        if any("TEMP B-TREE" in p for p in plan):
+            bad.append((params, plan))
+    return bad
+
+
+# listing_prices, wie es die beiden alten init_db() angelegt haben
+LEGACY_PRICE_TABLES = {
+    "db.py": """CREATE TABLE listing_prices (
+        listing_id TEXT NOT NULL,
+        seen_at    TEXT DEFAULT (datetime('now')),
+        price_eur  INTEGER)""",
+    "app.py": """CREATE TABLE listing_prices(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        listing_id TEXT,
+        price_eur INTEGER,
+        seen_at TEXT DEFAULT CURRENT_TIMESTAMP)""",
+}
+
+
+def check_legacy_upgrade() -> list:
+    """Beide Alt-Schemata frisch bis zur letzten Version migrieren; liefert Fehlermeldungen."""
+    rows = [("A", "2024-01-01 10:00:00", 1000), ("A", "2024-01-02 10:00:00", 1000),
+            ("A", "2024-01-03 10:00:00", 900), ("A", "2024-01-04 10:00:00", 1000),
+            ("B", "2024-01-01 10:00:00", 500), ("B", "2024-01-01 10:00:00", 500),
+            ("B", "2024-01-02 10:00:00", None)]
+    want = [("A", "2024-01-01 10:00:00", 1000), ("A", "2024-01-03 10:00:00", 900),
+            ("A", "2024-01-04 10:00:00", 1000), ("B", "2024-01-01 10:00:00", 500)]
+    errors = []
+    for origin, ddl in LEGACY_PRICE_TABLES.items():
+        conn = sqlite3.connect(":memory:", isolation_level=None)
+        conn.execute("CREATE TABLE listings (id TEXT PRIMARY KEY, title TEXT, price_eur INTEGER, last_seen TEXT)")
+        conn.execute("INSERT INTO listings VALUES ('A', 'Golf', 1000, '2024-01-04 10:00:00'), "
+                     "('B', 'Polo', 500, '2024-01-02 10:00:00')")
+        conn.execute(ddl)
+        conn.executemany("INSERT INTO listing_prices(listing_id, seen_at, price_eur) VALUES (?, ?, ?)", rows)
+        try:
+            version = migrate(conn)
+        except sqlite3.Error as e:
+            errors.append(f"{origin}: {e}")
+            continue
+        got = conn.execute("SELECT listing_id, datetime(ts, 'unixepoch'), price_eur "
+                           "FROM price_history ORDER BY 1, 2").fetchall()
+        if version != MIGRATIONS[-1][0]:
+            errors.append(f"{origin}: Version {version}")
+        if got != want:
+            errors.append(f"{origin}: price_history {got}")
+        conn.close()
+    return errors
+
+
+if __name__ == "__main__":
+    if "--legacy" in sys.argv:
+        errors = check_legacy_upgrade()
+        print("\n".join(errors) or "Alt-Schemata OK")
+        sys.exit(1 if errors else 0)
+    path = next((a for a in sys.argv[1:] if not a.startswith("-")), os.environ.get("AUTOS_DB", "autos.db"))
+    os.environ["AUTOS_DB"] = path  # app (für build_query) auf dieselbe Datei zeigen lassen
+    conn = sqlite3.connect(path, isolation_level=None)
+    print(f"Schema-Version: {migrate(conn)}")
+    if "--explain" in sys.argv:
+        bad = check_query_plans(conn)
+        for params, plan in bad:
+            print(f"[!] Temp-B-Tree: {params}\n    " + "\n    ".join(plan))
+        print("Query-Pläne OK" if not bad else f"{len(bad)} Abfragen ohne passenden Index")
+        sys.exit(1 if bad else 0)
@@ -0,0 +1,109 @@
+# planner.py — Filter-Pushdown: aus Push-Abos und gespeicherten Filtern
+# eine kleine Menge abdeckender Kleinanzeigen-Suchen ableiten
+import os
+from datetime import datetime
+
+from db import push_subscription_filters
+
+# Standardansicht der Web-UI – zählt als gespeicherter Filter
+DEFAULT_VIEW_FILTERS = {"price_max": "9000", "ez_min": "2012", "km_max": "100000"}
+
+PLAN_MAX_QUERIES = int(os.environ.get("KA_PLAN_MAX_QUERIES", "4"))
+
+# Wertebereiche für die Volumen-Schätzung (nur relativ wichtig)
+_DOMAIN = {
+    "price": (0, 50000),
+    "km": (0, 300000),
+    "ez": (1990, datetime.now().year + 1),
+}
+
+
+def _int(v):
+    try:
+        return int(v) if v not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def band_from_filters(f: dict) -> dict:
+    """Nur die upstream filterbaren Felder: Preis, km, EZ-Jahr."""
+    return {
+        "price_min": _int(f.get("price_min")), "price_max": _int(f.get("price_max")),
+        "km_max": _int(f.get("km_max")),
+        "ez_min": _int(f.get("ez_min")), "ez_max": _int(f.get("ez_max")),
+    }
+
+
+def _bounds(b, dim):
+    lo, hi = _DOMAIN[dim]
+    if dim == "km":
+        return lo, hi if b["km_max"] is None else min(hi, b["km_max"])
+    blo, bhi = b[f"{dim}_min"], b[f"{dim}_max"]
+    return (lo if blo is None else max(lo, blo)), (hi if bhi is None else min(hi, bhi))
+
+
+def volume(b) -> float:
+    """Anteil des Suchraums, den ein Band abdeckt (Proxy für Trefferzahl/Seiten)."""
+    v = 1.0
+    for dim, (lo, hi) in _DOMAIN.items():
+        a, z = _bounds(b, dim)
+        v *= max(0.0, (z - a) / float(hi - lo))
+    return v
+
+
+def merge(a, b) -> dict:
+    """Kleinstes Band, das a und b abdeckt (offene Grenze gewinnt)."""
+    def lo(x, y): return None if x is None or y is None else min(x, y)
+    def hi(x, y): return None if x is None or y is None else max(x, y)
+    return {
+        "price_min": lo(a["price_min"], b["price_min"]), "price_max": hi(a["price_max"], b["price_max"]),
+        "km_max": hi(a["km_max"], b["km_max"]),
+        "ez_min": lo(a["ez_min"], b["ez_min"]), "ez_max": hi(a["ez_max"], b["ez_max"]),
+    }
+
+
+def clamp(b, outer) -> dict:
+    """Band auf die globalen Grenzen (KA_PRICE_MIN/MAX, KA_KM_MAX) beschneiden."""
+    out = dict(b)
+    if outer.get("price_min") is not None:
+        out["price_min"] = max(outer["price_min"], b["price_min"] or 0)
+    if outer.get("price_max") is not None:
+        out["price_max"] = outer["price_max"] if b["price_max"] is None else min(outer["price_max"], b["price_max"])
+    if outer.get("km_max") is not None:
+        out["km_max"] = outer["km_max"] if b["km_max"] is None else min(outer["km_max"], b["km_max"])
+    return out
+
+
+def cover(bands, max_queries: int = PLAN_MAX_QUERIES) -> list:
+    """
+    Greedy: Paare zusammenlegen, solange das zusammengelegte Band nicht mehr
+    Suchraum kostet als beide einzeln (Überlappung/Enthaltensein) – oder
+    solange mehr als `max_queries` Suchen übrig sind (dann das billigste Paar).
+    """
+    bands = [b for b in bands if volume(b) > 0]
+    while len(bands) > 1:
+        best = None
+        for i in range(len(bands)):
+            for j in range(i + 1, len(bands)):
+                m = merge(bands[i], bands[j])
+                extra = volume(m) - volume(bands[i]) - volume(bands[j])
+                if best is None or extra < best[0]:
+                    best = (extra, i, j, m)
+        extra, i, j, m = best
+        if extra > 1e-9 and len(bands) <= max_queries:
+            break
+        bands = [b for k, b in enumerate(bands) if k not in (i, j)] + [m]
+    return bands
+
+
+def plan_bands(outer: dict, include_default_view: bool = True) -> list:
+    """
+    Abdeckende Such-Bänder für alle aktiven Abos (+ Standardansicht).
+    Leere Liste = kein Abo → breite Standardsuche verwenden.
+    """
+    filters = push_subscription_filters()
+    if not filters:
+        return []
+    if include_default_view:
+        filters.append(DEFAULT_VIEW_FILTERS)
+    return cover([clamp(band_from_filters(f), outer) for f in filters])
@@ -1,5 +1,6 @@
 # providers/links.py
 import os, re
+from vehicle import parse_registration
 KA_AREA_SLUG = os.environ.get("KA_AREA_SLUG", "bayern")
 KA_AREA_CODE = os.environ.get("KA_AREA_CODE", "l5510")
 KA_RADIUS_KM = int(os.environ.get("KA_RADIUS", "100"))
@@ -22,13 +23,7 @@ def build_similar_search_url(r):
     if not brand or not model:
         return ""
 
-    first_reg = (val("first_reg") or "")[:10]
-    ez_text   = (val("ez_text") or "")
-    year = None
-    for cand in (first_reg, ez_text):
-        m = re.search(r"(20\d{2}|19\d{2})", cand or "")
-        if m:
-            year = int(m.group(1)); break
+    year = val("ez_year") or parse_registration(val("first_reg"), val("ez_text"))[0]
 
     km_min = km_max = ""
     if isinstance(km, int):
@@ -83,14 +78,7 @@ def build_autoscout_search_url(r):
     brand = slug_brand(brand_raw)
     model = slug_model(model_raw)
 
-    first_reg = (val("first_reg") or "")[:10]
-    ez_text   = (val("ez_text") or "")
-    import re as _re
-    year = None
-    for cand in (first_reg, ez_text):
-        m = _re.search(r"(20\d{2}|19\d{2})", cand or "")
-        if m:
-            year = int(m.group(1)); break
+    year = val("ez_year") or parse_registration(val("first_reg"), val("ez_text"))[0]
 
     y_from = y_to = ""
     if isinstance(year, int):
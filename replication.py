@@ -0,0 +1,460 @@
+# replication.py — Leader/Follower-Replikation für mehrere Web-Instanzen
+#
+# AUTOS_ROLE=leader: scrapt wie bisher. Capture-Trigger merken sich in repl_log nur
+# Tabelle + Schlüssel jeder geänderten Listing-Zeile; ein Hintergrund-Thread packt das
+# alle paar Sekunden in einen Batch (aktuelle Zeilenwerte bzw. None = gelöscht,
+# zlib-komprimiertes JSON), benannt nach der höchsten repl_log.seq: <seq>.batch im
+# AUTOS_REPL_DIR. Alle SNAPSHOT_EVERY_SEC kommt ein snapshot-<seq>.db dazu (nur die
+# replizierten Tabellen) – Startpunkt für neue oder zu weit zurückliegende Follower.
+#
+# AUTOS_ROLE=follower: scrapt nicht. Liest die Dateien aus demselben Verzeichnis
+# (gemeinsames Volume) oder per HTTP vom Leader (AUTOS_REPL_URL → /api/repl/...) und
+# spielt die Batches der Reihe nach ein. Jede Zeile wird komplett überschrieben, das
+# Einspielen ist also idempotent – doppelte oder überlappende Batches schaden nicht.
+# Repliziert werden nur die Listing-Tabellen; Favoriten, Push-Abos und Caches bleiben
+# je Instanz lokal. Reines last_seen-Auffrischen (db.touch_listings, jeder Sync für alle
+# unveränderten Listings) lösen die Trigger nicht aus; es steht als ein REPL_TOUCH-Eintrag
+# je Batch im Protokoll und wird beim Follower als ein UPDATE eingespielt.
+#
+# Start: python3 replication.py [status|run|ship|snapshot|apply]
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import base64
+import fcntl
+import shutil
+import sqlite3
+import threading
+
+import dbpool
+from db import bump_data_generation
+from migrations import (migrate, current_version, has_fulltext, index_fulltext, rebuild_fulltext,
+                        LISTING_TABLE, DETAIL_TABLE, REPL_TOUCH)
+
+DB_PATH = os.environ.get("AUTOS_DB", "autos.db")
+ROLE = os.environ.get("AUTOS_ROLE", "standalone").strip().lower()  # standalone | leader | follower
+REPL_DIR = os.environ.get("AUTOS_REPL_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(DB_PATH)), "replication")
+REPL_URL = os.environ.get("AUTOS_REPL_URL", "").rstrip("/")   # Follower: Basis-URL des Leaders
+REPL_TOKEN = os.environ.get("AUTOS_REPL_TOKEN", "")            # Header X-Repl-Token, falls gesetzt
+INTERVAL_SEC = float(os.environ.get("AUTOS_REPL_INTERVAL_SEC", "5"))
+BATCH_KEYS = 5000                  # repl_log-Einträge je Batch
+SNAPSHOT_EVERY_SEC = 6 * 3600
+KEEP_BATCHES_SEC = 2 * 86400       # ältere Batches (vor dem jüngsten Schnappschuss) löscht der Leader
+HTTP_TIMEOUT_SEC = 30
+
+# Replizierte Tabellen → Primärschlüssel; Reihenfolge = Ladefolge beim Aufsetzen
+REPLICATED = {
+    "lookup": ("code", ),
+    LISTING_TABLE: ("rid", ),
+    DETAIL_TABLE: ("rid", ),
+    "price_history": ("listing_id", "ts"),
+    "listing_events": ("seq", ),
+}
+# Nur Sichtungszeit: kein Capture je Zeile, sondern REPL_TOUCH-Einträge (db.touch_listings)
+SEEN_COLUMNS = ("last_seen", "last_seen_ts")
+BATCH_RE = re.compile(r"^(\d{12})\.batch$")
+SNAPSHOT_RE = re.compile(r"^snapshot-(\d{12})\.db$")
+
+_state = {"pid": None, "thread": None, "last_run": None, "last_error": None, "batches": 0}
+_start_lock = threading.Lock()
+
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    for k, v in dbpool.PRAGMAS.items():
+        conn.execute(f"PRAGMA {k}={v}")
+    return conn
+
+
+def _write(conn, fn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        res = fn(conn)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return res
+
+
+def _where(pk):
+    return " AND ".join(f"{c} = ?" for c in pk)
+
+
+def is_repl_file(name) -> bool:
+    return bool(BATCH_RE.match(name) or SNAPSHOT_RE.match(name))
+
+
+def setup(conn):
+    """Capture-Trigger passend zur Rolle: nur der Leader protokolliert, sonst weg damit
+    (ein liegengebliebenes repl_log ohne Versand würde endlos wachsen). Jedes Mal neu
+    angelegt, damit UPDATE OF auch Spalten späterer Migrationen umfasst."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for tbl, pk in REPLICATED.items():
+            for event, ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                name = f"trg_repl_{tbl}_{event.lower()}"
+                conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+                if ROLE != "leader":
+                    continue
+                key = ", ".join(f"{ref}.{c}" for c in pk)
+                if event == "UPDATE" and tbl == LISTING_TABLE:
+                    cols = [r[1] for r in conn.execute(f"PRAGMA table_info({tbl})") if r[1] not in SEEN_COLUMNS]
+                    event = f"UPDATE OF {', '.join(cols)}"
+                conn.execute(f"""
+                  CREATE TRIGGER {name} AFTER {event} ON {tbl} BEGIN
+                    INSERT INTO repl_log(tbl, key) VALUES ('{tbl}', json_array({key}));
+                  END""")
+        if ROLE != "leader":
+            conn.execute("DELETE FROM repl_log")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# ------------------------------------------------------------
+# Leader: Batches und Schnappschüsse schreiben
+# ------------------------------------------------------------
+def _enc(v):
+    # listing_details sind zlib-BLOBs → für JSON base64
+    return {"b64": base64.b64encode(v).decode()} if isinstance(v, bytes) else v
+
+
+def _dec(v):
+    return base64.b64decode(v["b64"]) if isinstance(v, dict) else v
+
+
+def _write_file(name, data: bytes):
+    os.makedirs(REPL_DIR, exist_ok=True)
+    path = os.path.join(REPL_DIR, name)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)  # Follower sehen nie eine halbe Datei
+
+
+def ship(conn) -> int:
+    """Bis zu BATCH_KEYS repl_log-Einträge als ein Batch schreiben; gibt die Zahl der
+    Zeilenänderungen zurück (0 = nichts zu tun)."""
+    schema = current_version(conn)
+    conn.execute("BEGIN")  # ein Lese-Schnappschuss für Protokoll und Zeilenwerte
+    try:
+        log = conn.execute("SELECT seq, tbl, key FROM repl_log ORDER BY seq LIMIT ?", (BATCH_KEYS, )).fetchall()
+        # mehrfach geänderte Zeilen nur einmal, an der Stelle ihrer letzten Änderung
+        last = {}
+        for seq, tbl, key in log:
+            last.pop((tbl, key), None)
+            last[(tbl, key)] = seq
+        changes = []
+        for tbl, key in last:
+            if tbl == REPL_TOUCH:
+                changes.append([tbl, json.loads(key), None])
+                continue
+            pk = REPLICATED.get(tbl)
+            if pk is None:
+                continue
+            vals = json.loads(key)
+            cur = conn.execute(f"SELECT * FROM {tbl} WHERE {_where(pk)}", vals)
+            row = cur.fetchone()
+            changes.append([tbl, vals, None if row is None else
+                            {d[0]: _enc(v) for d, v in zip(cur.description, row)}])
+    finally:
+        conn.execute("COMMIT")
+    if not log:
+        return 0
+    seq = log[-1][0]
+    batch = {"seq": seq, "first": log[0][0], "schema": schema, "ts": int(time.time()), "changes": changes}
+    _write_file(f"{seq:012d}.batch", zlib.compress(json.dumps(batch, separators=(",", ":")).encode()))
+    _write(conn, lambda c: c.execute("DELETE FROM repl_log WHERE seq <= ?", (seq, )))
+    _state["batches"] += 1
+    return len(changes)
+
+
+def make_snapshot(conn) -> str:
+    """Replizierte Tabellen in snapshot-<seq>.db kopieren. seq = letzte versandte
+    repl_log-Position im selben Lese-Schnappschuss; was danach kommt, steht (eventuell
+    doppelt, das ist egal) in späteren Batches."""
+    os.makedirs(REPL_DIR, exist_ok=True)
+    tmp = os.path.join(REPL_DIR, "snapshot.db.tmp")
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn.execute("ATTACH DATABASE ? AS snap", (tmp, ))
+    try:
+        conn.execute("BEGIN")
+        try:
+            pos = conn.execute("""SELECT COALESCE((SELECT MIN(seq) - 1 FROM repl_log),
+                                                  (SELECT seq FROM sqlite_sequence WHERE name = 'repl_log'), 0)""").fetchone()[0]
+            conn.execute("CREATE TABLE snap.schema_version AS SELECT * FROM main.schema_version")
+            for tbl in REPLICATED:
+                conn.execute(f"CREATE TABLE snap.{tbl} AS SELECT * FROM main.{tbl}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.execute("DETACH DATABASE snap")
+    name = f"snapshot-{pos:012d}.db"
+    os.replace(tmp, os.path.join(REPL_DIR, name))
+    for old in os.listdir(REPL_DIR):
+        if SNAPSHOT_RE.match(old) and old != name:
+            os.remove(os.path.join(REPL_DIR, old))
+    return name
+
+
+def prune_files():
+    """Batches löschen, die älter als KEEP_BATCHES_SEC sind und vor dem jüngsten
+    Schnappschuss liegen – wer sie noch bräuchte, setzt ohnehin neu auf."""
+    files = list_files()
+    snaps = [int(m.group(1)) for m in map(SNAPSHOT_RE.match, files) if m]
+    if not snaps:
+        return 0
+    cutoff = time.time() - KEEP_BATCHES_SEC
+    n = 0
+    for name in files:
+        m = BATCH_RE.match(name)
+        path = os.path.join(REPL_DIR, name)
+        if m and int(m.group(1)) <= max(snaps) and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            n += 1
+    return n
+
+
+def run_leader(conn) -> int:
+    shipped = 0
+    while True:
+        n = ship(conn)
+        shipped += n
+        if not n:
+            break
+    snaps = [f for f in list_files() if SNAPSHOT_RE.match(f)]
+    if not snaps or time.time() - os.path.getmtime(os.path.join(REPL_DIR, snaps[-1])) > SNAPSHOT_EVERY_SEC:
+        print(f"[i] Replikation: {make_snapshot(conn)} geschrieben", file=sys.stderr, flush=True)
+    prune_files()
+    return shipped
+
+
+# ------------------------------------------------------------
+# Follower: Dateien holen und einspielen
+# ------------------------------------------------------------
+def _http_get(path, **kw):
+    import requests
+    r = requests.get(f"{REPL_URL}{path}", headers={"X-Repl-Token": REPL_TOKEN} if REPL_TOKEN else {},
+                     timeout=HTTP_TIMEOUT_SEC, **kw)
+    r.raise_for_status()
+    return r
+
+
+def list_files() -> list:
+    """Batch- und Schnappschuss-Dateien, aufsteigend sortiert."""
+    if ROLE == "follower" and REPL_URL:
+        return _http_get("/api/repl/files").json()["files"]
+    try:
+        return sorted(f for f in os.listdir(REPL_DIR) if is_repl_file(f))
+    except FileNotFoundError:
+        return []
+
+
+def _fetch(name, dest):
+    if REPL_URL:
+        with _http_get(f"/api/repl/file/{name}", stream=True) as r, open(dest, "wb") as f:
+            for chunk in r.iter_content(1 << 20):
+                f.write(chunk)
+    else:
+        shutil.copyfile(os.path.join(REPL_DIR, name), dest)
+
+
+def _read_batch(name) -> dict:
+    if REPL_URL:
+        data = _http_get(f"/api/repl/file/{name}").content
+    else:
+        with open(os.path.join(REPL_DIR, name), "rb") as f:
+            data = f.read()
+    return json.loads(zlib.decompress(data))
+
+
+def position(conn):
+    """repl_log-seq des zuletzt eingespielten Batches, None = noch nie aufgesetzt."""
+    r = conn.execute("SELECT value FROM meta WHERE key = 'repl_position'").fetchone()
+    return int(r[0]) if r else None
+
+
+def _set_position(conn, seq):
+    conn.execute("""INSERT INTO meta(key, value) VALUES ('repl_position', ?)
+                    ON CONFLICT(key) DO UPDATE SET value = excluded.value""", (str(seq), ))
+
+
+def bootstrap(conn, name):
+    """Replizierte Tabellen komplett aus einem Schnappschuss des Leaders ersetzen."""
+    tmp = DB_PATH + ".repl-snapshot"
+    _fetch(name, tmp)
+    conn.execute("ATTACH DATABASE ? AS snap", (tmp, ))
+    try:
+        theirs = conn.execute("SELECT MAX(version) FROM snap.schema_version").fetchone()[0]
+        if theirs > current_version(conn):
+            raise RuntimeError(f"Schnappschuss hat Schema {theirs}, lokal {current_version(conn)} – erst aktualisieren")
+
+        def load(c):
+            for tbl in reversed(list(REPLICATED)):
+                c.execute(f"DELETE FROM main.{tbl}")
+            for tbl in REPLICATED:
+                remote = {r[1] for r in c.execute(f"PRAGMA snap.table_info({tbl})")}
+                cols = ", ".join(r[1] for r in c.execute(f"PRAGMA main.table_info({tbl})") if r[1] in remote)
+                c.execute(f"INSERT INTO main.{tbl}({cols}) SELECT {cols} FROM snap.{tbl}")
+            if has_fulltext(c):
+                rebuild_fulltext(c)
+            _set_position(c, int(SNAPSHOT_RE.match(name).group(1)))
+
+        _write(conn, load)
+    finally:
+        conn.execute("DETACH DATABASE snap")
+        os.remove(tmp)
+    conn.execute("ANALYZE")  # frische DB hat Statistiken leerer Tabellen → schlechte Pläne
+    bump_data_generation(conn)
+    print(f"[i] Replikation: aus {name} aufgesetzt", file=sys.stderr, flush=True)
+
+
+def _apply(conn, batch) -> bool:
+    """Batch einspielen; True, wenn sich Inhalt geändert hat (nicht nur last_seen)."""
+    rids = set()
+    content = False
+    for tbl, key, row in batch["changes"]:
+        if tbl == REPL_TOUCH:
+            ids = key["ids"]
+            conn.execute(f"UPDATE {LISTING_TABLE} SET last_seen = ? WHERE id IN ({','.join('?' * len(ids))})",
+                         [key["last_seen"]] + ids)
+            continue
+        content = True
+        pk = REPLICATED[tbl]
+        if row is None:
+            conn.execute(f"DELETE FROM {tbl} WHERE {_where(pk)}", key)
+            continue
+        cols = list(row)
+        sets = ", ".join(f"{c} = excluded.{c}" for c in cols if c not in pk)
+        conn.execute(f"INSERT INTO {tbl}({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) "
+                     f"ON CONFLICT({', '.join(pk)}) DO " + (f"UPDATE SET {sets}" if sets else "NOTHING"),
+                     [_dec(row[c]) for c in cols])
+        if tbl in (LISTING_TABLE, DETAIL_TABLE):
+            rids.add(key[0])
+    # Volltext pflegt db.upsert_listing in Python (Details sind gepackt) → hier genauso
+    if rids and has_fulltext(conn):
+        index_fulltext(conn, sorted(rids))
+    _set_position(conn, batch["seq"])
+    return content
+
+
+def apply_pending(conn) -> int:
+    """Alle neuen Batches einspielen (je einer pro Transaktion); gibt deren Anzahl zurück."""
+    files = list_files()
+    snaps = [f for f in files if SNAPSHOT_RE.match(f)]
+    pos = position(conn)
+    if pos is None:
+        if not snaps:
+            return 0  # Leader hat noch keinen Schnappschuss geschrieben
+        bootstrap(conn, snaps[-1])
+        pos = position(conn)
+    applied = 0
+    content = False
+    for name in files:
+        m = BATCH_RE.match(name)
+        if not m or int(m.group(1)) <= pos:
+            continue
+        batch = _read_batch(name)
+        if batch["first"] > pos + 1:
+            # Lücke (Batches schon aufgeräumt) → jüngeren Schnappschuss nehmen, falls es einen gibt
+            if snaps and int(SNAPSHOT_RE.match(snaps[-1]).group(1)) > pos:
+                bootstrap(conn, snaps[-1])
+                return applied + apply_pending(conn)
+            raise RuntimeError(f"Replikationslücke: Position {pos}, nächster Batch beginnt bei {batch['first']}")
+        if batch["schema"] > current_version(conn):
+            print(f"[!] Replikation: Batch {name} hat Schema {batch['schema']} – Follower erst aktualisieren",
+                  file=sys.stderr, flush=True)
+            break
+        content |= _write(conn, lambda c: _apply(c, batch))
+        pos = batch["seq"]
+        applied += 1
+    if content:  # nur last_seen → wie beim Leader keine neue Generation (snapshot.SEEN_REFRESH_SEC)
+        bump_data_generation(conn)
+    _state["batches"] += applied
+    return applied
+
+
+# ------------------------------------------------------------
+# Hintergrund-Thread + Status
+# ------------------------------------------------------------
+def run_once() -> int:
+    """Ein Durchgang der Rolle; flock, damit mehrere Prozesse einer Instanz sich abwechseln."""
+    with open(DB_PATH + ".repl.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        conn = _connect()
+        try:
+            migrate(conn, DB_PATH)
+            return run_leader(conn) if ROLE == "leader" else apply_pending(conn)
+        finally:
+            conn.close()
+
+
+def _loop():
+    while True:
+        try:
+            run_once()
+            _state["last_error"] = None
+        except Exception as e:
+            _state["last_error"] = str(e)
+            print(f"[!] Replikation ({ROLE}): {e}", file=sys.stderr, flush=True)
+        _state["last_run"] = time.time()
+        time.sleep(INTERVAL_SEC)
+
+
+def start():
+    """Hintergrund-Thread starten (Leader: versenden, Follower: einspielen); sonst nichts."""
+    if ROLE not in ("leader", "follower"):
+        return
+    with _start_lock:
+        t = _state["thread"]
+        if _state["pid"] == os.getpid() and t is not None and t.is_alive():
+            return
+        _state["pid"] = os.getpid()
+        _state["thread"] = threading.Thread(target=_loop, name="replication", daemon=True)
+        _state["thread"].start()
+
+
+def status(conn) -> dict:
+    res = {"role": ROLE, "dir": None if REPL_URL and ROLE == "follower" else REPL_DIR,
+           "url": REPL_URL or None, "position": position(conn), "batches": _state["batches"],
+           "last_run": _state["last_run"], "last_error": _state["last_error"]}
+    if ROLE == "leader":
+        res["pending"] = conn.execute("SELECT COUNT(*) FROM repl_log").fetchone()[0]
+        res["position"] = conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'repl_log'").fetchone()
+        res["position"] = res["position"][0] if res["position"] else 0
+    return res
+
+
+def main():
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "status"
+    conn = _connect()
+    migrate(conn, DB_PATH)
+    setup(conn)
+    if cmd == "run":  # Dauerbetrieb ohne Web-App, z.B. neben runner.py auf dem Leader
+        conn.close()
+        if ROLE not in ("leader", "follower"):
+            sys.exit("AUTOS_ROLE=leader oder follower setzen")
+        _loop()
+    elif cmd == "ship":
+        print(f"{run_leader(conn)} Zeilenänderungen versandt")
+    elif cmd == "snapshot":
+        print(make_snapshot(conn))
+    elif cmd == "apply":
+        print(f"{apply_pending(conn)} Batches eingespielt")
+    else:
+        print(json.dumps(status(conn), indent=2))
+
+
+if __name__ == "__main__":
+    main()
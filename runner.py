@@ -1,10 +1,102 @@
+import os
+import math
 import time
 import subprocess
+from datetime import datetime, timezone
 
-INTERVAL_SEC = 30 * 60  # 30 Minuten
+from db import arrival_counts
 
-while True:
-    print("== Lauf startet ==")
-    subprocess.run(["python3", "scrape_ebay.py"], check=False)
-    print(f"== Pause {INTERVAL_SEC//60} min ==")
-    time.sleep(INTERVAL_SEC)
+INTERVAL_SEC = 30 * 60  # Fallback, solange keine Historie da ist
+
+# Ziel: mittlere Erkennungslatenz (Inserat erscheint → wir sehen es)
+TARGET_LATENCY_SEC = int(os.environ.get("RUNNER_TARGET_LATENCY_MIN", "10")) * 60
+# Budget: maximale Läufe pro Tag und Profil (≈ Upstream-Requests)
+MAX_RUNS_PER_DAY = int(os.environ.get("RUNNER_MAX_RUNS_PER_DAY", "96"))
+MIN_INTERVAL_SEC = 5 * 60
+MAX_INTERVAL_SEC = 2 * 60 * 60
+HISTORY_DAYS = 28
+MIN_ARRIVALS = 50         # darunter: festes Intervall
+MODEL_REFRESH_SEC = 60 * 60
+
+# Suchprofile: Name, Plattform (für die first_seen-Historie), Kommando
+PROFILES = [
+    {"name": "kleinanzeigen", "platform": "ebay-kleinanzeigen", "cmd": ["python3", "scrape_ebay.py"]},
+]
+
+
+class ArrivalModel:
+    """
+    Ankunftsraten je Wochen-Bucket (Wochentag, Stunde) aus first_seen.
+
+    Bei Poisson-Ankünften mit Rate λ und Abfrageintervall T ist die erwartete
+    Erkennungslatenz T/2. Minimiert man die Anzahl Läufe bei gegebener
+    (ankunftsgewichteter) Ziel-Latenz, ergibt sich T_b ∝ 1/√λ_b:
+    abends (viele neue Inserate) oft abfragen, nachts selten.
+    """
+
+    def __init__(self, platform: str):
+        self.platform = platform
+        self.intervals = {}
+        self.fitted_at = 0.0
+
+    def fit(self):
+        counts = arrival_counts(self.platform, HISTORY_DAYS)
+        self.fitted_at = time.monotonic()
+        self.intervals = {}
+        if sum(counts.values()) < MIN_ARRIVALS:
+            return
+
+        weeks = HISTORY_DAYS / 7.0
+        rates = {(wd, hh): counts.get((wd, hh), 0) / weeks  # Ankünfte pro Stunde
+                 for wd in range(7) for hh in range(24)}
+        total = sum(rates.values())
+        root_sum = sum(math.sqrt(l) for l in rates.values())
+
+        # T_b = k / √λ_b; k so, dass Σ λ_b·T_b/2 / Σ λ_b = Ziel-Latenz
+        k = 2.0 * TARGET_LATENCY_SEC * total / root_sum
+        # Budget: Läufe pro Woche = Σ 3600·√λ_b / k
+        runs_per_week = 3600.0 * root_sum / k
+        budget = MAX_RUNS_PER_DAY * 7
+        if runs_per_week > budget:
+            k *= runs_per_week / budget
+
+        for b, l in rates.items():
+            t = k / math.sqrt(l) if l > 0 else MAX_INTERVAL_SEC
+            self.intervals[b] = int(min(MAX_INTERVAL_SEC, max(MIN_INTERVAL_SEC, t)))
+
+    def interval(self, now: datetime) -> int:
+        if not self.fitted_at or (time.monotonic() - self.fitted_at) > MODEL_REFRESH_SEC:
+            try:
+                self.fit()
+            except Exception as e:
+                print(f"[WARN] Ankunftsmodell {self.platform}: {e}")
+        # strftime('%w') in SQLite: 0 = Sonntag
+        b = ((now.weekday() + 1) % 7, now.hour)
+        return self.intervals.get(b, INTERVAL_SEC)
+
+
+def main():
+    if os.environ.get("AUTOS_ROLE", "standalone").strip().lower() == "follower":
+        # Follower bekommen die Daten vom Leader (replication.py) – kein eigener Crawl
+        print("[i] AUTOS_ROLE=follower: runner.py scrapt nicht")
+        return
+    models = {p["name"]: ArrivalModel(p["platform"]) for p in PROFILES}
+    next_due = {p["name"]: 0.0 for p in PROFILES}
+
+    while True:
+        for p in PROFILES:
+            if time.time() < next_due[p["name"]]:
+                continue
+            print(f"== Lauf startet: {p['name']} ==")
+            # scrape_ebay.py nimmt selbst die Sync-Lease (db.sync_lease) – crawlt gerade ein
+            # Web-Worker oder ist der letzte Lauf keine 30 s her, endet es sofort
+            subprocess.run(p["cmd"], check=False)
+            iv = models[p["name"]].interval(datetime.now(timezone.utc))
+            next_due[p["name"]] = time.time() + iv
+            print(f"== {p['name']}: nächster Lauf in {iv // 60} min ==")
+
+        time.sleep(max(1.0, min(next_due.values()) - time.time()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 # scrape_ebay.py
 import re
 import time
+import heapq
 import requests
 from datetime import datetime, timedelta
 from bs4 import BeautifulSoup
-from db import init_db, upsert_listing
+from db import (init_db, upsert_listing, segment_key, segment_price_averages, push_price_limits,
+                load_checkpoint, save_checkpoint, clear_checkpoint,
+                existing_ids, record_discovered, record_enriched,
+                srp_hash, warm_srp_cache, remember_srp_hash, touch_listings, bump_data_generation,
+                sync_lease)
+from planner import plan_bands
 from typing import Optional, List, Dict, Tuple
 import os  # neu
 import json
@@ -364,8 +370,8 @@ def parse_article(article, base="https://www.kleinanzeigen.de"):
         "pics": pics,
     }
 
-def crawl_search_page(url: str) -> List[Dict]:
-    r = requests.get(url, headers=HEADERS, timeout=30)
+def crawl_search_page(url: str, timeout: float = 30) -> List[Dict]:
+    r = requests.get(url, headers=HEADERS, timeout=timeout)
     r.raise_for_status()
     soup = BeautifulSoup(r.text, "lxml")
     out = []
@@ -397,8 +403,8 @@ def _norm_int(s: Optional[str]) -> Optional[int]:
     s = re.sub(r"[^\d]", "", s or "")
     return int(s) if s else None
 
-def parse_detail_page(url: str) -> dict:
-    r = requests.get(url, headers=DETAIL_HEADERS, timeout=30)
+def parse_detail_page(url: str, timeout: float = 30) -> dict:
+    r = requests.get(url, headers=DETAIL_HEADERS, timeout=timeout)
     r.raise_for_status()
     soup = BeautifulSoup(r.text, "lxml")
 
@@ -480,10 +486,22 @@ def parse_detail_page(url: str) -> dict:
 # ------------------------------------------------------------
 # Such-URLs
 # ------------------------------------------------------------
-def build_ka_search_url(page: int = 1) -> str:
+def build_ka_search_url(page: int = 1, band: Optional[dict] = None) -> str:
+    """
+    Kleinanzeigen-SRP-URL. Ohne `band` die breite Standardsuche (KA_* aus der
+    Umgebung), mit `band` (price_min/price_max/km_max/ez_min/ez_max) eine
+    schmale Suche aus dem Filter-Pushdown.
+    """
     base = "https://www.kleinanzeigen.de/s-autos/"
     path = ""
 
+    if band is None:
+        band = {"price_min": KA_PRICE_MIN, "price_max": KA_PRICE_MAX, "km_max": KA_KM_MAX}
+
+    def v(k):
+        x = band.get(k)
+        return "" if x is None else str(x)
+
     # NEU: nur Privatverkäufer
     path += "anbieter:privat/"
 
@@ -491,17 +509,19 @@ def build_ka_search_url(page: int = 1) -> str:
         path += f"{KA_AREA_SLUG}/"
     path += "anzeige:angebote/"
 
-    if KA_PRICE_MIN or KA_PRICE_MAX:
-        path += f"preis:{KA_PRICE_MIN}:{KA_PRICE_MAX}/"
+    if v("price_min") or v("price_max"):
+        path += f"preis:{v('price_min')}:{v('price_max')}/"
 
     if page >= 2:
-        path += "seite:2/"
+        path += f"seite:{page}/"
 
     cblock = f"c216{KA_AREA_CODE}r{KA_RADIUS_KM}"
 
     parts = [cblock]
-    if KA_KM_MAX:
-        parts.append(f"autos.km_i:%2C{KA_KM_MAX}")
+    if v("km_max"):
+        parts.append(f"autos.km_i:%2C{v('km_max')}")
+    if v("ez_min") or v("ez_max"):
+        parts.append(f"autos.ez_i:{v('ez_min')}%2C{v('ez_max')}")
 
     return base + path + "+".join(parts)
 
@@ -509,40 +529,256 @@ def build_ka_search_url(page: int = 1) -> str:
 # Statt fixer Liste dynamisch Page 1 + 2
 SEARCH_URLS = [build_ka_search_url(1), build_ka_search_url(2)]
 
+# Seiten pro schmaler Pushdown-Suche (breite Suche: SEARCH_URLS)
+KA_PLAN_PAGES = int(os.environ.get("KA_PLAN_PAGES", "1"))
+KA_PUSHDOWN = os.environ.get("KA_PUSHDOWN", "1") == "1"
+
+
+def planned_search_urls() -> List[str]:
+    """
+    Filter-Pushdown: statt einer breiten Suche die abdeckenden schmalen Suchen
+    aus Push-Abos + Standardansicht (siehe planner.py). Ohne Abos: SEARCH_URLS.
+    """
+    if not KA_PUSHDOWN:
+        return SEARCH_URLS
+    outer = {"price_min": norm_int(KA_PRICE_MIN), "price_max": norm_int(KA_PRICE_MAX),
+             "km_max": norm_int(KA_KM_MAX)}
+    try:
+        bands = plan_bands(outer)
+    except Exception as e:
+        print(f"[WARN] Pushdown-Planung: {e}")
+        bands = []
+    if not bands:
+        return SEARCH_URLS
+    return [build_ka_search_url(p, b) for b in bands for p in range(1, KA_PLAN_PAGES + 1)]
+
+
+# ------------------------------------------------------------
+# Priorisierung der Detailseiten
+# ------------------------------------------------------------
+# Segment-Ø und Push-Preisgrenzen ändern sich langsam → kurz cachen,
+# damit nicht jeder Sync die ganze Tabelle aggregiert.
+PRIORITY_CACHE_TTL_SEC = 15 * 60
+_priority_cache = {"ts": 0.0, "segments": {}, "limits": []}
+
+
+def _priority_context() -> dict:
+    now = time.monotonic()
+    if not _priority_cache["ts"] or (now - _priority_cache["ts"]) > PRIORITY_CACHE_TTL_SEC:
+        _priority_cache["segments"] = segment_price_averages()
+        _priority_cache["limits"] = push_price_limits()
+        _priority_cache["ts"] = now
+    return _priority_cache
+
+
+def detail_priority(row: dict, ctx: dict) -> float:
+    """
+    Schätzt den Deal-Wert eines Listings nur aus SRP-Daten (höher = früher laden):
+    - Preis vs. Segment-Ø (EZ-Jahr + km-Klasse): bis zu ±50 Punkte
+    - Preis unter der Grenze eines Push-Abos: 20 Punkte
+    - Frische von posted_at: bis zu 30 Punkte
+    """
+    score = 0.0
+    price = row.get("price_eur")
+
+    avg = ctx["segments"].get(segment_key(row.get("ez_text"), row.get("km")))
+    if price and avg:
+        score += max(-0.5, min(0.5, avg / price - 1.0)) * 100
+
+    if price and any(price <= lim for lim in ctx["limits"]):
+        score += 20
+
+    posted = row.get("posted_at")
+    try:
+        age_h = (datetime.now() - datetime.strptime(posted, "%Y-%m-%d %H:%M")).total_seconds() / 3600
+    except (TypeError, ValueError):
+        age_h = None
+    if age_h is not None:
+        if age_h <= 1: score += 30
+        elif age_h <= 6: score += 20
+        elif age_h <= 24: score += 10
+
+    return score
+
+
+def fetch_details(row: dict, timeout: float = 30) -> int:
+    """Detailseite laden und ins Listing schreiben."""
+    det = parse_detail_page(row["url"], timeout=timeout)
+    if not det:
+        return 0
+    payload = {"id": row["id"], "platform": row.get("platform") or "ebay-kleinanzeigen", "url": row.get("url")}
+    if row.get("title"):
+        payload["title"] = row["title"]
+    payload.update(det)
+    return upsert_listing(payload)
+
 
 # ------------------------------------------------------------
 # Sync
 # ------------------------------------------------------------
-# ============================================================
-# ERSETZE in scrape_ebay.py die komplette sync_once() Funktion
-# (die alte Funktion löschen und diese einfügen)
-# ============================================================
+SYNC_PROFILE = "kleinanzeigen"
+# Erledigte SRP-Seiten gelten nur so lange (ab Beginn der Runde); offene Detailseiten bleiben immer
+CHECKPOINT_PAGES_MAX_AGE_SEC = 15 * 60
+# Fehlgeschlagene SRP-Seite (4xx, Sperre, Parser): erst nach Backoff wieder versuchen
+PAGE_RETRY_BASE_SEC = 60
+PAGE_RETRY_MAX_SEC = 60 * 60
+# Detailseite mit Fehler: in den nächsten Läufen erneut, nach so vielen Versuchen aufgeben
+DETAIL_MAX_ATTEMPTS = 3
+
+
+def _page_backoff(attempts: int) -> float:
+    return min(PAGE_RETRY_MAX_SEC, PAGE_RETRY_BASE_SEC * 2 ** (attempts - 1))
+
+
+def sync_once(budget_sec: Optional[float] = None) -> dict:
+    """
+    Schneller Sync: SRP scannen, nur NEUE/geänderte Listings detailliert laden.
+    Die Detailseiten werden nicht in SRP-Reihenfolge, sondern über eine
+    Priority-Queue (geschätzter Deal-Wert) abgearbeitet.
+
+    Mit `budget_sec` endet der Lauf spätestens nach dieser Zeit; der Stand
+    (erledigte Seiten, offene Detail-IDs) liegt in `crawl_checkpoint` und der
+    nächste Aufruf macht dort weiter. Ergebnis enthält dann "partial": True –
+    nur wenn das Zeitbudget aufgebraucht ist. Eine fehlerhafte Seite zählt als
+    versucht und kommt erst nach Backoff (`failed` im Checkpoint) wieder dran;
+    eine fehlerhafte Detailseite erst im nächsten Lauf (höchstens
+    DETAIL_MAX_ATTEMPTS-mal). Was nur am Budgetende abgebrochen wurde, bleibt offen.
+    """
+    deadline = time.monotonic() + budget_sec if budget_sec else None
+
+    def remaining() -> float:
+        return deadline - time.monotonic() if deadline else 30.0
+
+    def cut_by_budget(timeout: float) -> bool:
+        # Timeout war vom Restbudget gekürzt und das Budget ist jetzt weg → kein echter Fehler
+        return timeout < 30 and remaining() <= 1
+
+    state, age = load_checkpoint(SYNC_PROFILE)
+    state = state or {}
+    now = time.time()
+    pages_done = state.get("pages_done") or []
+    # Rundenbeginn statt updated_at: der Checkpoint wird bei jedem Aufruf neu geschrieben
+    round_ts = state.get("round_ts") or (now - age if age is not None else now)
+    if now - round_ts > CHECKPOINT_PAGES_MAX_AGE_SEC:
+        pages_done = []
+    if not pages_done:
+        round_ts = now
+    # url → [Fehlversuche, frühestens wieder (Epoch)]; bleibt über Runden hinweg erhalten
+    failed = state.get("failed") or {}
+    # Heap: [-priorität, reihenfolge, row]
+    queue = [tuple(e) for e in (state.get("pending") or [])]
+    heapq.heapify(queue)
+    tie = state.get("tie", len(queue))
+    resumed = bool(pages_done or queue)
+    retry = []  # Detailseiten mit Fehler: erst im nächsten Lauf wieder
+
+    def checkpoint():
+        save_checkpoint(SYNC_PROFILE, {"pages_done": pages_done, "pending": queue + retry, "tie": tie,
+                                       "round_ts": round_ts, "failed": failed})
 
-def sync_once() -> dict:
-    """Schneller Sync: SRP scannen, nur NEUE Listings detailliert laden."""
     seen = 0
     stored = 0
-    for url in SEARCH_URLS:
+    ctx = _priority_context()
+    hashes = warm_srp_cache()
+    urls = planned_search_urls()
+
+    for url in urls:
+        if url in pages_done:
+            continue
+        if url in failed and failed[url][1] > time.time():
+            pages_done.append(url)  # Backoff läuft noch → in dieser Runde als versucht
+            continue
+        if remaining() <= 1:
+            break
+        timeout = min(30, remaining())
         try:
-            rows = crawl_search_page(url)
+            rows = crawl_search_page(url, timeout=timeout)
             seen += len(rows)
+            # Bereits im Cache → existiert sicher; nur den Rest in der DB prüfen
+            known = {r["id"] for r in rows if r["id"] in hashes}
+            known |= existing_ids(r["id"] for r in rows if r["id"] not in known)
+            unchanged = []
+            page_stored = 0
             for row in rows:
+                h = srp_hash(row)
+                if hashes.get(row["id"]) == h:
+                    unchanged.append(row["id"])
+                    continue
+                row["srp_hash"] = h
                 changed = upsert_listing(row)
-                stored += changed
-                # Nur bei NEUEN Listings Detailseite laden
+                remember_srp_hash(row["id"], h)
+                page_stored += changed
                 if changed > 0 and row.get("url"):
-                    try:
-                        det = parse_detail_page(row["url"])
-                        if det:
-                            payload = {"id": row["id"], "platform": row.get("platform") or "ebay-kleinanzeigen", "url": row.get("url")}
-                            if row.get("title"):
-                                payload["title"] = row["title"]
-                            payload.update(det)
-                            upsert_listing(payload)
-                    except Exception as e:
-                        print(f"[WARN] Detail bei {row.get('id')}: {e}")
-                    time.sleep(0.8)
-            time.sleep(1)
+                    tie += 1
+                    heapq.heappush(queue, (-detail_priority(row, ctx), tie, row))
+            record_discovered([r for r in rows if r["id"] not in known], SYNC_PROFILE)
+            touch_listings(unchanged)
+            stored += page_stored
+            if page_stored:
+                bump_data_generation()
+            pages_done.append(url)
+            failed.pop(url, None)
+            checkpoint()
+            time.sleep(min(1, max(0, remaining())))
+        except Exception as e:
+            if cut_by_budget(timeout):
+                print(f"[i] {url} am Budgetende abgebrochen – bleibt offen: {e}")
+                break
+            attempts = (failed.get(url) or [0])[0] + 1
+            failed[url] = [attempts, time.time() + _page_backoff(attempts)]
+            pages_done.append(url)  # versucht – macht den Lauf nicht "partial"
+            checkpoint()
+            print(f"[WARN] Fehler bei {url} ({attempts}. Versuch, nächster in {_page_backoff(attempts):.0f}s): {e}")
+
+    order = []
+    enriched = 0
+    while queue and remaining() > 1:
+        entry = heapq.heappop(queue)
+        row = entry[2]
+        order.append(row["id"])
+        timeout = min(30, remaining())
+        try:
+            enriched += fetch_details(row, timeout=timeout)
+            record_enriched(row["id"])
         except Exception as e:
-            print(f"[WARN] Fehler bei {url}: {e}")
-    return {"seen": seen, "stored": stored}
+            if cut_by_budget(timeout):
+                heapq.heappush(queue, entry)  # nicht versucht → bleibt vorn in der Queue
+                break
+            attempts = row.get("detail_attempts", 0) + 1
+            if attempts < DETAIL_MAX_ATTEMPTS:
+                row["detail_attempts"] = attempts
+                retry.append(entry)
+            print(f"[WARN] Detail bei {row.get('id')} ({attempts}. Versuch"
+                  f"{'' if attempts < DETAIL_MAX_ATTEMPTS else ', aufgegeben'}): {e}")
+        checkpoint()
+        time.sleep(min(0.8, max(0, remaining())))
+    if enriched:
+        bump_data_generation()
+
+    # Nur das Zeitbudget macht einen Lauf unvollständig; Fehlerseiten stehen in pages_done,
+    # fehlerhafte Detailseiten in retry
+    partial = bool(queue) or any(u not in pages_done for u in urls)
+    failed = {u: f for u, f in failed.items() if u in urls}  # nicht mehr geplante Suchen vergessen
+    if partial:
+        checkpoint()
+    elif failed or retry:
+        # Runde fertig, nur Backoff der Fehlerseiten und Detail-Wiederholungen müssen bleiben
+        save_checkpoint(SYNC_PROFILE, {"failed": failed, "pending": retry, "tie": tie})
+    else:
+        clear_checkpoint(SYNC_PROFILE)
+
+    return {"seen": seen, "stored": stored, "priority_ids": order,
+            "partial": partial, "pending": len(queue), "resumed": resumed,
+            "failed_pages": len(failed), "detail_retries": len(retry)}
+
+
+if __name__ == "__main__":
+    init_db()
+    # Dieselbe Lease wie /api/sync (db.sync_lease) – runner.py startet uns, Web-Worker crawlen evtl. gerade
+    with sync_lease() as lease:
+        if lease is None:
+            print("[i] Sync läuft bereits oder ist gerade gelaufen – übersprungen")
+        else:
+            res = sync_once()
+            lease["completed"] = not res.get("partial")
+            print(res)
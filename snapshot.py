@@ -0,0 +1,321 @@
+# snapshot.py — spaltenweiser Schnappschuss der Listings (NumPy, mmap) für Filter, Zählung, Top-K
+#
+# Pro data_generation (meta-Tabelle, von Sync/Wartung hochgezählt) ein Verzeichnis mit
+# einer .npy-Datei je Spalte; alle Worker mappen dieselben Dateien read-only. Reines
+# last_seen-Auffrischen (db.touch_listings) zählt die Generation nicht hoch – dafür gilt ein
+# Schnappschuss nur für ein SEEN_REFRESH_SEC-Fenster von MAX(last_seen_ts). Der erste
+# Worker, der eine neue Generation sieht, baut sie unter einem flock – inkrementell aus
+# der vorigen: jede Änderung (upsert, touch) setzt last_seen, also reichen die Zeilen mit
+# last_seen_ts seit dem letzten Bau plus ein Abgleich der gelöschten ids.
+# SQLite wird danach nur noch für die sichtbaren Zeilen gefragt (app.fetch_page).
+#
+# Selbsttest (Blättern, während sich last_seen ändert):  python snapshot.py --check
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import fcntl
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # ohne numpy läuft alles wie bisher über SQLite
+    np = None
+
+DB_PATH = os.environ.get("AUTOS_DB", "autos.db")
+SNAPSHOT_DIR = os.environ.get("AUTOS_SNAPSHOT_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(DB_PATH)), "snapshot")
+FULL_REBUILD_SEC = 60 * 60   # spätestens dann komplett neu (fängt Änderungen ohne last_seen)
+SEEN_REFRESH_SEC = 5 * 60    # nur last_seen bewegt (touch) → höchstens so oft neu bauen
+KEEP_GENERATIONS = 2
+
+# Spalte → SQL-Ausdruck. Numerisch als float64: NULL wird NaN und fällt wie in SQL
+# aus jedem Vergleich heraus. PLZ wird per plz_key zur Zahl (Präfix → Zahlenbereich).
+COLUMNS = {
+    "price_eur": "price_eur",
+    "km": "km",
+    "ez_year": "ez_year",
+    "pics": "IFNULL(pics, 0)",
+    "posted_ts": "posted_ts",
+    "last_seen_ts": "last_seen_ts",
+    "plz": "postal_code",
+}
+PLZ_DIGITS = 5
+
+_state = {"snap": None}
+_lock = threading.Lock()
+
+
+def available() -> bool:
+    return np is not None
+
+
+def plz_key(code):
+    """PLZ aus bis zu 5 Ziffern → Zahl mit derselben Ordnung wie der Text (Basis 11,
+    fehlende Stelle < '0'), sonst None. So trifft ein Präfix auch kürzere Codes wie in SQL."""
+    if not code or not (code.isascii() and code.isdigit()) or len(code) > PLZ_DIGITS:
+        return None
+    k = 0
+    for i in range(PLZ_DIGITS):
+        k = k * 11 + (int(code[i]) + 1 if i < len(code) else 0)
+    return k
+
+
+def plz_range(prefix):
+    """(min, max) der plz_key-Werte aller Codes mit diesem Präfix, None wenn nicht abbildbar."""
+    lo = plz_key(prefix)
+    return None if lo is None else (lo, lo + 11 ** (PLZ_DIGITS - len(prefix)) - 1)
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.generation = self.meta["generation"]
+        self.key = (self.generation, self.meta.get("seen_stamp"))
+        self._orders = {}
+        self.cols = {c: np.load(os.path.join(path, f"{c}.npy"), mmap_mode="r")
+                     for c in ("id", "id_rank", *COLUMNS)}
+
+    def __len__(self):
+        return len(self.cols["id"])
+
+    def mask(self, ranges):
+        """ranges: {spalte: (min, max)} inklusiv, None = offen."""
+        m = np.ones(len(self), dtype=bool)
+        for col, (lo, hi) in ranges.items():
+            v = self.cols[col]
+            if lo is not None:
+                m &= v >= lo
+            if hi is not None:
+                m &= v <= hi
+        return m
+
+    def count(self, ranges) -> int:
+        return int(np.count_nonzero(self.mask(ranges)))
+
+    def _order(self, sort_col, desc):
+        """Sortierschlüssel + Gesamtreihenfolge je Sortierung, einmal pro Prozess und Generation.
+        Schlüssel so, dass aufsteigend = Leserichtung; NULL → +inf (ans Ende)."""
+        k = self._orders.get((sort_col, desc))
+        if k is None:
+            if sort_col:
+                p = np.asarray(self.cols[sort_col], dtype=np.float64)
+                p = np.where(np.isnan(p), np.inf, -p if desc else p)
+            else:
+                p = np.zeros(len(self))
+            ls = np.asarray(self.cols["last_seen_ts"], dtype=np.float64)
+            ls = np.where(np.isnan(ls), np.inf, -ls)
+            k = (p, ls, np.lexsort((-np.asarray(self.cols["id_rank"]), ls, p)))
+            self._orders[(sort_col, desc)] = k
+        return k
+
+    def page(self, ranges, sort_col, desc, key=None, before=False, limit=50):
+        """(ids, keys) der nächsten `limit` Zeilen in Leserichtung – gleiche Ordnung wie
+        app.sort_order_sql: NULLs ans Ende, dann last_seen_ts DESC, id DESC.
+        keys = Cursor-Schlüssel [Wert, last_seen_ts, id] aus DIESEM Schnappschuss: die Zeile
+        in SQLite kann schon neuer sein (touch_listings), der Cursor muss aber zur Ordnung
+        passen, in der die Seite entstanden ist – sonst springt er zurück an den Anfang."""
+        p, ls, order = self._order(sort_col, desc)
+        m = self.mask(ranges)
+        if key is not None:
+            v, lsv, lid = key
+            pv = 0.0 if not sort_col else np.inf if v is None else (-v if desc else v)
+            lsv = np.inf if lsv is None else -lsv
+            m &= (p < pv) | ((p == pv) & (ls < lsv)) if before else (p > pv) | ((p == pv) & (ls > lsv))
+            # Gleichstand in Wert und last_seen: id entscheidet (nur für diese wenigen Zeilen)
+            tie = np.flatnonzero((p == pv) & (ls == lsv))
+            if len(tie):
+                tid = self.cols["id"][tie]
+                lid = str(lid).encode()
+                m[tie] = self.mask(ranges)[tie] & ((tid > lid) if before else (tid < lid))
+        hits = order[m[order]]
+        hits = hits[::-1][:limit] if before else hits[:limit]
+        ids = [i.decode() for i in self.cols["id"][hits]]
+        vals = self.cols[sort_col][hits] if sort_col else [None] * len(hits)
+        keys = [[_num(v), _num(ls), i] for v, ls, i in zip(vals, self.cols["last_seen_ts"][hits], ids)]
+        return ids, keys
+
+
+def _num(v):
+    """float64 aus dem Schnappschuss → Wert wie aus SQLite (NaN → None, ganzzahlig → int)."""
+    if v is None or np.isnan(v):
+        return None
+    v = float(v)
+    return int(v) if v.is_integer() else v
+
+
+def _schema_version(conn) -> int:
+    return conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+
+
+def _fetch(conn, where="", args=()):
+    rows = conn.execute(f"SELECT id, {', '.join(COLUMNS.values())} FROM listings {where}", args).fetchall()
+    cols = {"id": np.array([str(r[0]).encode() for r in rows], dtype=bytes)}
+    for i, c in enumerate(COLUMNS, start=1):
+        conv = plz_key if c == "plz" else None
+        vals = (conv(r[i]) if conv else r[i] for r in rows)
+        cols[c] = np.array([np.nan if v is None else v for v in vals], dtype=np.float64)
+    return cols
+
+
+def _seen_stamp(conn) -> int:
+    """Fenster von MAX(last_seen_ts) – ein Seek in idx_listings_sort_seen; in allen Workern gleich."""
+    ls = conn.execute("SELECT MAX(last_seen_ts) FROM listings").fetchone()[0]
+    return int(ls or 0) // SEEN_REFRESH_SEC
+
+
+def _gen_dir(generation, stamp):
+    return os.path.join(SNAPSHOT_DIR, f"gen-{generation:08d}-{stamp:08d}")
+
+
+def _latest_dir():
+    gens = sorted(d for d in os.listdir(SNAPSHOT_DIR) if d.startswith("gen-") and "." not in d)
+    return os.path.join(SNAPSHOT_DIR, gens[-1]) if gens else None
+
+
+def _build(conn, generation, stamp):
+    t0 = time.time()
+    schema = _schema_version(conn)
+    base_path = _latest_dir()
+    base = Snapshot(base_path) if base_path else None
+    if base and base.meta["schema"] == schema and t0 - base.meta["full_ts"] < FULL_REBUILD_SEC:
+        changed = _fetch(conn, "WHERE last_seen_ts >= ?", (int(base.meta["built_ts"]) - 2, ))
+        alive = np.array([str(r[0]).encode() for r in conn.execute("SELECT id FROM listings")], dtype=bytes)
+        old_ids = base.cols["id"]
+        keep = np.isin(old_ids, alive) & ~np.isin(old_ids, changed["id"])
+        cols = {c: np.concatenate([np.asarray(base.cols[c])[keep], changed[c]]) for c in changed}
+        full_ts = base.meta["full_ts"]
+    else:
+        cols = _fetch(conn)
+        full_ts = t0
+
+    # Rang der id (SQLite vergleicht TEXT bytewise wie hier) für "id DESC" im lexsort
+    order = np.argsort(cols["id"], kind="stable")
+    cols["id_rank"] = np.empty(len(order), dtype=np.int64)
+    cols["id_rank"][order] = np.arange(len(order))
+
+    final = _gen_dir(generation, stamp)
+    tmp = f"{final}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    for c, arr in cols.items():
+        np.save(os.path.join(tmp, f"{c}.npy"), arr)
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({"generation": generation, "seen_stamp": stamp, "schema": schema,
+                   "built_ts": t0, "full_ts": full_ts,
+                   "rows": len(order), "incremental": full_ts != t0,
+                   "build_sec": round(time.time() - t0, 3)}, f)
+    os.rename(tmp, final)
+
+
+def _prune():
+    gens = sorted(d for d in os.listdir(SNAPSHOT_DIR) if d.startswith("gen-"))
+    done = [d for d in gens if "." not in d]
+    for d in gens:
+        # halbfertige Builds abgestürzter Worker und alte Generationen (schon gemappte bleiben lesbar)
+        if d not in done[-KEEP_GENERATIONS:]:
+            shutil.rmtree(os.path.join(SNAPSHOT_DIR, d), ignore_errors=True)
+
+
+def current(conn, generation: int):
+    """Schnappschuss zur Generation und zum last_seen-Fenster; baut ihn bei Bedarf (einmal je
+    Schlüssel, prozessübergreifend). Innerhalb eines Fensters kann last_seen in SQLite schon
+    neuer sein – die Cursor kommen deshalb aus dem Schnappschuss (Snapshot.page)."""
+    key = (generation, _seen_stamp(conn))
+    snap = _state["snap"]
+    if snap is not None and snap.key == key:
+        return snap
+    with _lock:
+        snap = _state["snap"]
+        if snap is not None and snap.key == key:
+            return snap
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        path = _gen_dir(*key)
+        if not os.path.isdir(path):
+            with open(os.path.join(SNAPSHOT_DIR, ".lock"), "w") as lockf:
+                fcntl.flock(lockf, fcntl.LOCK_EX)
+                try:
+                    if not os.path.isdir(path):
+                        _build(conn, *key)
+                        _prune()
+                finally:
+                    fcntl.flock(lockf, fcntl.LOCK_UN)
+        snap = Snapshot(path)
+        _state["snap"] = snap
+        return snap
+
+
+# ------------------------------------------------------------
+# Selbsttest: Keyset-Cursor über den Schnappschuss bei sich änderndem last_seen
+# ------------------------------------------------------------
+def check_paging(rows=40, per_page=5) -> list:
+    """/api/table?sort=seen_desc in einer Wegwerf-DB durchblättern und nach der zweiten Seite
+    last_seen der hinteren Hälfte ändern – einmal über db.touch_listings (gleiche Generation),
+    einmal direkt (Schnappschuss veraltet). Keine id darf doppelt kommen, das Blättern muss
+    enden. Gibt Fehlerbeschreibungen zurück, leer = OK."""
+    import tempfile
+    tmp = tempfile.mkdtemp(prefix="snapcheck-")
+    os.environ["AUTOS_DB"] = os.path.join(tmp, "autos.db")
+    os.environ["AUTOS_SNAPSHOT_DIR"] = os.path.join(tmp, "snapshot")
+    import app
+    import db
+
+    ids = [f"L{i:03d}" for i in range(rows)]
+    for i, lid in enumerate(ids):
+        db.upsert_listing({"id": lid, "platform": "ebay-kleinanzeigen", "url": f"https://example.invalid/{lid}",
+                           "title": f"Check {lid}", "price_eur": 1000, "km": 1000})
+    late = ids[rows // 2:]
+    errors = []
+    client = app.app.test_client()
+    try:
+        for mode in ("touch", "direkt"):
+            conn = db.get_conn()
+            # L000 zuletzt gesehen, L039 am längsten her
+            conn.executemany("UPDATE listings_data SET last_seen = datetime('now', ?) WHERE id = ?",
+                             [(f"-{i + 1} minutes", lid) for i, lid in enumerate(ids)])
+            db.bump_data_generation(conn)
+            conn.close()
+            seen, cursor = [], ""
+            for n in range(rows):
+                resp = client.get("/api/table", query_string={
+                    "sort": "seen_desc", "per_page": per_page, "cursor": cursor,
+                    "price_max": "", "ez_min": "", "km_max": ""})
+                page = list(dict.fromkeys(re.findall(r'data-row-id="([^"]+)"', resp.get_data(as_text=True))))
+                dup = [lid for lid in page if lid in seen]
+                if dup:
+                    errors.append(f"{mode}: Seite {n + 1} wiederholt {dup}")
+                    break
+                seen += page
+                if n == 1:
+                    if mode == "touch":
+                        db.touch_listings(late)
+                    else:
+                        conn = db.get_conn()
+                        conn.execute(f"UPDATE listings_data SET last_seen = datetime('now') "
+                                     f"WHERE id IN ({','.join('?' * len(late))})", late)
+                        conn.commit()
+                        conn.close()
+                cursor = resp.headers.get("X-Next-Cursor")
+                if not cursor:
+                    break
+            else:
+                errors.append(f"{mode}: nach {rows} Seiten noch kein Ende")
+            missing = [lid for lid in ids if lid not in seen and lid not in late]
+            if missing:
+                errors.append(f"{mode}: nie gezeigt {missing}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return errors
+
+
+if __name__ == "__main__":
+    if "--check" in sys.argv:
+        if np is None:
+            sys.exit("numpy fehlt – Schnappschuss ist aus")
+        errors = check_paging()
+        for e in errors:
+            print(f"[!] {e}")
+        print("Blättern mit Schnappschuss OK" if not errors else f"{len(errors)} Fehler")
+        sys.exit(1 if errors else 0)
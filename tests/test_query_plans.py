@@ -0,0 +1,58 @@
+# EXPLAIN QUERY PLAN für alle Listen-Abfragen aus app.build_query (siehe migrations.check_query_plans):
+# keine darf einen Temp-B-Tree zum Sortieren brauchen – weder auf leerer noch auf gefüllter DB.
+# Start: python -m pytest -q
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# app legt beim Import seine DB an – dafür eine Wegwerf-Datei statt autos.db
+os.environ["AUTOS_DB"] = os.path.join(tempfile.mkdtemp(prefix="plantest-"), "autos.db")
+
+import pytest  # noqa: E402
+
+from migrations import check_query_plans, migrate  # noqa: E402
+
+
+def _fresh_db(path):
+    conn = sqlite3.connect(str(path), isolation_level=None)
+    migrate(conn)
+    return conn
+
+
+def _fill(conn, n=5000):
+    """Zufällige Listings, ein Teil ohne Preis/km/Inserat-Datum (NULL-Gruppen), dann ANALYZE."""
+    r = random.Random(1)
+    rows = [(f"L{i:06d}", f"https://example.invalid/{i}", f"{r.choice(['Golf', 'Polo', 'Astra'])} {i}",
+             None if r.random() < .05 else r.randint(300, 40000),
+             None if r.random() < .1 else r.randint(0, 300000),
+             str(r.randint(80000, 99999)), r.randint(0, 20),
+             None if r.random() < .2 else f"2026-{r.randint(1, 9):02d}-{r.randint(1, 28):02d} 10:00:00",
+             f"2026-10-{r.randint(1, 19):02d} {r.randint(0, 23):02d}:{r.randint(0, 59):02d}:00",
+             r.randint(1995, 2024))
+            for i in range(n)]
+    conn.execute("BEGIN")
+    conn.executemany("""INSERT INTO listings_data(id, url, title, price_eur, km, postal_code, pics,
+                                                  posted_at, last_seen, ez_year)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+    conn.execute("COMMIT")
+    conn.execute("ANALYZE")
+
+
+def _describe(bad):
+    return "\n".join(f"{params}\n    " + "\n    ".join(plan) for params, plan in bad)
+
+
+@pytest.mark.parametrize("filled", [False, True], ids=["leer", "gefuellt"])
+def test_listing_queries_use_sort_index(tmp_path, filled):
+    conn = _fresh_db(tmp_path / "autos.db")
+    try:
+        if filled:
+            _fill(conn)
+        bad = check_query_plans(conn)
+    finally:
+        conn.close()
+    assert not bad, f"{len(bad)} Abfragen mit Temp-B-Tree:\n" + _describe(bad)
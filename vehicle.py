@@ -0,0 +1,78 @@
+# vehicle.py — Normalisierung von Fahrzeugdaten (plattformübergreifend)
+import re
+import hashlib
+
+_MONTHS_DE = {
+    "januar": 1, "jan": 1, "februar": 2, "feb": 2, "märz": 3, "maerz": 3, "mär": 3, "mrz": 3,
+    "april": 4, "apr": 4, "mai": 5, "juni": 6, "jun": 6, "juli": 7, "jul": 7,
+    "august": 8, "aug": 8, "september": 9, "sep": 9, "sept": 9, "oktober": 10, "okt": 10,
+    "november": 11, "nov": 11, "dezember": 12, "dez": 12,
+}
+
+FP_KM_ROUND = 5000
+
+
+def _val(r, k):
+    try: return r[k]
+    except Exception: return None
+
+
+def _slug(v) -> str:
+    v = (v or "").lower()
+    v = re.sub(r"[^a-z0-9äöüß]+", "", v)
+    return v
+
+
+def _parse_reg(s: str):
+    s = (s or "").strip().lower()
+    m = re.search(r"(\d{4})-(\d{1,2})", s)
+    if m and 1 <= int(m.group(2)) <= 12:
+        return int(m.group(1)), int(m.group(2))
+    m = re.search(r"(\d{1,2})\s*[/.]\s*(\d{4})", s)
+    if m and 1 <= int(m.group(1)) <= 12:
+        return int(m.group(2)), int(m.group(1))
+    m = re.search(r"([a-zäöü]+)\.?\s+(\d{4})", s)
+    if m and m.group(1) in _MONTHS_DE:
+        return int(m.group(2)), _MONTHS_DE[m.group(1)]
+    m = re.search(r"(19\d{2}|20\d{2})", s)
+    return (int(m.group(1)), None) if m else (None, None)
+
+
+def parse_registration(first_reg=None, ez_text=None):
+    """
+    Erstzulassung → (jahr, monat). first_reg (Detailseite) hat Vorrang vor
+    ez_text (SRP). '05/2015', '2015-05', 'Mai 2015', '2015' → (2015, 5|None).
+    Gemeinsamer Parser für Ingest (ez_year/ez_month), Push-Filter und Links.
+    """
+    year, month = _parse_reg(first_reg)
+    if year is None:
+        year, month = _parse_reg(ez_text)
+    return year, month
+
+
+def _reg_month(r):
+    year, month = parse_registration(_val(r, "first_reg"), _val(r, "ez_text"))
+    if year is None:
+        return None
+    return f"{year:04d}-{month:02d}" if month else f"{year:04d}"
+
+
+def vehicle_fingerprint(r):
+    """
+    Normalisierter Fahrzeug-Fingerprint: Marke, Modell, EZ-Monat, km (gerundet),
+    PS und PLZ. Gleiches Auto auf verschiedenen Plattformen bzw. neu eingestellt
+    ergibt denselben Wert. None, wenn Marke/Modell/EZ fehlen.
+    """
+    brand = _slug(_val(r, "brand"))
+    model = _slug(_val(r, "model"))
+    reg = _reg_month(r)
+    if not brand or not model or not reg:
+        return None
+
+    km = _val(r, "km")
+    km = int(round(km / FP_KM_ROUND)) * FP_KM_ROUND if isinstance(km, int) else ""
+    ps = _val(r, "power_ps") or ""
+    plz = (_val(r, "postal_code") or "").strip()
+
+    key = f"{brand}|{model}|{reg}|{km}|{ps}|{plz}"
+    return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
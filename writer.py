@@ -0,0 +1,121 @@
+# writer.py — ein Schreib-Thread pro Prozess für die kleinen Schreibzugriffe der Web-App
+#
+# Favoriten, Push-Abos, mobile.de-Preise, Deal-Score-Cache und push_sent haben bisher je
+# eine eigene Verbindung geöffnet und committet – parallel zu den Einzel-Commits des
+# Scrapers, mit "database is locked" als Folge. Jetzt landen sie in einer begrenzten Queue;
+# der Writer-Thread nimmt alles, was gerade ansteht, und schreibt es in EINER Transaktion
+# (ein fsync für viele Aufträge). Jeder Auftrag läuft in einem eigenen Savepoint, ein
+# Fehler trifft also nur sein eigenes Future.
+#
+#   writer.execute(DB_PATH, "DELETE FROM favorites WHERE listing_id=?", (lid, )).result(5)
+#   writer.submit(DB_PATH, fn, arg)   # fn(conn, arg) im Writer-Thread, Future ohne Warten
+import os
+import sys
+import queue
+import threading
+from concurrent.futures import Future
+
+import dbpool
+
+QUEUE_MAX = int(os.environ.get("AUTOS_WRITE_QUEUE", "1000"))
+BATCH_MAX = int(os.environ.get("AUTOS_WRITE_BATCH", "200"))
+PUT_TIMEOUT_SEC = 5.0   # Queue voll → Aufrufer wartet so lange, dann queue.Full
+RESULT_TIMEOUT_SEC = 10.0
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class Writer:
+    def __init__(self, path):
+        self.path = path
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {"jobs": 0, "failed": 0, "batches": 0, "max_batch": 0}
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            # erster Aufruf oder nach fork(): Thread und Queue gibt es im Kind nicht
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=QUEUE_MAX)
+            self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, fn, *args) -> Future:
+        """fn(conn, *args) im Writer-Thread ausführen; Ergebnis/Fehler über das Future."""
+        self._ensure_thread()
+        fut = Future()
+        self._queue.put((fut, fn, args), timeout=PUT_TIMEOUT_SEC)
+        return fut
+
+    def _run(self):
+        q = self._queue
+        conn = dbpool.connect(self.path)
+        while True:
+            batch = [q.get()]
+            while len(batch) < BATCH_MAX:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(conn, batch)
+
+    def _commit(self, conn, batch):
+        done = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fut, fn, args in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT job")
+                try:
+                    done.append((fut, fn(conn, *args), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    done.append((fut, None, e))
+                conn.execute("RELEASE job")
+            conn.commit()
+        except Exception as e:
+            # Commit selbst gescheitert (z.B. busy_timeout) → alle Aufträge des Batches
+            print(f"[!] Writer: Batch mit {len(batch)} Aufträgen verworfen: {e}", file=sys.stderr, flush=True)
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            done = [(fut, None, e) for fut, _, _ in batch if fut.running()]
+        self.stats["jobs"] += len(done)
+        self.stats["batches"] += 1
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+        for fut, res, e in done:
+            if e is not None:
+                self.stats["failed"] += 1
+                fut.set_exception(e)
+            else:
+                fut.set_result(res)
+
+
+def _writer(path) -> Writer:
+    with _writers_lock:
+        w = _writers.get(path)
+        if w is None:
+            w = _writers[path] = Writer(path)
+        return w
+
+
+def submit(path, fn, *args) -> Future:
+    return _writer(path).submit(fn, *args)
+
+
+def execute(path, sql, args=()) -> Future:
+    """Ein Statement über den Writer; das Future liefert rowcount."""
+    return submit(path, lambda conn: conn.execute(sql, args).rowcount)
+
+
+def writer_stats() -> dict:
+    with _writers_lock:
+        writers = dict(_writers)
+    return {path: dict(w.stats, queued=w._queue.qsize() if w._queue else 0) for path, w in writers.items()}